@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Worker utilization of synchronous successive halving against asynchronous successive halving (ASHA)
+when the trial durations are heterogeneous. Utilization is the busy time of all the runs divided by
+``n_jobs`` times the wall time, the same data ``FMinResult.plot_concurrent_over_time`` draws.
+'''
+import zlib
+from time import perf_counter, sleep
+
+import click
+import numpy as np
+
+from ultraopt import fmin
+from ultraopt.multi_fidelity import SuccessiveHalvingIterGenerator, AsyncSuccessiveHalvingIterGenerator
+from ultraopt.tests.mock import config_space
+
+
+def evaluate(config: dict, budget=100):
+    # duration proportional to the budget, times a log-normal factor that depends on the config
+    rng = np.random.RandomState(zlib.crc32(str(sorted(config.items())).encode()))
+    sleep(0.2 * budget / 25 * rng.lognormal(0, 0.75))
+    return float(sum(config.values())) / budget
+
+
+def get_utilization(ret, n_jobs):
+    data = np.array([[info["start_time"], info["end_time"]] for info in ret.optimizer.runId2info.values()])
+    return (data[:, 1] - data[:, 0]).sum() / (n_jobs * (data[:, 1].max() - data[:, 0].min()))
+
+
+@click.command()
+@click.option('--n-iterations', '-n', default=16)
+@click.option('--n-jobs', '-j', default=4)
+@click.option('--eta', '-e', default=3)
+def main(n_iterations, n_jobs, eta):
+    for iter_generator in [SuccessiveHalvingIterGenerator(25 / 9, 25, eta),
+                           AsyncSuccessiveHalvingIterGenerator(25 / 9, 25, eta)]:
+        start = perf_counter()
+        ret = fmin(evaluate, config_space, "Random", n_iterations=n_iterations, n_jobs=n_jobs,
+                   parallel_strategy="ProcessPool", multi_fidelity_iter_generator=iter_generator,
+                   show_progressbar=False)
+        cost = perf_counter() - start
+        print(f"{iter_generator.__class__.__name__:>36}: {cost:.2f}s, "
+              f"utilization {get_utilization(ret, n_jobs):.1%}")
+
+
+if __name__ == '__main__':
+    main()
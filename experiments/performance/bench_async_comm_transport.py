@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Per-trial overhead of the AsyncComm strategy with the Pyro4 transport (nameserver, discovery,
+one RPC per job) and with the multiprocessing.connection transport (push-based, prefetching),
+for a sub-millisecond objective.
+'''
+from time import perf_counter
+
+import click
+
+from ultraopt import fmin
+from ultraopt.tests.mock import evaluate, config_space
+
+
+@click.command()
+@click.option('--n-iterations', '-n', default=500)
+@click.option('--n-jobs', '-j', default=4)
+@click.option('--optimizer', '-o', default="Random")
+def main(n_iterations, n_jobs, optimizer):
+    print(f"n_iterations={n_iterations}, n_jobs={n_jobs}, optimizer={optimizer}")
+    for transport, n_prefetch in [("Pyro4", 1), ("Connection", 1), ("Connection", 4)]:
+        start = perf_counter()
+        fmin(evaluate, config_space, optimizer, n_iterations=n_iterations, n_jobs=n_jobs,
+             parallel_strategy="AsyncComm", transport=transport, n_prefetch=n_prefetch, show_progressbar=False)
+        cost = perf_counter() - start
+        print(f"{transport:>10} (prefetch {n_prefetch}): {cost:.2f}s, {cost / n_iterations * 1e3:.2f}ms per trial")
+
+
+if __name__ == '__main__':
+    main()
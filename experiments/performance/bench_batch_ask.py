@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Latency of a batch ``ask(n_points=k)`` after a long run: constant liar for ETPE and Forest,
+and the diversified KDE sampling of ETPE.
+'''
+from time import perf_counter
+
+import click
+import numpy as np
+
+from ultraopt.optimizer import ETPEOptimizer, ForestOptimizer
+from ultraopt.tests.mock import config_space, evaluate
+
+
+@click.command()
+@click.option('--n-obvs', '-n', default=5000)
+@click.option('--n-points', '-k', default=32)
+@click.option('--repeat', '-r', default=3)
+def main(n_obvs, n_points, repeat):
+    print(f"n_obvs={n_obvs}, n_points={n_points}")
+    for optimizer_cls, strategy in [(ETPEOptimizer, "diversified"), (ETPEOptimizer, "cl_min"),
+                                    (ForestOptimizer, "cl_min")]:
+        opt = optimizer_cls()
+        opt.initialize(config_space)
+        configs = config_space.sample_configuration(n_obvs)
+        for i, config in enumerate(configs):
+            opt.register_config(config.get_dictionary(), 1)
+            opt.tell(config, evaluate(config.get_dictionary()), update_model=i == n_obvs - 1)
+        costs = []
+        for _ in range(repeat):
+            start = perf_counter()
+            config_info_pairs = opt.ask(n_points=n_points, strategy=strategy)
+            costs.append(perf_counter() - start)
+            for config, _ in config_info_pairs:
+                opt.tell(config, evaluate(config))
+        print(f"{optimizer_cls.__name__:>16} {strategy:>12}: batch ask median {np.median(costs):.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+``ConfigEvaluator.calc_weight`` latency for n observations and several budgets,
+with the batched ranking loss (random search / coarse-to-fine) and with the former
+one-weight-at-a-time loop.
+'''
+from time import perf_counter
+
+import click
+import numpy as np
+from skopt.learning.forest import ExtraTreesRegressor
+
+from ultraopt.optimizer.bo.config_evaluator import ConfigEvaluator
+
+
+def legacy_calc_weight(config_evaluator, X_test, y_test):
+    outputs = np.vstack([epm.predict(X_test)[None, :] for epm in config_evaluator.budget2epm.values()])
+
+    def objective(w):
+        output = (outputs * np.array(w)[:, None]).sum(axis=0)[None, :]
+        label = y_test[None, :]
+        return np.count_nonzero(np.logical_xor((output < output.T), (label < label.T)))
+
+    weights = config_evaluator.sample_weights(10000, outputs.shape[0])
+    w = weights[np.argmin([objective(w) for w in weights])]
+    return dict(zip(config_evaluator.budget2epm.keys(), w / np.sum(w)))
+
+
+@click.command()
+@click.option('--n-obvs', '-n', default=500)
+@click.option('--n-budgets', '-b', default=5)
+@click.option('--n-dims', '-d', default=10)
+def main(n_obvs, n_budgets, n_dims):
+    rng = np.random.RandomState(0)
+    X = rng.rand(n_obvs, n_dims)
+    y = np.sum((X - 0.5) ** 2, axis=1)
+    budgets = [1 / 3 ** i for i in reversed(range(n_budgets))]
+    budget2epm = {}
+    for budget in budgets:
+        epm = ExtraTreesRegressor(n_estimators=10, random_state=0)
+        epm.fit(X, y + rng.normal(0, 1 - budget, n_obvs) * 0.1)
+        budget2epm[budget] = epm
+    print(f"n_obvs={n_obvs}, n_budgets={n_budgets}")
+    for method in ["random", "coarse_to_fine", "legacy"]:
+        weight_search = "random" if method == "legacy" else method
+        config_evaluator = ConfigEvaluator(budget2epm, budgets[-1], weight_search=weight_search)
+        start = perf_counter()
+        if method == "legacy":
+            budget2weight = legacy_calc_weight(config_evaluator, X, y)
+        else:
+            budget2weight = config_evaluator.calc_weight(X, y)
+        cost = perf_counter() - start
+        weights = np.round(list(budget2weight.values()), 3)
+        print(f"{method:>15}: {cost:.2f}s  weights = {weights}")
+
+
+if __name__ == '__main__':
+    main()
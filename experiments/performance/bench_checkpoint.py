@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Time the caller is blocked to checkpoint one result, for growing histories: ``dump_checkpoint``
+(joblib dump of the whole optimizer) against ``Checkpointer.log_result`` (one JSON line queued for
+the background thread) and ``Checkpointer.snapshot`` (in memory dump, written in the background).
+'''
+import os
+import tempfile
+from time import perf_counter
+
+import click
+
+from ultraopt.optimizer import ETPEOptimizer
+from ultraopt.tests.mock import evaluate, config_space
+from ultraopt.utils.checkpoint import Checkpointer
+from ultraopt.utils.misc import dump_checkpoint
+
+
+@click.command()
+@click.option('--n-repeats', '-r', default=20)
+def main(n_repeats):
+    checkpoint_file = os.path.join(tempfile.mkdtemp(), "checkpoint.pkl")
+    opt = ETPEOptimizer()
+    opt.initialize(config_space)
+    checkpointer = Checkpointer(opt, checkpoint_file)
+    n_obvs = 0
+    for n_history in [100, 1000, 5000]:
+        while n_obvs < n_history:
+            config, _ = opt.ask()
+            opt.tell(config, evaluate(config), update_model=(n_obvs == n_history - 1))
+            n_obvs += 1
+        checkpointer.flush()
+        config = opt.budget2obvs[1]["configs"][-1].get_dictionary()
+        timings = {}
+        for name, func in [
+            ("dump_checkpoint", lambda: dump_checkpoint(opt, checkpoint_file + ".old")),
+            ("log_result", lambda: checkpointer.log_result(config, 1, {"loss": 0.5})),
+            ("snapshot", checkpointer.snapshot),
+        ]:
+            start = perf_counter()
+            for _ in range(n_repeats):
+                func()
+            timings[name] = (perf_counter() - start) / n_repeats
+            checkpointer.flush()
+        print(f"history {n_history:>5}: " +
+              ", ".join(f"{name} {cost * 1e3:.3f}ms" for name, cost in timings.items()))
+    checkpointer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Saving, loading and warm starting from a large result: a joblib dump of the optimizer against the
+columnar format of ``FMinResult.save`` (memory-mapped ``.npy`` columns).
+'''
+import os
+import tempfile
+from time import perf_counter
+
+import click
+from joblib import dump, load
+
+from ultraopt import fmin, FMinResult
+from ultraopt.optimizer import RandomOptimizer
+from ultraopt.tests.mock import evaluate, config_space
+from ultraopt.utils.columnar import save_columnar
+
+
+def timeit(func):
+    start = perf_counter()
+    result = func()
+    return perf_counter() - start, result
+
+
+@click.command()
+@click.option('--n-trials', '-n', default=20000)
+def main(n_trials):
+    opt = RandomOptimizer()
+    opt.initialize(config_space)
+    obvs = opt.budget2obvs[1]
+    for config in config_space.sample_configuration(n_trials):
+        config.origin = "Random Search"
+        obvs.append(config, config.get_array(), evaluate(config.get_dictionary()))
+        opt.register_config(config.get_dictionary(), 1)
+    directory = tempfile.mkdtemp()
+    pkl_file = os.path.join(directory, "optimizer.pkl")
+    columnar_dir = os.path.join(directory, "columnar")
+    print(f"n_trials={n_trials}")
+    print(f"joblib dump       : {timeit(lambda: dump(opt, pkl_file))[0]:.3f}s")
+    print(f"columnar save     : {timeit(lambda: save_columnar(columnar_dir, opt))[0]:.3f}s")
+    print(f"joblib load       : {timeit(lambda: FMinResult(load(pkl_file)))[0]:.3f}s")
+    cost, result = timeit(lambda: FMinResult.load(columnar_dir))
+    print(f"columnar load     : {cost:.3f}s (best loss {result.best_loss:.4f})")
+    for name, previous_result in [("joblib", pkl_file), ("columnar", columnar_dir)]:
+        cost, _ = timeit(lambda: fmin(evaluate, config_space, "Random", n_iterations=1,
+                                      previous_result=previous_result, show_progressbar=False))
+        print(f"{name + ' warm start':<18}: {cost:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Throughput of the config IDs (the keys of ``runId2info``) on a large HDL config space:
+the MD5 of the sorted dict against the vector keyed ``get_hash_of_config``, for dicts,
+for ``Configuration`` objects and for a batch of vectors.
+'''
+from time import perf_counter
+
+import click
+
+from ultraopt.hdl import hdl2cs
+from ultraopt.utils.hash import get_hash_of_config, get_hash_of_dict, get_hashes_of_vectors
+
+HDL = {
+    "preprocessing(choice)": {
+        "scaler": {"with_mean": {"_type": "choice", "_value": [True, False]}},
+        "pca": {
+            "n_components": {"_type": "uniform", "_value": [0.5, 0.99]},
+            "whiten": {"_type": "choice", "_value": [True, False]},
+        },
+    },
+    "model(choice)": {
+        "svc": {
+            "C": {"_type": "loguniform", "_value": [0.01, 10000]},
+            "kernel": {"_type": "choice", "_value": ["rbf", "poly", "sigmoid"]},
+            "degree": {"_type": "int_uniform", "_value": [2, 5]},
+            "gamma": {"_type": "loguniform", "_value": [1e-5, 10]},
+            "coef0": {"_type": "quniform", "_value": [-1, 1]},
+            "__activate": {"kernel": {"sigmoid": ["coef0"], "poly": ["degree", "coef0"]}},
+        },
+        "gbdt": {
+            "n_estimators": {"_type": "int_quniform", "_value": [10, 1000, 10]},
+            "learning_rate": {"_type": "loguniform", "_value": [1e-3, 1]},
+            "max_depth": {"_type": "int_uniform", "_value": [1, 12]},
+            "subsample": {"_type": "uniform", "_value": [0.1, 1]},
+            "min_samples_leaf": {"_type": "int_uniform", "_value": [1, 50]},
+            "max_features": {"_type": "uniform", "_value": [0.1, 1]},
+        },
+        "random_forest": {
+            "n_estimators": {"_type": "int_quniform", "_value": [10, 1000, 10]},
+            "criterion": {"_type": "choice", "_value": ["gini", "entropy"]},
+            "max_features": {"_type": "uniform", "_value": [0.1, 1]},
+            "min_samples_split": {"_type": "int_uniform", "_value": [2, 20]},
+            "min_samples_leaf": {"_type": "int_uniform", "_value": [1, 20]},
+            "bootstrap": {"_type": "choice", "_value": [True, False]},
+        },
+    }
+}
+
+
+def throughput(func, items):
+    start = perf_counter()
+    func(items)
+    return len(items) / (perf_counter() - start)
+
+
+@click.command()
+@click.option('--n-configs', '-n', default=20000)
+def main(n_configs):
+    config_space = hdl2cs(HDL)
+    configs = config_space.sample_configuration(n_configs)
+    dicts = [config.get_dictionary() for config in configs]
+    vectors = [config.get_array() for config in configs]
+    print(f"{len(config_space.get_hyperparameters())} hyperparameters, {n_configs} configs")
+    for name, func, items in [
+        ("md5 of the sorted dict", lambda items: [get_hash_of_dict(item) for item in items], dicts),
+        ("vector keyed, dict", lambda items: [get_hash_of_config(item, config_space) for item in items], dicts),
+        ("vector keyed, Configuration", lambda items: [get_hash_of_config(item) for item in items], configs),
+        ("vector keyed, batch of vectors", lambda items: get_hashes_of_vectors(items, config_space), vectors),
+    ]:
+        print(f"{name:<31}: {throughput(func, items):>10.0f} configs/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+fit + predict + sample latency of TreeParzenEstimator with the NumPy KDE backend
+and with sklearn's KernelDensity.
+'''
+from time import perf_counter
+
+import click
+import numpy as np
+from ConfigSpace import ConfigurationSpace
+from ConfigSpace.hyperparameters import UniformFloatHyperparameter
+
+from ultraopt.learning.tpe import TreeParzenEstimator
+from ultraopt.utils.config_transformer import ConfigTransformer
+
+
+def timeit(func, repeat):
+    costs = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        costs.append(perf_counter() - start)
+    return np.median(costs) * 1e3
+
+
+@click.command()
+@click.option('--n-obvs', '-n', default=200)
+@click.option('--n-dims', '-d', default=10)
+@click.option('--n-candidates', '-c', default=100)
+@click.option('--repeat', '-r', default=20)
+def main(n_obvs, n_dims, n_candidates, repeat):
+    cs = ConfigurationSpace()
+    for i in range(n_dims):
+        cs.add_hyperparameter(UniformFloatHyperparameter(f"x{i}", -5, 5))
+    config_transformer = ConfigTransformer(impute=None, encoder=None)
+    config_transformer.fit(cs)
+    rng = np.random.RandomState(0)
+    X = config_transformer.transform(np.array([config.get_array() for config in cs.sample_configuration(n_obvs)]))
+    y = rng.rand(n_obvs)
+    X_cand = config_transformer.transform(
+        np.array([config.get_array() for config in cs.sample_configuration(n_candidates * 10)]))
+    print(f"n_obvs={n_obvs}, n_dims={n_dims}, n_candidates={n_candidates}")
+    print(f"{'backend':>8} {'fit(ms)':>9} {'predict(ms)':>12} {'sample(ms)':>11}")
+    for backend in ["sklearn", "numpy"]:
+        tpe = TreeParzenEstimator(kde_backend=backend)
+        tpe.set_config_transformer(config_transformer)
+        fit_cost = timeit(lambda: tpe.fit(X, y), repeat)
+        predict_cost = timeit(lambda: tpe.predict(X_cand), repeat)
+        sample_cost = timeit(lambda: tpe.sample(n_candidates, sort_by_EI=True, random_state=rng), repeat)
+        print(f"{backend:>8} {fit_cost:>9.2f} {predict_cost:>12.2f} {sample_cost:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
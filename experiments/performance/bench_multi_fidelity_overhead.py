@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Per-trial overhead of Hyperband on a fast synthetic objective (MultiFidelityRosenbrock2D):
+the in-process IterationScheduler (Serial, MapReduce, ProcessPool strategies) against the
+nameserver + dispatcher + RPC path of the AsyncComm strategy.
+'''
+from time import perf_counter
+
+import click
+
+from ultraopt import fmin
+from ultraopt.multi_fidelity import HyperBandIterGenerator
+from ultraopt.tests.mock import evaluate, config_space
+
+
+@click.command()
+@click.option('--n-iterations', '-n', default=12)
+@click.option('--n-jobs', '-j', default=1)
+@click.option('--optimizer', '-o', default="Random")
+def main(n_iterations, n_jobs, optimizer):
+    iter_generator = HyperBandIterGenerator(25, 100, 2)
+    n_trials = iter_generator.num_all_configs(n_iterations)
+    print(f"n_trials={n_trials}, n_jobs={n_jobs}, optimizer={optimizer}")
+    for parallel_strategy in ["Serial", "MapReduce", "ProcessPool", "AsyncComm"]:
+        if parallel_strategy == "Serial" and n_jobs > 1:
+            continue
+        start = perf_counter()
+        fmin(evaluate, config_space, optimizer, n_iterations=n_iterations, n_jobs=n_jobs,
+             parallel_strategy=parallel_strategy, auto_identify_serial_strategy=False,
+             multi_fidelity_iter_generator=iter_generator, show_progressbar=False)
+        cost = perf_counter() - start
+        print(f"{parallel_strategy:>12}: {cost:.2f}s, {cost / n_trials * 1e3:.2f}ms per trial")
+
+
+if __name__ == '__main__':
+    main()
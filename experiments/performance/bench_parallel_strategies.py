@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Wall time of ``fmin`` with the MapReduce and ProcessPool parallel strategies, for an
+evaluation function whose cost is heterogeneous (1 call in 5 is 10x slower).
+MapReduce waits for the slowest evaluation of every batch, ProcessPool keeps all the workers busy.
+'''
+from time import perf_counter, sleep
+
+import click
+
+from ultraopt import fmin
+from ultraopt.tests.mock import config_space
+
+dataset = None
+
+
+def load_dataset(n_rows):
+    # runs once in each worker of the ProcessPool strategy
+    global dataset
+    dataset = list(range(n_rows))
+
+
+def evaluate(config):
+    duration = 0.2 if hash(str(sorted(config.items()))) % 5 == 0 else 0.02
+    sleep(duration)
+    return sum(config.values())
+
+
+@click.command()
+@click.option('--n-iterations', '-n', default=160)
+@click.option('--n-jobs', '-j', default=8)
+@click.option('--optimizer', '-o', default="ETPE")
+def main(n_iterations, n_jobs, optimizer):
+    for parallel_strategy in ["MapReduce", "ProcessPool"]:
+        start = perf_counter()
+        fmin(evaluate, config_space, optimizer, n_iterations=n_iterations, n_jobs=n_jobs,
+             parallel_strategy=parallel_strategy, show_progressbar=False,
+             worker_initializer=load_dataset, worker_initargs=(1000,))
+        print(f"{parallel_strategy:>12}: {perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
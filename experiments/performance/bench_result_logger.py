@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Time the master spends in the result logger per job (a logger that appends to the files in the
+call against the buffered ``JsonResultLogger``), and the time to refresh the ``Result`` of a live
+run (``logged_results_to_HBS_result`` against ``LoggedResultsReader.read``).
+'''
+import tempfile
+from time import perf_counter
+
+import click
+
+from ultraopt.result import JsonResultLogger, LoggedResultsReader, logged_results_to_HBS_result
+from ultraopt.structure import Job
+
+
+class SyncResultLogger(JsonResultLogger):
+    '''Writes in the call, like the loggers of hpbandster.'''
+
+    def new_config(self, config_id, config, config_info):
+        super(SyncResultLogger, self).new_config(config_id, config, config_info)
+        self.flush()
+
+    def __call__(self, job):
+        super(SyncResultLogger, self).__call__(job)
+        self.flush()
+
+
+def make_job(i):
+    job = Job((i // 100, 0, i % 100), config={"x0": i * 0.1, "x1": -i * 0.1}, config_info={}, budget=1)
+    job.time_it("submitted")
+    job.time_it("started")
+    job.time_it("finished")
+    job.result = {"loss": i * 0.01}
+    return job
+
+
+@click.command()
+@click.option('--n-jobs', '-n', default=20000)
+@click.option('--n-new', default=100, help="jobs logged between two refreshes of the live result")
+def main(n_jobs, n_new):
+    jobs = [make_job(i) for i in range(n_jobs)]
+    for logger_cls in [SyncResultLogger, JsonResultLogger]:
+        result_logger = logger_cls(tempfile.mkdtemp())
+        start = perf_counter()
+        for job in jobs:
+            result_logger.new_config(job.id, job.kwargs["config"], job.kwargs["config_info"])
+            result_logger(job)
+        cost = perf_counter() - start
+        result_logger.close()
+        print(f"{logger_cls.__name__:>16}: {cost / n_jobs * 1e6:.1f}us per job in the master")
+
+    directory = tempfile.mkdtemp()
+    result_logger = JsonResultLogger(directory)
+    for job in jobs:
+        result_logger.new_config(job.id, job.kwargs["config"], job.kwargs["config_info"])
+        result_logger(job)
+    result_logger.flush()
+    reader = LoggedResultsReader(directory)
+    reader.read()
+    for i in range(n_new):
+        job = make_job(n_jobs + i)
+        result_logger.new_config(job.id, job.kwargs["config"], job.kwargs["config_info"])
+        result_logger(job)
+    result_logger.close()
+    start = perf_counter()
+    logged_results_to_HBS_result(directory)
+    print(f"refresh after {n_new} new jobs, full reload: {perf_counter() - start:.3f}s")
+    start = perf_counter()
+    reader.read()
+    print(f"refresh after {n_new} new jobs, incremental read: {perf_counter() - start:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
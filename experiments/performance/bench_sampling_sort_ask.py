@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+ask latency of the Forest/GBRT optimizers (SamplingSortOptimizer, 5000 samples per ask)
+on a conditional space with 30+ hyperparameters, with and without local search.
+'''
+from time import perf_counter
+
+import click
+import numpy as np
+
+from ultraopt.hdl import hdl2cs
+from ultraopt.optimizer import ForestOptimizer, GBRTOptimizer
+
+
+def build_config_space(n_dims):
+    HDL = {}
+    for i in range(n_dims):
+        if i % 4 == 0:
+            HDL[f"c{i}"] = {"_type": "choice", "_value": ["a", "b", "c", "d"]}
+        elif i % 4 == 1:
+            HDL[f"i{i}"] = {"_type": "int_uniform", "_value": [1, 100]}
+        else:
+            HDL[f"x{i}"] = {"_type": "loguniform" if i % 2 else "uniform", "_value": [0.01, 10]}
+    HDL["model(choice)"] = {
+        "A": {"a1": {"_type": "uniform", "_value": [0, 1]}, "a2": {"_type": "choice", "_value": ["p", "q"]}},
+        "B": {"b1": {"_type": "int_quniform", "_value": [10, 100, 10]}},
+    }
+    return hdl2cs(HDL)
+
+
+def evaluate(config: dict):
+    return float(sum(value for key, value in config.items() if isinstance(value, (int, float))))
+
+
+@click.command()
+@click.option('--n-dims', '-d', default=32)
+@click.option('--n-initial', '-i', default=30)
+@click.option('--n-asks', '-n', default=20)
+@click.option('--local-search/--no-local-search', default=False)
+def main(n_dims, n_initial, n_asks, local_search):
+    config_space = build_config_space(n_dims)
+    print(f"n_hyperparameters={len(config_space.get_hyperparameters())}")
+    for optimizer_cls in [ForestOptimizer, GBRTOptimizer]:
+        opt = optimizer_cls(min_points_in_model=n_initial, use_local_search=local_search)
+        opt.initialize(config_space)
+        for _ in range(n_initial):
+            config, _ = opt.ask()
+            opt.tell(config, evaluate(config))
+        costs = []
+        for _ in range(n_asks):
+            start = perf_counter()
+            config, _ = opt.ask()
+            costs.append(perf_counter() - start)
+            opt.tell(config, evaluate(config))
+        costs = np.array(costs) * 1e3
+        print(f"{optimizer_cls.__name__:>16}: ask median {np.median(costs):.1f}ms, mean {costs.mean():.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
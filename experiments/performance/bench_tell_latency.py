@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Per-call latency of ``register_config`` + ``tell`` as the history grows.
+
+RandomOptimizer does not fit any model, so the numbers only measure the bookkeeping
+of the observation history. With the array-backed ``ObservationStore`` the latency
+should stay flat up to 50k observations.
+'''
+from time import perf_counter
+
+import click
+import numpy as np
+from ConfigSpace import ConfigurationSpace
+from ConfigSpace.hyperparameters import UniformFloatHyperparameter, CategoricalHyperparameter
+
+from ultraopt.optimizer import RandomOptimizer
+
+
+def build_config_space(n_dims):
+    cs = ConfigurationSpace()
+    for i in range(n_dims):
+        if i % 3 == 2:
+            cs.add_hyperparameter(CategoricalHyperparameter(f"x{i}", ["a", "b", "c", "d"]))
+        else:
+            cs.add_hyperparameter(UniformFloatHyperparameter(f"x{i}", -5, 5))
+    return cs
+
+
+@click.command()
+@click.option('--n-observations', '-n', default=50000)
+@click.option('--n-dims', '-d', default=10)
+@click.option('--report-every', '-r', default=5000)
+def main(n_observations, n_dims, report_every):
+    cs = build_config_space(n_dims)
+    opt = RandomOptimizer()
+    opt.initialize(cs, budgets=[1], random_state=0)
+    configs = [config.get_dictionary() for config in cs.sample_configuration(n_observations)]
+    rng = np.random.RandomState(0)
+    losses = rng.rand(n_observations)
+    latencies = np.zeros([n_observations])
+    print(f"{'n_obvs':>8} {'mean(us)':>10} {'p99(us)':>10}")
+    for i, (config, loss) in enumerate(zip(configs, losses)):
+        start = perf_counter()
+        opt.register_config(config, 1)
+        opt.tell(config, loss)
+        latencies[i] = perf_counter() - start
+        if (i + 1) % report_every == 0:
+            window = latencies[i + 1 - report_every:i + 1] * 1e6
+            print(f"{i + 1:>8} {window.mean():>10.1f} {np.percentile(window, 99):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
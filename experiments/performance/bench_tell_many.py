@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Warm start an optimizer from a large history: one ``tell`` per observation (the model fitted
+after the last one) against one ``tell_many`` call.
+'''
+import logging
+from time import perf_counter
+
+import click
+
+from ultraopt.optimizer import ETPEOptimizer
+from ultraopt.tests.mock import evaluate, config_space
+
+
+@click.command()
+@click.option('--n-trials', '-n', default=20000)
+def main(n_trials):
+    # ``tell`` logs an error per observation because the configs were not asked
+    logging.disable(logging.ERROR)
+    configs = [config.get_dictionary() for config in config_space.sample_configuration(n_trials)]
+    losses = [evaluate(config) for config in configs]
+    print(f"n_trials={n_trials}")
+    opt = ETPEOptimizer()
+    opt.initialize(config_space)
+    start = perf_counter()
+    for i, (config, loss) in enumerate(zip(configs, losses)):
+        opt.tell(config, loss, update_model=(i == n_trials - 1))
+    print(f"tell      : {perf_counter() - start:.3f}s")
+    opt = ETPEOptimizer()
+    opt.initialize(config_space)
+    start = perf_counter()
+    opt.tell_many(configs, losses)
+    print(f"tell_many : {perf_counter() - start:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
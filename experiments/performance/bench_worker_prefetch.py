@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+'''
+Idle time of the AsyncComm workers between two jobs (the time they wait for the master to refit the
+model and sample the next configuration), with one job per worker and with a prefetch queue.
+'''
+from time import perf_counter, sleep
+from uuid import uuid4
+
+import click
+import numpy as np
+
+from ultraopt.async_comm.master import Master
+from ultraopt.async_comm.nameserver import NameServer
+from ultraopt.async_comm.worker import Worker
+from ultraopt.facade.utils import get_optimizer
+from ultraopt.multi_fidelity import CustomIterGenerator
+from ultraopt.tests.mock import evaluate, config_space
+
+
+def run(optimizer, n_iterations, n_jobs, n_prefetch, cost):
+    def eval_func(config):
+        sleep(cost)
+        return evaluate(config)
+
+    run_id = uuid4().hex
+    opt = get_optimizer(optimizer)
+    opt.initialize(config_space, [1])
+    NS = NameServer(run_id=run_id, host="127.0.0.1")
+    _, ns_port = NS.start()
+    workers = [Worker(run_id=run_id, nameserver="127.0.0.1", nameserver_port=ns_port, host="127.0.0.1",
+                      worker_id=i, n_prefetch=n_prefetch)
+               for i in range(n_jobs)]
+    for worker in workers:
+        worker.initialize(eval_func)
+        worker.run(True, "thread")
+    master = Master(run_id, opt, CustomIterGenerator([1], [1]), nameserver="127.0.0.1", nameserver_port=ns_port,
+                    host="127.0.0.1")
+    start = perf_counter()
+    master.run(n_iterations, min_n_workers=n_jobs)
+    cost_time = perf_counter() - start
+    master.shutdown(True)
+    NS.shutdown()
+    return cost_time, np.hstack(list(master.get_idle_gaps().values()))
+
+
+@click.command()
+@click.option('--n-iterations', '-n', default=200)
+@click.option('--n-jobs', '-j', default=4)
+@click.option('--optimizer', '-o', default="ETPE")
+@click.option('--cost', '-c', default=0.02, help="seconds per evaluation")
+def main(n_iterations, n_jobs, optimizer, cost):
+    print(f"n_iterations={n_iterations}, n_jobs={n_jobs}, optimizer={optimizer}, cost={cost}s")
+    for n_prefetch in [1, 2]:
+        cost_time, idle_gaps = run(optimizer, n_iterations, n_jobs, n_prefetch, cost)
+        print(f"prefetch {n_prefetch}: {cost_time:.2f}s, idle gap per job: mean {idle_gaps.mean() * 1e3:.2f}ms, "
+              f"p90 {np.percentile(idle_gaps, 90) * 1e3:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
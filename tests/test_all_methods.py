@@ -3,9 +3,10 @@
 # @Author  : qichun tang
 # @Date    : 2020-12-19
 # @Contact    : qichun.tang@bupt.edu.cn
+import asyncio
 import unittest
 
-from ultraopt import fmin
+from ultraopt import fmin, fmin_async
 from ultraopt.constants import valid_optimizers, valid_parallel_strategies
 from ultraopt.multi_fidelity import HyperBandIterGenerator, SuccessiveHalvingIterGenerator
 from ultraopt.tests.mock import evaluate, config_space
@@ -14,12 +15,10 @@ class TestAllMethod(unittest.TestCase):
     def test_all_methods(self):
         for optimizer in valid_optimizers:
             for parallel_strategie in valid_parallel_strategies:
-                if parallel_strategie == "AsyncComm":
-                    multi_fidelity_iter_generators = [
-                        HyperBandIterGenerator(50, 100, 2),
-                        SuccessiveHalvingIterGenerator(50, 100, 2)]
-                else:
-                    multi_fidelity_iter_generators = [None]
+                multi_fidelity_iter_generators = [
+                    None,
+                    HyperBandIterGenerator(50, 100, 2),
+                    SuccessiveHalvingIterGenerator(50, 100, 2)]
                 for multi_fidelity_iter_generator in multi_fidelity_iter_generators:
                     print(optimizer, parallel_strategie, multi_fidelity_iter_generator)
                     ret = fmin(
@@ -27,3 +26,70 @@ class TestAllMethod(unittest.TestCase):
                         parallel_strategy=parallel_strategie, multi_fidelity_iter_generator=multi_fidelity_iter_generator
                     )
                     print(ret)
+
+    def test_asyncio(self):
+        n_running = 0
+        max_running = 0
+
+        async def async_evaluate(config: dict, budget=100):
+            nonlocal n_running, max_running
+            n_running += 1
+            max_running = max(max_running, n_running)
+            await asyncio.sleep(0.01)
+            n_running -= 1
+            return evaluate(config, budget)
+
+        ret = fmin(async_evaluate, config_space, optimizer="ETPE", n_iterations=20, n_jobs=4)
+        assert len(ret.optimizer.budget2obvs[1]["losses"]) == 20
+        assert max_running == 4
+        ret = asyncio.run(fmin_async(
+            async_evaluate, config_space, optimizer="Random", n_iterations=1, n_jobs=4,
+            multi_fidelity_iter_generator=SuccessiveHalvingIterGenerator(25, 100, 2)))
+        n_runs = SuccessiveHalvingIterGenerator(25, 100, 2).num_all_configs(1)
+        assert sum(len(obvs["losses"]) for obvs in ret.optimizer.budget2obvs.values()) == n_runs
+
+    def test_connection_transport(self):
+        for multi_fidelity_iter_generator, n_runs in [
+            (None, 20),
+            (SuccessiveHalvingIterGenerator(25, 100, 2), SuccessiveHalvingIterGenerator(25, 100, 2).num_all_configs(1))
+        ]:
+            ret = fmin(
+                evaluate, config_space, optimizer="Random", n_iterations=20 if multi_fidelity_iter_generator is None else 1,
+                n_jobs=2, parallel_strategy="AsyncComm", transport="Connection", n_prefetch=2,
+                multi_fidelity_iter_generator=multi_fidelity_iter_generator)
+            assert sum(len(obvs["losses"]) for obvs in ret.optimizer.budget2obvs.values()) == n_runs
+
+    def test_worker_prefetch(self):
+        for transport in ["Pyro4", "Connection"]:
+            ret = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=20, n_jobs=2,
+                       parallel_strategy="AsyncComm", transport=transport, n_prefetch=3)
+            assert len(ret.optimizer.budget2obvs[1]["losses"]) == 20
+
+    def test_debug_worker_failure(self):
+        from uuid import uuid4
+        from ultraopt.async_comm.master import Master
+        from ultraopt.async_comm.nameserver import NameServer
+        from ultraopt.async_comm.worker import Worker
+        from ultraopt.multi_fidelity import CustomIterGenerator
+        from ultraopt.optimizer import ETPEOptimizer
+
+        def fail(config):
+            raise ValueError("failed in a debug worker")
+
+        run_id = uuid4().hex
+        NS = NameServer(run_id=run_id, host="127.0.0.1", port=0)
+        _, ns_port = NS.start()
+        # the debug worker registers its failure and shuts down, the other worker finishes the run
+        for worker_id, (eval_func, debug) in enumerate([(fail, True), (evaluate, False)]):
+            worker = Worker(run_id=run_id, nameserver="127.0.0.1", nameserver_port=ns_port, host="127.0.0.1",
+                            worker_id=worker_id, debug=debug)
+            worker.initialize(eval_func)
+            worker.run(True, "thread")
+        opt = ETPEOptimizer()
+        opt.initialize(config_space)
+        master = Master(run_id, opt, CustomIterGenerator([1], [1]), nameserver="127.0.0.1",
+                        nameserver_port=ns_port, host="127.0.0.1", ping_interval=1)
+        master.run(10)
+        master.shutdown(True)
+        NS.shutdown()
+        assert len(opt.budget2obvs[1]) == 10
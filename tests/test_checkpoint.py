@@ -3,14 +3,24 @@
 # @Author  : qichun tang
 # @Date    : 2020-12-20
 # @Contact    : qichun.tang@bupt.edu.cn
+import os
+import tempfile
+import threading
 import unittest
 
+import numpy as np
+from ConfigSpace import ConfigurationSpace, UniformFloatHyperparameter
 from joblib import load
 
 from ultraopt import fmin, FMinResult
 from ultraopt.constants import valid_parallel_strategies
-from ultraopt.multi_fidelity import CustomIterGenerator
+from ultraopt.multi_fidelity import CustomIterGenerator, HyperBandIterGenerator
+from ultraopt.optimizer import ETPEOptimizer
+from ultraopt.result import columnar_results_to_HBS_result, logged_results_to_HBS_result, JsonResultLogger, \
+    LoggedResultsReader
+from ultraopt.structure import Job
 from ultraopt.tests.mock import evaluate, config_space
+from ultraopt.utils.checkpoint import Checkpointer, load_checkpoint
 
 
 class TestCheckpoint(unittest.TestCase):
@@ -20,17 +30,173 @@ class TestCheckpoint(unittest.TestCase):
             optimizer = "ETPE"
             n_iterations = 3
             n_jobs = 4
-            p_res = fmin(
-                evaluate,
-                config_space,
-                optimizer=optimizer,
-                n_jobs=n_jobs,
-                n_iterations=n_iterations,
-                parallel_strategy=parallel_strategy,
-                checkpoint_file="checkpoint.pkl",
-                checkpoint_freq=2,
-                multi_fidelity_iter_generator=CustomIterGenerator([4, 2, 1], [25, 50, 100])
-            )
-            res = FMinResult(load("checkpoint.pkl"))
+            with tempfile.TemporaryDirectory() as directory:
+                checkpoint_file = os.path.join(directory, "checkpoint.pkl")
+                p_res = fmin(
+                    evaluate,
+                    config_space,
+                    optimizer=optimizer,
+                    n_jobs=n_jobs,
+                    n_iterations=n_iterations,
+                    parallel_strategy=parallel_strategy,
+                    checkpoint_file=checkpoint_file,
+                    checkpoint_freq=2,
+                    multi_fidelity_iter_generator=CustomIterGenerator([4, 2, 1], [25, 50, 100])
+                )
+                res = FMinResult(load(checkpoint_file))
             assert p_res.budget2info == res.budget2info
             print(res)
+
+    def test_checkpoint_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_file = os.path.join(directory, "checkpoint.pkl")
+            opt = ETPEOptimizer()
+            opt.initialize(config_space)
+            checkpointer = Checkpointer(opt, checkpoint_file)
+            for i in range(12):
+                config, _ = opt.ask()
+                loss = evaluate(config)
+                opt.tell(config, loss)
+                checkpointer.log_result(config, 1, {"loss": loss})
+                if i == 4:
+                    checkpointer.snapshot()
+            checkpointer.close()
+            # the snapshot holds 5 results, the other 7 are replayed from the log
+            assert len(load(checkpoint_file).budget2obvs[1]) == 5
+            resumed_opt = load_checkpoint(checkpoint_file)
+            assert np.all(resumed_opt.budget2obvs[1]["losses"] == opt.budget2obvs[1]["losses"])
+            assert np.all(resumed_opt.budget2obvs[1]["vectors"] == opt.budget2obvs[1]["vectors"])
+            assert {runId: info["end_time"] for runId, info in resumed_opt.runId2info.items()} == \
+                   {runId: info["end_time"] for runId, info in opt.runId2info.items()}
+            # resume from the checkpoint
+            res = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=3, previous_result=checkpoint_file)
+            assert len(res.optimizer.budget2obvs[1]) == 15
+
+    def test_checkpoint_lock(self):
+        # the snapshot is serialized by the background thread while it holds the lock
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_file = os.path.join(directory, "checkpoint.pkl")
+            lock = threading.Lock()
+            opt = ETPEOptimizer()
+            opt.initialize(config_space)
+            checkpointer = Checkpointer(opt, checkpoint_file, lock=lock)
+            for i in range(6):
+                with lock:
+                    config, _ = opt.ask()
+                    loss = evaluate(config)
+                    opt.tell(config, loss)
+                    checkpointer.log_result(config, 1, {"loss": loss})
+                    if i == 2:
+                        checkpointer.snapshot()
+            checkpointer.close()
+            assert 3 <= len(load(checkpoint_file).budget2obvs[1]) <= 6
+            resumed_opt = load_checkpoint(checkpoint_file)
+            assert np.all(resumed_opt.budget2obvs[1]["losses"] == opt.budget2obvs[1]["losses"])
+
+    def test_checkpoint_stopped_run(self):
+        # the run stops before all the runs of the iterations are done, the last results are snapshotted
+        def failing_evaluate(config, budget):
+            if len(calls) == 7:
+                raise RuntimeError("stop")
+            calls.append(config)
+            return evaluate(config)
+
+        calls = []
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_file = os.path.join(directory, "checkpoint.pkl")
+            with self.assertRaises(RuntimeError):
+                fmin(failing_evaluate, config_space, optimizer="ETPE", n_iterations=2,
+                     checkpoint_file=checkpoint_file, checkpoint_freq=5,
+                     multi_fidelity_iter_generator=HyperBandIterGenerator(25, 100, 2))
+            opt = load(checkpoint_file)
+            assert sum(len(obvs) for obvs in opt.budget2obvs.values()) == 7
+            # resume into the same checkpoint, the log of the previous run is kept until the new snapshot
+            res = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=3, previous_result=checkpoint_file,
+                       checkpoint_file=checkpoint_file, checkpoint_freq=2)
+            assert len(load_checkpoint(checkpoint_file).budget2obvs[1]) == len(res.budget2obvs[1]) == 3
+
+    def test_columnar_result(self):
+        with tempfile.TemporaryDirectory() as directory:
+            res = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=2,
+                       multi_fidelity_iter_generator=HyperBandIterGenerator(25, 100, 2))
+            res.save(directory)
+            loaded_res = FMinResult.load(directory)
+            assert loaded_res.budget2info == res.budget2info
+            for budget, obvs in res.budget2obvs.items():
+                loaded_obvs = loaded_res.budget2obvs[budget]
+                assert np.all(loaded_obvs["losses"] == obvs["losses"])
+                assert [config.get_dictionary() for config in loaded_obvs["configs"]] == \
+                       [config.get_dictionary() for config in obvs["configs"]]
+            assert len(columnar_results_to_HBS_result(directory).get_all_runs()) == \
+                   sum(len(obvs) for obvs in res.budget2obvs.values())
+            # warm start from the memory-mapped columns
+            res = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=1, previous_result=directory,
+                       multi_fidelity_iter_generator=HyperBandIterGenerator(25, 100, 2))
+            assert len(res.budget2obvs[25]) == 8
+            # warm start a run whose budgets are not the saved budgets, with both strategies
+            for warm_start_strategy in ["resume", "continue"]:
+                res = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=5, previous_result=directory,
+                           warm_start_strategy=warm_start_strategy)
+                assert len(res.budget2obvs[1]) == 5
+                assert len(res.budget2obvs[25]) == len(loaded_res.budget2obvs[25])
+            # a config space with the same names but other bounds
+            other_config_space = ConfigurationSpace()
+            other_config_space.add_hyperparameters([UniformFloatHyperparameter(name, -1, 1)
+                                                    for name in config_space.get_hyperparameter_names()])
+            for warm_start_strategy in ["resume", "continue"]:
+                with self.assertRaises(ValueError):
+                    fmin(evaluate, other_config_space, optimizer="ETPE", n_iterations=1, previous_result=directory,
+                         warm_start_strategy=warm_start_strategy)
+        # an empty result
+        opt = ETPEOptimizer()
+        opt.initialize(config_space)
+        with tempfile.TemporaryDirectory() as directory:
+            FMinResult(opt).save(directory)
+            result = columnar_results_to_HBS_result(directory)
+            assert result.get_all_runs() == [] and result.HB_config["max_budget"] is None
+
+    def test_result_logger(self):
+        with tempfile.TemporaryDirectory() as directory:
+            res = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=1, n_jobs=2,
+                       parallel_strategy="AsyncComm", multi_fidelity_iter_generator=HyperBandIterGenerator(25, 100, 2),
+                       result_logger=directory)
+            n_runs = sum(len(obvs) for obvs in res.budget2obvs.values())
+            assert len(logged_results_to_HBS_result(directory).get_all_runs()) == n_runs
+        # follow a live run
+        with tempfile.TemporaryDirectory() as directory:
+            result_logger = JsonResultLogger(directory, flush_interval=3600)
+            reader = LoggedResultsReader(directory)
+            for i in range(4):
+                job = Job((0, 0, i), config={"x0": i}, budget=1)
+                job.time_it("submitted")
+                job.result = {"loss": i}
+                result_logger.new_config(job.id, job.kwargs["config"], {})
+                result_logger(job)
+                if i == 1:
+                    result_logger.flush()
+                    assert len(reader.read().get_all_runs()) == 2
+            result_logger.close()
+            with open(os.path.join(directory, "results.json"), "a") as fh:
+                fh.write('[[0, 0, 4], 1, {"submi')  # partially written
+            assert len(reader.read().get_all_runs()) == 4
+
+    def test_tell_many(self):
+        configs = [config.get_dictionary() for config in config_space.sample_configuration(30)]
+        losses = [evaluate(config) for config in configs]
+        opt = ETPEOptimizer()
+        opt.initialize(config_space)
+        for i, (config, loss) in enumerate(zip(configs, losses)):
+            opt.tell(config, loss, update_model=(i == 29))
+        bulk_opt = ETPEOptimizer()
+        bulk_opt.initialize(config_space)
+        bulk_opt.tell_many(configs, losses)
+        assert np.all(bulk_opt.budget2obvs[1]["vectors"] == opt.budget2obvs[1]["vectors"])
+        assert np.all(bulk_opt.budget2obvs[1]["losses"] == opt.budget2obvs[1]["losses"])
+        assert bulk_opt.budget2obvs[1].lock_keys == opt.budget2obvs[1].lock_keys
+        assert len(bulk_opt.runId2info) == 30
+        with self.assertRaises(ValueError):
+            bulk_opt.tell_many([{"x0": 100, "x1": 0}], [1])
+        # warm start with the "resume" strategy
+        res = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=5, previous_result=FMinResult(opt),
+                   warm_start_strategy="resume")
+        assert len(res.optimizer.budget2obvs[1]) == 35
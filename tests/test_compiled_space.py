@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import unittest
+
+import numpy as np
+from ConfigSpace import Configuration
+from ConfigSpace.util import deactivate_inactive_hyperparameters
+
+from ultraopt.hdl import hdl2cs
+from ultraopt.utils.compiled_space import CompiledConfigSpace
+from ultraopt.utils.config_space import deactivate
+
+
+HDL = {
+    "model(choice)": {
+        "linearsvc": {
+            "max_iter": {"_type": "int_quniform", "_value": [300, 3000, 100], "_default": 600},
+            "penalty": {"_type": "choice", "_value": ["l1", "l2"], "_default": "l2"},
+            "dual": {"_type": "choice", "_value": [True, False], "_default": False},
+            "loss": {"_type": "choice", "_value": ["hinge", "squared_hinge"], "_default": "squared_hinge"},
+            "__forbidden": [
+                {"penalty": "l1", "loss": "hinge"},
+                {"penalty": "l2", "dual": False, "loss": "hinge"},
+            ]
+        },
+        "svc": {
+            "C": {"_type": "loguniform", "_value": [0.01, 10000], "_default": 1.0},
+            "kernel": {"_type": "choice", "_value": ["rbf", "poly", "sigmoid"], "_default": "rbf"},
+            "degree": {"_type": "int_uniform", "_value": [2, 5], "_default": 3},
+            "coef0": {"_type": "quniform", "_value": [-1, 1], "_default": 0},
+            "__activate": {
+                "kernel": {
+                    "sigmoid": ["coef0"],
+                    "poly": ["degree", "coef0"]
+                }
+            }
+        },
+    }
+}
+
+
+class TestCompiledConfigSpace(unittest.TestCase):
+    def test_process_equals_config_space(self):
+        config_space = hdl2cs(HDL)
+        compiled_space = CompiledConfigSpace(config_space)
+        rng = np.random.RandomState(0)
+        X = rng.rand(500, compiled_space.n_dims) * 1.2 - 0.1
+        choice_ids = compiled_space.n_choices > 0
+        X[:, choice_ids] = np.floor(rng.rand(500, choice_ids.sum()) * compiled_space.n_choices[choice_ids])
+        expected_vectors = []
+        expected_valid = []
+        for x in X:
+            try:
+                config = deactivate_inactive_hyperparameters(
+                    configuration_space=config_space,
+                    configuration=deactivate(config_space, x)
+                )
+                expected_vectors.append(config.get_array())
+                expected_valid.append(True)
+            except ValueError:
+                expected_valid.append(False)
+        vectors, valid = compiled_space.process(X)
+        self.assertTrue(np.array_equal(valid, expected_valid))
+        self.assertTrue(0 < valid.sum() < 500)
+        self.assertTrue(np.allclose(vectors, expected_vectors, equal_nan=True))
+        config = compiled_space.materialize(vectors[0])
+        self.assertTrue(np.allclose(config.get_array(), vectors[0], equal_nan=True))
+
+    def test_one_exchange_neighbors(self):
+        config_space = hdl2cs(HDL)
+        compiled_space = CompiledConfigSpace(config_space)
+        X = compiled_space.sample(50, 0)
+        neighbors, owners = compiled_space.get_one_exchange_neighbors(X, 0)
+        self.assertEqual(set(owners), set(range(50)))
+        for neighbor, owner in zip(neighbors, owners):
+            config_space.check_configuration(compiled_space.materialize(neighbor))
+            changed = ~((neighbor == X[owner]) | (np.isnan(neighbor) & np.isnan(X[owner])))
+            self.assertTrue(changed.any())
+            # a change of a parent may (de)activate its children, otherwise one hyperparameter is changed
+            self.assertTrue(changed.sum() == 1 or changed[compiled_space.name2idx["model:__choice__"]] or
+                            changed[compiled_space.name2idx["model:svc:kernel"]])
+
+    def test_vectorize_equals_configuration(self):
+        config_space = hdl2cs(HDL)
+        compiled_space = CompiledConfigSpace(config_space)
+        dicts = [config.get_dictionary() for config in config_space.sample_configuration(50)]
+        svc = {"model:__choice__": "svc", "model:svc:kernel": "poly", "model:svc:C": 1.0,
+               "model:svc:degree": 3, "model:svc:coef0": 0.0}
+        # numbers given as strings, and a float of an integer hyperparameter
+        dicts += [svc, dict(svc, **{"model:svc:C": "1.0"}), dict(svc, **{"model:svc:degree": "3"}),
+                  dict(svc, **{"model:svc:degree": 3.0})]
+        X, legal = compiled_space.vectorize(dicts)
+        for dict_, vector, is_legal in zip(dicts, X, legal):
+            try:
+                config = Configuration(config_space, dict_)
+            except (ValueError, TypeError):
+                self.assertFalse(is_legal)
+                continue
+            self.assertTrue(is_legal)
+            np.testing.assert_allclose(vector, config.get_array())
+        self.assertEqual(legal[-4:].tolist(), [True, False, False, False])
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import unittest
+
+import numpy as np
+
+from ultraopt.optimizer.bo.config_evaluator import rank_losses, ConfigEvaluator, PredictionCache
+
+
+def brute_force_rank_loss(outputs, label, w):
+    output = (outputs * np.array(w)[:, None]).sum(axis=0)[None, :]
+    label = label[None, :]
+    return np.count_nonzero(np.logical_xor((output < output.T), (label < label.T)))
+
+
+class CountingEPM():
+    def __init__(self, coef):
+        self.coef = coef
+        self.n_predicted = 0
+
+    def predict(self, X, return_std=False):
+        self.n_predicted += X.shape[0]
+        return X @ self.coef, np.abs(X[:, 0])
+
+
+class TestConfigEvaluator(unittest.TestCase):
+    def test_rank_losses_equals_brute_force(self):
+        rng = np.random.RandomState(0)
+        for n, L, with_ties in [(1, 2, False), (37, 3, False), (100, 4, True), (300, 5, True)]:
+            outputs = rng.rand(L, n)
+            label = rng.rand(n)
+            if with_ties:
+                outputs = np.round(outputs * 4)
+                label = np.round(label * 6)
+            weights = rng.rand(100, L)
+            weights[weights < 0.3] = 0
+            weights[weights > 0.8] = 1
+            expected = [brute_force_rank_loss(outputs, label, w) for w in weights]
+            self.assertTrue(np.all(rank_losses(outputs, label, weights, chunk_size=32) == expected))
+
+    def test_prediction_cache(self):
+        rng = np.random.RandomState(0)
+        budget2epm = {1 / 3: CountingEPM(rng.rand(4)), 1: CountingEPM(rng.rand(4))}
+        prediction_cache = PredictionCache(budget2epm)
+        evaluator = ConfigEvaluator(budget2epm, 1, prediction_cache=prediction_cache)
+        evaluator.update_weight({1 / 3: 0.3, 1: 0.7})
+        X = rng.rand(20, 4)
+        expected = evaluator(X, 0.5, use_cache=False)
+        self.assertTrue(np.all(evaluator(X[:10], 0.5) == expected[:10]))
+        self.assertTrue(np.all(evaluator(X, 0.5) == expected))
+        self.assertEqual(budget2epm[1].n_predicted, 20 + 20)
+        self.assertEqual(prediction_cache.cache_info()["hits"], 20)
+        # a refit invalidates the predictions of that budget only
+        prediction_cache.invalidate(1)
+        evaluator(X, 0.5)
+        self.assertEqual(budget2epm[1].n_predicted, 20 + 20 + 20)
+        self.assertEqual(budget2epm[1 / 3].n_predicted, 20 + 20)
@@ -113,3 +113,147 @@ class TestETPE(unittest.TestCase):
         }
         config_space = hdl2cs(HDL)
         fmin(evaluate, config_space, "ETPE", n_iterations=30)
+
+    def test_kde_backends_are_equivalent(self):
+        from ultraopt.learning.tpe import TreeParzenEstimator
+        from ultraopt.tests.mock import config_space
+        from ultraopt.utils.config_transformer import ConfigTransformer
+        config_transformer = ConfigTransformer(impute=None, encoder=None)
+        config_transformer.fit(config_space)
+        rng = np.random.RandomState(0)
+        X = config_transformer.transform([config.get_array() for config in config_space.sample_configuration(50)])
+        y = rng.rand(50)
+        X_cand = config_transformer.transform(
+            [config.get_array() for config in config_space.sample_configuration(100)])
+        results = []
+        for kde_backend in ["sklearn", "numpy"]:
+            for kde_sample_weight_scaler in [None, "normalize"]:
+                tpe = TreeParzenEstimator(kde_backend=kde_backend,
+                                          kde_sample_weight_scaler=kde_sample_weight_scaler)
+                tpe.set_config_transformer(config_transformer)
+                tpe.fit(X, y)
+                samples = tpe.sample(10, random_state=1, bandwidth_factor=2)
+                results.append((tpe.predict(X_cand), [sample.get_array() for sample in samples]))
+        for (sk_predict, sk_samples), (np_predict, np_samples) in zip(results[:2], results[2:]):
+            self.assertTrue(np.allclose(sk_predict, np_predict))
+            self.assertTrue(np.allclose(sk_samples, np_samples, equal_nan=True))
+
+    def test_partial_fit_equals_fit(self):
+        from ultraopt.learning.tpe import TreeParzenEstimator
+        rng = np.random.RandomState(0)
+        X = rng.rand(100, 5)
+        X[rng.rand(100) < 0.3, 3:] = np.nan
+        y = rng.rand(100)
+        X_cand = rng.rand(50, 5)
+        X_cand[:20, 3:] = np.nan
+        for kde_sample_weight_scaler in [None, "std-exp"]:
+            tpe = TreeParzenEstimator(kde_sample_weight_scaler=kde_sample_weight_scaler).fit(X[:3], y[:3])
+            for i in range(3, 100):
+                tpe.partial_fit(X[i:i + 1], y[i:i + 1])
+            full_tpe = TreeParzenEstimator(kde_sample_weight_scaler=kde_sample_weight_scaler).fit(X, y)
+            self.assertTrue(np.allclose(tpe.predict(X_cand), full_tpe.predict(X_cand)))
+        # the new rows split the group of the first 3 columns
+        X_split = X[:, :3].copy()
+        X_split[40:, 2] = np.nan
+        tpe = TreeParzenEstimator().fit(X_split[:30], y[:30])
+        for i in range(30, 100):
+            tpe.partial_fit(X_split[i:i + 1], y[i:i + 1])
+        full_tpe = TreeParzenEstimator().fit(X_split, y)
+        self.assertEqual(tpe.n_groups, 2)
+        self.assertTrue(np.allclose(tpe.predict(X_cand[:, :3]), full_tpe.predict(X_cand[:, :3])))
+
+    def test_cached_transform(self):
+        import pandas as pd
+        from tabular_nn import EquidistanceEncoder
+        from ultraopt.utils.config_space import sample_configurations
+        from ultraopt.utils.config_transformer import ConfigTransformer
+        config_space = hdl2cs({
+            "x": {"_type": "uniform", "_value": [0, 1]},
+            "c": {"_type": "choice", "_value": list("abcdef")},
+            "m(choice)": {"A": {"a": {"_type": "choice", "_value": list("pqrs")}},
+                          "B": {"b": {"_type": "uniform", "_value": [0, 1]}}},
+        })
+        encoder = EquidistanceEncoder()
+        config_transformer = ConfigTransformer(impute=None, encoder=encoder).fit(config_space)
+        vectors = np.array([config.get_array() for config in sample_configurations(config_space, 200)])
+        config_transformer.fit_encoder(vectors)
+        expected = np.asarray(encoder.transform(
+            pd.DataFrame(vectors[:, config_transformer.mask], columns=config_transformer.hp_names)))
+        self.assertIsNotNone(config_transformer.get_encoder_lookup())
+        self.assertTrue(np.allclose(config_transformer.transform(vectors), expected, equal_nan=True))
+        config_transformer.transform(vectors[:100], cache_key=1)
+        result = config_transformer.transform(vectors, cache_key=1)
+        self.assertTrue(np.allclose(result, expected, equal_nan=True))
+        self.assertEqual(config_transformer.cache_info()["hits"], 100)
+        # the encoder is refit, the cache is invalidated
+        config_transformer.fit_encoder(vectors)
+        config_transformer.transform(vectors, cache_key=1)
+        self.assertEqual(config_transformer.cache_info()["hits"], 100)
+        # the last rows are replaced (e.g. the lies of a batch ask by new observations)
+        replaced = np.vstack([vectors[:190], vectors[:20]])
+        result = config_transformer.transform(replaced, cache_key=1)
+        self.assertTrue(np.allclose(result, np.vstack([expected[:190], expected[:20]]), equal_nan=True))
+        self.assertEqual(config_transformer.cache_info()["hits"], 290)
+
+    def test_batch_ask_discards_lies(self):
+        from ConfigSpace import Configuration
+        from ultraopt.optimizer import ETPEOptimizer
+        from ultraopt.tests.mock import config_space
+        from ultraopt.utils.config_space import get_dict_from_config
+        opt = ETPEOptimizer(min_points_in_model=10)
+        opt.initialize(config_space)
+        for _ in range(20):
+            config, _ = opt.ask()
+            opt.tell(config, evaluate(config))
+        obvs = opt.budget2obvs[1]
+        losses = np.array(obvs["losses"])
+        config_info_pairs = opt.ask(n_points=8)
+        configs = [get_dict_from_config(config) for config, _ in config_info_pairs]
+        self.assertEqual(len(set(map(str, configs))), 8)
+        # the lies are removed, the epm is fitted on the real observations only
+        self.assertTrue(np.array_equal(obvs["losses"], losses))
+        self.assertEqual(opt.budget2epm[1].n_samples_, 20)
+        # the pending configs stay locked
+        for config in configs:
+            self.assertTrue(opt.is_config_exist(1, Configuration(config_space, config)))
+
+    def test_diversified_batch_ask(self):
+        from ultraopt.optimizer import ETPEOptimizer
+        from ultraopt.tests.mock import config_space
+        opt = ETPEOptimizer(min_points_in_model=10, batch_strategy="diversified")
+        opt.initialize(config_space)
+        for _ in range(3):
+            for config, _ in opt.ask(n_points=8):
+                opt.tell(config, evaluate(config))
+        n_samples = opt.budget2epm[1].n_samples_
+        config_info_pairs = opt.ask(n_points=16)
+        self.assertEqual(len(set(str(config) for config, _ in config_info_pairs)), 16)
+        self.assertTrue(all(info["model_based_pick"] for _, info in config_info_pairs))
+        # no lie is fitted
+        self.assertEqual(opt.budget2epm[1].n_samples_, n_samples)
+        self.assertEqual(len(opt.budget2obvs[1]), 24)
+
+    def test_batch_ask_with_embedding_encoder(self):
+        from ultraopt.optimizer import ETPEOptimizer
+        HDL = {
+            "x": {"_type": "uniform", "_value": [0, 1]},
+            "c": {"_type": "choice", "_value": list("abcdefg")},
+            "d": {"_type": "choice", "_value": list("vwxyz")},
+        }
+        config_space = hdl2cs(HDL)
+
+        def evaluate(config):
+            return config["x"] + "abcdefg".index(config["c"]) * 0.1 + "vwxyz".index(config["d"]) * 0.05
+
+        for strategy in ["cl_min", "diversified"]:
+            opt = ETPEOptimizer(min_points_in_model=10)
+            opt.initialize(config_space)
+            # the real observations plus the lies of a batch reach min_points_in_model
+            # before the embedding encoder is fitted
+            for _ in range(6):
+                for config, _ in opt.ask(n_points=4, strategy=strategy):
+                    opt.tell(config, evaluate(config))
+            self.assertTrue(opt.config_transformer.encoder.fitted)
+            self.assertEqual(opt.budget2epm[1].n_samples_, 24)
+        fmin(evaluate, HDL, ETPEOptimizer(batch_strategy="diversified"), n_iterations=40, n_jobs=3,
+             parallel_strategy="MapReduce")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import gc
+import unittest
+
+import numpy as np
+from ConfigSpace import Configuration
+
+from ultraopt.hdl import hdl2cs
+from ultraopt.utils.hash import get_hash_of_config, get_hashes_of_vectors, get_keys_of_vectors, get_key_of_vector, \
+    config_space_cache
+
+HDL = {
+    "model(choice)": {
+        "svc": {
+            "C": {"_type": "loguniform", "_value": [0.01, 10000], "_default": 1.0},
+            "kernel": {"_type": "choice", "_value": ["rbf", "poly", "sigmoid"], "_default": "rbf"},
+            "degree": {"_type": "int_uniform", "_value": [2, 5], "_default": 3},
+            "__activate": {"kernel": {"poly": ["degree"]}}
+        },
+        "gbdt": {
+            "n_estimators": {"_type": "int_quniform", "_value": [10, 1000, 10], "_default": 100},
+            "learning_rate": {"_type": "loguniform", "_value": [1e-3, 1], "_default": 0.1},
+        },
+    }
+}
+
+
+class TestHash(unittest.TestCase):
+    def test_config_ids(self):
+        config_space = hdl2cs(HDL)
+        # the same config space, built again (e.g. in another process)
+        other_config_space = hdl2cs(HDL)
+        configs = config_space.sample_configuration(200)
+        ids = [get_hash_of_config(config.get_dictionary(), config_space) for config in configs]
+        assert ids == [get_hash_of_config(Configuration(other_config_space, config.get_dictionary()))
+                       for config in configs]
+        vectors = np.array([Configuration(config_space, config.get_dictionary()).get_array() for config in configs])
+        assert ids == get_hashes_of_vectors(vectors, config_space)
+        assert len(set(ids)) == len({str(sorted(config.get_dictionary().items())) for config in configs})
+        # the ID of a Configuration follows its values
+        config = Configuration(config_space, configs[0].get_dictionary())
+        config_id = get_hash_of_config(config)
+        name = next(name for name in config.keys() if name.endswith("C") or name.endswith("learning_rate"))
+        # a legal value, between the current value and the upper bound
+        config[name] = (config[name] + config_space.get_hyperparameter(name).upper) / 2
+        assert get_hash_of_config(config) == get_hash_of_config(config.get_dictionary(), config_space) != config_id
+        with self.assertRaises(ValueError):
+            get_hash_of_config(config.get_dictionary())
+        # a different config space gives different IDs
+        other_hdl = {"model(choice)": {key: value for key, value in HDL["model(choice)"].items() if key == "svc"}}
+        svc_config = next(config for config in configs if config["model:__choice__"] == "svc")
+        assert get_hash_of_config(svc_config.get_dictionary(), hdl2cs(other_hdl)) != \
+               get_hash_of_config(svc_config.get_dictionary(), config_space)
+        # the cache of a config space is cleared when it is garbage collected
+        gc.collect()
+        n_config_spaces = len(config_space_cache)
+        get_hash_of_config(svc_config.get_dictionary(), hdl2cs(HDL))
+        gc.collect()
+        assert len(config_space_cache) == n_config_spaces
+
+    def test_key_of_vector(self):
+        rng = np.random.RandomState(0)
+        X = rng.rand(1000, 5)
+        X[rng.rand(*X.shape) < 0.2] = np.nan
+        X[:100] = np.round(X[:100], 10) + 0.5e-10
+        X[100:200] = -1e-12
+        assert [get_key_of_vector(x) for x in X] == get_keys_of_vectors(X)
@@ -3,9 +3,30 @@
 # @Author  : qichun tang
 # @Date    : 2020-12-20
 # @Contact    : qichun.tang@bupt.edu.cn
+import os
+import tempfile
 import unittest
 
-from ultraopt.multi_fidelity import HyperBandIterGenerator, SuccessiveHalvingIterGenerator, CustomIterGenerator
+import numpy as np
+
+from ultraopt import fmin
+from ultraopt.multi_fidelity import HyperBandIterGenerator, SuccessiveHalvingIterGenerator, CustomIterGenerator, \
+    AsyncSuccessiveHalvingIterGenerator, TrialStateStore
+from ultraopt.optimizer import RandomOptimizer
+from ultraopt.structure import Job
+from ultraopt.tests.mock import evaluate, config_space
+
+resumed_budgets = []
+
+
+def resumable_evaluate(config: dict, budget=100, state=None):
+    previous_budget, n_epochs = state.load()
+    resumed_budgets.append((previous_budget, budget))
+    n_epochs = 0 if n_epochs is None else n_epochs
+    assert n_epochs == (previous_budget or 0)
+    # "train" the remaining epochs only
+    state.save(n_epochs + (budget - n_epochs), budget)
+    return evaluate(config, budget)
 
 
 class TestMultiFidelity(unittest.TestCase):
@@ -34,3 +55,69 @@ class TestMultiFidelity(unittest.TestCase):
             print("get_budgets", iter_gen.get_budgets())
             print("num_all_configs", iter_gen.num_all_configs(3))
             print("get_next_iteration", iter_gen.get_next_iteration(4))
+
+    def test_in_process_scheduler(self):
+        iter_gen = CustomIterGenerator([4, 2, 1], [25, 50, 100])
+        for parallel_strategy in ["Serial", "MapReduce", "ProcessPool"]:
+            ret = fmin(evaluate, config_space, optimizer="ETPE", n_iterations=2, n_jobs=3,
+                       parallel_strategy=parallel_strategy, multi_fidelity_iter_generator=iter_gen,
+                       show_progressbar=False)
+            budget2obvs = ret.optimizer.budget2obvs
+            assert [len(budget2obvs[budget]["losses"]) for budget in [25, 50, 100]] == [8, 4, 2]
+
+    def test_async_successive_halving(self):
+        iter_gen = AsyncSuccessiveHalvingIterGenerator(25, 100, 2)
+        assert iter_gen.num_configs_list == [[4, 2, 1]]
+        opt = RandomOptimizer()
+        opt.initialize(config_space, iter_gen.get_budgets())
+        iter_gen.initialize(opt)
+        iteration = iter_gen.get_next_iteration(0)
+        rng = np.random.RandomState(0)
+        running = []
+        budgets = []
+        while not iteration.is_finished:
+            # keep 2 runs in flight, finish them in a random order
+            while len(running) < 2:
+                next_run = iteration.get_next_run()
+                if next_run is None:
+                    break
+                config_id, config, config_info, budget = next_run
+                budgets.append(budget)
+                job = Job(config_id, config=config, config_info=config_info, budget=budget)
+                job.result = {"loss": evaluate(config, budget)}
+                running.append(job)
+            if not running:
+                assert iteration.get_next_run() is None
+                break
+            job = running.pop(rng.randint(len(running)))
+            iteration.register_result(job)
+            opt.new_result(job)
+        assert iteration.is_finished
+        assert sorted(budgets) == [25] * 4 + [50] * 2 + [100]
+        # no barrier: the first promotion happens before the last configuration is sampled
+        assert budgets.index(50) < len(budgets) - 1 - budgets[::-1].index(25)
+
+    def test_trial_state_store(self):
+        iter_gen = CustomIterGenerator([4, 2, 1], [25, 50, 100])
+        with tempfile.TemporaryDirectory() as directory:
+            resumed_budgets.clear()
+            fmin(resumable_evaluate, config_space, optimizer="Random", n_iterations=1, n_jobs=1,
+                 multi_fidelity_iter_generator=iter_gen, state_store=TrialStateStore(directory),
+                 show_progressbar=False)
+            # the promoted configs resume from the checkpoint of the previous budget
+            assert sorted(resumed_budgets, key=str) == sorted(
+                [(None, 25)] * 4 + [(25, 50)] * 2 + [(50, 100)], key=str)
+            # the states are removed when the configs are terminated or the iteration is finished
+            assert os.listdir(directory) == []
+        fmin(resumable_evaluate, config_space, optimizer="Random", n_iterations=2, n_jobs=2,
+             parallel_strategy="ProcessPool", multi_fidelity_iter_generator=iter_gen, show_progressbar=False)
+        store = TrialStateStore(max_size=0)
+        for i in range(3):
+            store.get((0, 0, i)).save(np.zeros([100]), 1)
+            store.update_size((0, 0, i))
+        assert store.total_size == sum(store.get_size((0, 0, i)) for i in range(3)) > 0
+        store.evict(excluded={(0, 0, 1)})
+        assert list(store.config_ids) == [(0, 0, 1)]
+        assert store.total_size == store.get_size((0, 0, 1))
+        store.clear()
+        assert not os.path.exists(store.directory)
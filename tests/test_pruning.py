@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import unittest
+
+import numpy as np
+
+from ultraopt import fmin, MedianPruner, PercentilePruner, TrialPruned
+from ultraopt.pruning import Reporter, run_eval_func
+from ultraopt.tests.mock import evaluate, config_space
+
+n_steps = 10
+
+
+def evaluate_with_report(config: dict, report=None):
+    loss = evaluate(config)
+    for step in range(n_steps):
+        report(step, loss * (1 + 1 / (step + 1)))
+    return loss
+
+
+class TestPruning(unittest.TestCase):
+    def test_pruners(self):
+        pruner = PercentilePruner(25, n_startup_trials=4, n_warmup_steps=2)
+        losses = [1, 2, 3, 4]
+        assert not pruner.should_prune(1, 10, losses)  # warm up
+        assert not pruner.should_prune(2, 10, losses[:3])  # not enough trials
+        assert pruner.should_prune(2, 2, losses)
+        assert not pruner.should_prune(2, 1.5, losses)
+        assert MedianPruner(n_startup_trials=1).should_prune(0, 3, losses)
+
+        def bad_trial(config, report):
+            report(0, 1)
+            report(1, 5)
+            return 0.5
+
+        result = run_eval_func(bad_trial, {}, report=Reporter(MedianPruner(1), {1: [1, 2]}))
+        assert result == {"loss": 5, "curve": [[0, 1.0], [1, 5.0]], "pruned": True}
+        result = run_eval_func(bad_trial, {}, report=Reporter())
+        assert result == {"loss": 0.5, "curve": [[0, 1.0], [1, 5.0]]}
+        with self.assertRaises(TrialPruned):
+            Reporter(MedianPruner(1), {0: [0.5]})(0, 1)
+
+    def test_fmin_with_pruner(self):
+        for parallel_strategy in ["Serial", "ProcessPool"]:
+            ret = fmin(evaluate_with_report, config_space, optimizer="ETPE", n_iterations=30, n_jobs=2,
+                       parallel_strategy=parallel_strategy, pruner=MedianPruner(n_startup_trials=3),
+                       show_progressbar=False)
+            opt = ret.optimizer
+            # the pruned trials are partial observations, not crashes
+            losses = opt.budget2obvs[1]["losses"]
+            assert len(losses) == 30 and np.all(np.isfinite(losses))
+            n_pruned = sum(bool(info.get("pruned")) for info in opt.runId2info.values())
+            assert 0 < n_pruned < 30
+            step2losses = opt.budget2curves[1]
+            assert len(step2losses[0]) == 30 and len(step2losses[n_steps - 1]) == 30 - n_pruned
@@ -4,4 +4,6 @@
 # @Date    : 2020-12-14
 # @Contact    : qichun.tang@bupt.edu.cn
 from ultraopt.facade.fmin import fmin
+from ultraopt.facade.fmin_async import fmin_async
 from ultraopt.facade.result import FMinResult
+from ultraopt.pruning import TrialPruned, MedianPruner, PercentilePruner
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import socket
+import threading
+import time
+from collections import deque
+from multiprocessing import Pipe
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, wait
+
+from ultraopt.structure import Job
+from ultraopt.utils.logging_ import get_logger
+from .worker import Worker
+
+
+def get_authkey(run_id):
+    return str(run_id).encode()
+
+
+class ConnectionDispatcher(object):
+    """
+    Push-based alternative to the Pyro4 ``Dispatcher``, on top of ``multiprocessing.connection``:
+    no nameserver and no discovery polling, a worker connects to the listener and is registered at once.
+
+    A worker registers with the number of jobs it wants to prefetch, the dispatcher pushes jobs to it
+    as long as it has fewer jobs than that, and the worker sends the results back in batches.
+    The queue callback gets the number of job slots (the sum of the prefetch sizes), so the
+    ``Master`` keeps every slot filled.
+    """
+
+    def __init__(self, new_result_callback, run_id='0', host=None, port=0, queue_callback=None):
+        self.new_result_callback = new_result_callback
+        self.queue_callback = queue_callback
+        self.run_id = run_id
+        self.logger = get_logger(self)
+        self.listener = Listener((host or '127.0.0.1', port), authkey=get_authkey(run_id))
+        self.address = self.listener.address
+        self.shutdown_all_threads = False
+
+        self.waiting_jobs = deque()
+        self.running_jobs = {}
+        self.worker2conn = {}
+        self.worker2n_prefetch = {}
+        self.worker2n_jobs = {}
+        self.thread_cond = threading.Condition()
+        # wakes up the receiver when a worker connects or at shutdown
+        self.wakeup_reader, self.wakeup_writer = Pipe(duplex=False)
+
+    def run(self):
+        accept_thread = threading.Thread(target=self.accept_workers, name='accept_workers')
+        accept_thread.daemon = True
+        accept_thread.start()
+        self.logger.debug('DISPATCHER: listening on %s' % str(self.address))
+        self.receive_results()
+        self.logger.debug('DISPATCHER: shut down complete')
+
+    def accept_workers(self):
+        while not self.shutdown_all_threads:
+            try:
+                conn = self.listener.accept()
+                message = conn.recv()
+            except (OSError, EOFError, AuthenticationError):
+                continue
+            if self.shutdown_all_threads:
+                conn.close()
+                break
+            _, worker_name, n_prefetch = message
+            with self.thread_cond:
+                self.worker2conn[worker_name] = conn
+                self.worker2n_prefetch[worker_name] = n_prefetch
+                self.worker2n_jobs[worker_name] = 0
+                self.logger.debug('DISPATCHER: registered worker %s (prefetch %i)' % (worker_name, n_prefetch))
+                self.dispatch_jobs()
+                self.thread_cond.notify_all()
+            self.wakeup_writer.send(None)
+            if self.queue_callback is not None:
+                self.queue_callback(self.number_of_slots())
+
+    def receive_results(self):
+        while not self.shutdown_all_threads:
+            with self.thread_cond:
+                conn2worker = {conn: worker_name for worker_name, conn in self.worker2conn.items()}
+            for conn in wait(list(conn2worker) + [self.wakeup_reader]):
+                if self.shutdown_all_threads:
+                    break
+                if conn is self.wakeup_reader:
+                    conn.recv()
+                    continue
+                worker_name = conn2worker[conn]
+                try:
+                    _, results = conn.recv()
+                except (OSError, EOFError):
+                    self.remove_worker(worker_name)
+                    continue
+                jobs = []
+                with self.thread_cond:
+                    for id, result, exception, timestamps in results:
+                        job = self.running_jobs.pop(id)
+                        job.timestamps.update(timestamps)
+                        job.result = result
+                        job.exception = exception
+                        jobs.append(job)
+                    self.worker2n_jobs[worker_name] -= len(results)
+                    self.dispatch_jobs()
+                # with the condition released, the master can submit new jobs in its callback
+                for job in jobs:
+                    self.new_result_callback(job)
+
+    def dispatch_jobs(self):
+        # called with the condition acquired
+        for worker_name, conn in self.worker2conn.items():
+            n_free = self.worker2n_prefetch[worker_name] - self.worker2n_jobs[worker_name]
+            batch = []
+            while self.waiting_jobs and len(batch) < n_free:
+                job = self.waiting_jobs.popleft()
+                job.time_it('started')
+                job.worker_name = worker_name
+                self.running_jobs[job.id] = job
+                batch.append((job.id, job.kwargs))
+            if batch:
+                self.worker2n_jobs[worker_name] += len(batch)
+                conn.send(("jobs", batch))
+            if not self.waiting_jobs:
+                break
+
+    def remove_worker(self, worker_name):
+        self.logger.warning('DISPATCHER: lost the connection to worker %s' % worker_name)
+        with self.thread_cond:
+            self.worker2conn.pop(worker_name).close()
+            self.worker2n_prefetch.pop(worker_name)
+            self.worker2n_jobs.pop(worker_name)
+            # the jobs of a crashed worker are run again
+            for id, job in list(self.running_jobs.items()):
+                if job.worker_name == worker_name:
+                    del self.running_jobs[id]
+                    self.waiting_jobs.appendleft(job)
+            self.dispatch_jobs()
+        if self.queue_callback is not None:
+            self.queue_callback(self.number_of_slots())
+
+    def submit_job(self, id, **kwargs):
+        with self.thread_cond:
+            job = Job(id, **kwargs)
+            job.time_it('submitted')
+            self.waiting_jobs.append(job)
+            self.dispatch_jobs()
+
+    def number_of_workers(self):
+        with self.thread_cond:
+            return len(self.worker2conn)
+
+    def number_of_slots(self):
+        with self.thread_cond:
+            return sum(self.worker2n_prefetch.values())
+
+    def trigger_discover_worker(self):
+        # workers are registered as soon as they connect
+        pass
+
+    def shutdown(self, shutdown_workers=False):
+        with self.thread_cond:
+            self.shutdown_all_threads = True
+            for conn in self.worker2conn.values():
+                try:
+                    if shutdown_workers:
+                        conn.send(("shutdown", None))
+                    conn.close()
+                except OSError:
+                    pass
+        self.wakeup_writer.send(None)
+        # unblock ``accept``, a plain socket does not wait for the handshake if nobody accepts any more
+        try:
+            socket.create_connection(self.address).close()
+        except OSError:
+            pass
+        self.listener.close()
+
+
+class ConnectionWorker(Worker):
+    """
+    Worker of the ``ConnectionDispatcher``: connects to ``address``, prefetches up to ``n_prefetch`` jobs
+    and sends the results back in batches of at most ``result_batch_size``
+    (a batch is also sent as soon as the worker has no job left to run).
+    """
+
+    def __init__(self, address, run_id, worker_id=None, n_prefetch=1, result_batch_size=1, debug=False):
+        super(ConnectionWorker, self).__init__(run_id, worker_id=worker_id, debug=debug, n_prefetch=n_prefetch)
+        self.address = tuple(address)
+        self.result_batch_size = result_batch_size
+        self.conn = None
+
+    def _run(self):
+        try:
+            self.conn = Client(self.address, authkey=get_authkey(self.run_id))
+        except OSError:
+            # e.g. the run finished before this worker started
+            self.logger.warning('WORKER: could not connect to the dispatcher at %s' % str(self.address))
+            return
+        self.conn.send(("register", self.worker_id, self.n_prefetch))
+        self.logger.debug('WORKER: registered to the dispatcher at %s' % str(self.address))
+        jobs = deque()
+        results = []
+        try:
+            while True:
+                # block only when there is nothing to run
+                while not jobs or self.conn.poll():
+                    kind, message = self.conn.recv()
+                    if kind == "shutdown":
+                        return
+                    jobs.extend(message)
+                id, kwargs = jobs.popleft()
+                results.append(self.run_job(id, kwargs))
+                if len(results) >= self.result_batch_size or not (jobs or self.conn.poll()):
+                    self.conn.send(("results", results))
+                    results = []
+        except (OSError, EOFError):
+            self.logger.debug('WORKER: connection to the dispatcher closed')
+        finally:
+            self.conn.close()
+
+    def run_job(self, id, kwargs):
+        self.logger.debug('WORKER: start processing job %s' % str(id))
+        timestamps = {'started': time.time()}
+        try:
+            result, exception = self.compute(config_id=id, **kwargs), None
+        except Exception as e:
+            self.logger.error(str(e))
+            self.logger.error(kwargs)
+            if self.debug:
+                raise
+            result, exception = None, str(e)
+        timestamps['finished'] = time.time()
+        return (id, result, exception, timestamps)
+
+    def shutdown(self):
+        if self.conn is not None:
+            self.conn.close()
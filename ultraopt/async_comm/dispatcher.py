@@ -12,7 +12,9 @@ class Worker(object):
     def __init__(self, name, uri):
         self.name = name
         self.proxy = Pyro4.Proxy(uri)
-        self.runs_job = None
+        # ids of the jobs sent to the worker, at most n_prefetch
+        self.runs_jobs = set()
+        self.n_prefetch = 1
 
     def is_alive(self):
         try:
@@ -29,6 +31,9 @@ class Worker(object):
     def is_busy(self):
         return (self.proxy.is_busy())
 
+    def has_free_slot(self):
+        return (len(self.runs_jobs) < self.n_prefetch)
+
     def __repr__(self):
         return (self.name)
 
@@ -60,7 +65,8 @@ class Dispatcher(object):
         host: str
             ip (or name that resolves to that) of the network interface to use
         queue_callback: function
-            gets called with the number of workers in the pool on every update-cycle
+            gets called with the number of job slots (the sum of the prefetch sizes of the workers)
+            in the pool on every update-cycle
         """
 
         self.new_result_callback = new_result_callback
@@ -163,8 +169,9 @@ class Dispatcher(object):
                         if not w.is_alive():
                             self.logger.debug('DISPATCHER: skipping dead worker, %s' % wn)
                             continue
+                        w.n_prefetch = w.proxy.get_n_prefetch()
                         update = True
-                        self.logger.debug('DISPATCHER: discovered new worker, %s' % wn)
+                        self.logger.debug('DISPATCHER: discovered new worker, %s (prefetch %i)' % (wn, w.n_prefetch))
                         self.worker_pool[wn] = w
 
             # check the current list of workers
@@ -178,9 +185,7 @@ class Dispatcher(object):
                     update = True
                     # todo check if there were jobs running on that that need to be rescheduled
 
-                    current_job = self.worker_pool[wn].runs_job
-
-                    if not current_job is None:
+                    for current_job in self.worker_pool[wn].runs_jobs:
                         self.logger.debug('Job %s was not completed' % str(current_job))
                         crashed_jobs.add(current_job)
 
@@ -188,14 +193,15 @@ class Dispatcher(object):
                     self.idle_workers.discard(wn)
                     continue
 
-                if not self.worker_pool[wn].is_busy():
+                if self.worker_pool[wn].has_free_slot() and not self.worker_pool[wn].is_busy():
                     self.idle_workers.add(wn)
 
             # try to submit more jobs if something changed
             if update:
                 if not self.queue_callback is None:
+                    number_of_slots = self.number_of_slots()
                     self.discover_cond.release()
-                    self.queue_callback(len(self.worker_pool))
+                    self.queue_callback(number_of_slots)
                     self.discover_cond.acquire()
                 self.runner_cond.notify()
 
@@ -223,6 +229,10 @@ class Dispatcher(object):
         with self.discover_cond:
             return (len(self.worker_pool))
 
+    def number_of_slots(self):
+        # called with the condition acquired
+        return (sum(worker.n_prefetch for worker in self.worker_pool.values()))
+
     def job_runner(self):
 
         self.runner_cond.acquire()
@@ -246,7 +256,10 @@ class Dispatcher(object):
             self.logger.debug('DISPATCHER: starting job %s on %s' % (str(job.id), worker.name))
 
             job.time_it('started')
-            worker.runs_job = job.id
+            worker.runs_jobs.add(job.id)
+            if worker.has_free_slot():
+                # the worker queues the jobs it can not run yet
+                self.idle_workers.add(wn)
 
             worker.proxy.start_computation(self, job.id, **job.kwargs)
 
@@ -274,6 +287,8 @@ class Dispatcher(object):
             # fill in missing information
             job = self.running_jobs[id]
             job.time_it('finished')
+            # the worker side timestamps, when the job was actually run
+            job.timestamps.update(result.get('timestamps', {}))
             job.result = result['result']
             job.exception = result['exception']
             job.config_info = None
@@ -285,7 +300,7 @@ class Dispatcher(object):
 
             # label worker as idle again
             try:
-                self.worker_pool[job.worker_name].runs_job = None
+                self.worker_pool[job.worker_name].runs_jobs.discard(id)
                 self.worker_pool[job.worker_name].proxy._pyroRelease()
                 self.idle_workers.add(job.worker_name)
                 # notify the job_runner to check for more jobs to run
@@ -3,19 +3,23 @@ import os
 import threading
 import time
 from collections import defaultdict
-from typing import Dict
+from typing import Dict, Optional
 
 import numpy as np
 
 from ultraopt.facade.utils import get_wanted
 from ultraopt.multi_fidelity.iter import WarmStartIteration
 from ultraopt.multi_fidelity.iter_gen.base_gen import BaseIterGenerator
+from ultraopt.multi_fidelity.state_store import TrialStateStore
 from ultraopt.optimizer.base_opt import BaseOptimizer
+from ultraopt.pruning import PercentilePruner
 from ultraopt.utils.logging_ import get_logger
 from ultraopt.utils.progress import no_progress_callback
+from .connection import ConnectionDispatcher
 from .dispatcher import Dispatcher
 from ..result import Result
-from ..utils.misc import print_incumbent_trajectory, dump_checkpoint
+from ..utils.checkpoint import Checkpointer
+from ..utils.misc import print_incumbent_trajectory
 
 
 class Master(object):
@@ -38,7 +42,10 @@ class Master(object):
                  result_logger=None,
                  previous_result=None,
                  incumbents: Dict[float, dict] = None,
-                 incumbent_performances: Dict[float, float] = None
+                 incumbent_performances: Dict[float, float] = None,
+                 state_store: Optional[TrialStateStore] = None,
+                 pruner: Optional[PercentilePruner] = None,
+                 transport="Pyro4"
                  ):
         """The Master class is responsible for the book keeping and to decide what to run next. Optimizers are
                 instantiations of Master, that handle the important steps of deciding what configurations to run on what
@@ -86,9 +93,19 @@ class Master(object):
             a result logger that writes live results to disk
         previous_result:
             previous run to warmstart the run
+        state_store: ultraopt.multi_fidelity.state_store.TrialStateStore
+            per-config states, the directory of the state of a config is given to the workers as
+            its working_directory
+        pruner: ultraopt.pruning.PercentilePruner
+            prunes the trials that report bad intermediate losses, the workers get the losses
+            reported by the finished trials of the same budget
+        transport: str
+            "Pyro4" (nameserver, discovery and one RPC per job) or "Connection" (``ConnectionDispatcher``:
+            workers connect to ``self.dispatcher.address``, prefetch jobs and send their results in batches)
         """
         self.checkpoint_freq = checkpoint_freq
         self.checkpoint_file = checkpoint_file
+        self.checkpointer = None
         self.progress_callback = progress_callback
         iter_generator.initialize(optimizer)
         self.iter_generator = iter_generator
@@ -99,6 +116,11 @@ class Master(object):
         self.logger = get_logger(self)
 
         self.result_logger = result_logger
+        self.state_store = state_store
+        self.pruner = pruner
+        self.running_config_ids = set()
+        # (started, finished) of the jobs run by each worker
+        self.worker2timestamps = defaultdict(list)
 
         self.optimizer = optimizer
         self.time_ref = None
@@ -126,12 +148,20 @@ class Master(object):
             'time_ref': self.time_ref
         }
 
-        self.dispatcher = Dispatcher(
-            self.job_callback, queue_callback=self.adjust_queue_size,
-            run_id=run_id, ping_interval=ping_interval,
-            nameserver=nameserver, nameserver_port=nameserver_port,
-            host=host
-        )
+        if transport == "Pyro4":
+            self.dispatcher = Dispatcher(
+                self.job_callback, queue_callback=self.adjust_queue_size,
+                run_id=run_id, ping_interval=ping_interval,
+                nameserver=nameserver, nameserver_port=nameserver_port,
+                host=host
+            )
+        elif transport == "Connection":
+            self.dispatcher = ConnectionDispatcher(
+                self.job_callback, queue_callback=self.adjust_queue_size,
+                run_id=run_id, host=host
+            )
+        else:
+            raise ValueError(f"Invalid transport {transport} not in ['Pyro4', 'Connection']")
         self.incumbents = defaultdict(dict)
         self.incumbent_performances = defaultdict(lambda: np.inf)
         if incumbents is not None:
@@ -202,7 +232,10 @@ class Master(object):
         self.iter_cnt = 0
         self.wait_for_workers(min_n_workers)
 
-        iteration_kwargs.update({'result_logger': self.result_logger})
+        iteration_kwargs.update({'result_logger': self.result_logger, 'state_store': self.state_store})
+        if self.checkpoint_file is not None:
+            # the snapshots are serialized by the thread of the checkpointer, not in ``job_callback``
+            self.checkpointer = Checkpointer(self.optimizer, self.checkpoint_file, lock=self.thread_cond)
 
         if self.time_ref is None:
             self.time_ref = time.time()
@@ -250,6 +283,10 @@ class Master(object):
                     break
 
         self.thread_cond.release()
+        if self.checkpointer is not None:
+            # the runs that were not started (time limit) or not promoted are not counted in ``iter_cnt``
+            self.checkpointer.snapshot()
+            self.checkpointer.close()
 
         for i in self.warmstart_iteration:
             i.fix_timestamps(self.time_ref)
@@ -280,7 +317,9 @@ class Master(object):
         with self.thread_cond:
             self.logger.debug('job_callback for %s got condition' % str(job.id))
             self.num_running_jobs -= 1
-            if job.result is not None:
+            if "started" in job.timestamps and "finished" in job.timestamps:
+                self.worker2timestamps[job.worker_name].append((job.timestamps["started"], job.timestamps["finished"]))
+            if job.result is not None and not job.result.get("pruned"):
                 budget = job.kwargs["budget"]
                 challenger = job.kwargs["config"]
                 challenger_performance = job.result["loss"]
@@ -298,20 +337,37 @@ class Master(object):
                 self.result_logger(job)
             self.iterations[job.id[0]].register_result(job)
             self.optimizer.new_result(job)
+            self.running_config_ids.discard(job.id)
+            if self.state_store is not None:
+                self.state_store.update_size(job.id)
+                self.state_store.evict(self.running_config_ids)
             # 更新进度条等操作
             max_budget, best_loss, _ = get_wanted(self.optimizer)
             self.progress_ctx.postfix = f"max budget: {max_budget}, best loss: {best_loss:.3f}"
             self.progress_ctx.update(1)
             self.iter_cnt += 1
-            if self.checkpoint_file is not None:
-                if (self.iter_cnt - 1) % self.checkpoint_freq == 0 or self.iter_cnt == self.all_n_iterations:
-                    dump_checkpoint(self.optimizer, self.checkpoint_file)
+            if self.checkpointer is not None:
+                # only queued, written by the thread of the checkpointer
+                self.checkpointer.log_result(job.kwargs["config"], job.kwargs["budget"], job.result)
+                if self.iter_cnt % self.checkpoint_freq == 0:
+                    self.checkpointer.snapshot()
             if self.num_running_jobs <= self.job_queue_sizes[0]:
                 self.logger.debug("HBMASTER: Trying to run another job!")
                 self.thread_cond.notify()
 
         self.logger.debug('job_callback for %s finished' % str(job.id))
 
+    def get_idle_gaps(self) -> Dict[str, np.ndarray]:
+        '''
+        The idle times of each worker between the end of a job and the start of its next job, e.g. the time
+        the worker waited for the master to refit its model and sample a new configuration.
+        '''
+        worker2idle_gaps = {}
+        for worker_name, timestamps in self.worker2timestamps.items():
+            timestamps = np.array(sorted(timestamps)).reshape([-1, 2])
+            worker2idle_gaps[worker_name] = np.maximum(timestamps[1:, 0] - timestamps[:-1, 1], 0)
+        return worker2idle_gaps
+
     def _queue_wait(self):
         """
         helper function to wait for the queue to not overflow/underload it
@@ -333,9 +389,18 @@ class Master(object):
         self.logger.debug('HBMASTER: trying submitting job %s to dispatcher' % str(config_id))
         with self.thread_cond:
             self.logger.debug('HBMASTER: submitting job %s to dispatcher' % str(config_id))
+            if self.state_store is None:
+                working_directory = self.working_directory
+            else:
+                working_directory = self.state_store.get(config_id).directory
+            kwargs = {}
+            if self.pruner is not None:
+                # pairs instead of a dict, so that it can be serialized for the RPC
+                kwargs["step2losses"] = list(self.optimizer.get_step2losses(budget).items())
             self.dispatcher.submit_job(config_id, config=config, config_info=config_info, budget=budget,
-                                       working_directory=self.working_directory)
+                                       working_directory=working_directory, **kwargs)
             self.num_running_jobs += 1
+            self.running_config_ids.add(config_id)
 
         # shouldn't the next line be executed while holding the condition?
         self.logger.debug("HBMASTER: job %s submitted to dispatcher" % str(config_id))
@@ -7,11 +7,14 @@ import socket
 import sys
 import threading
 import time
+from collections import deque
 from uuid import uuid4
 
 import Pyro4
 
 # from autoflow.utils.sys_ import get_trance_back_msg
+from ultraopt.multi_fidelity.state_store import TrialState
+from ultraopt.pruning import Reporter, run_eval_func
 from ultraopt.utils.logging_ import get_logger
 
 
@@ -33,7 +36,8 @@ class Worker(object):
             host=None,
             worker_id=None,
             timeout=None,
-            debug=False
+            debug=False,
+            n_prefetch=1
     ):
         """
 
@@ -56,6 +60,10 @@ class Worker(object):
             Towards the end of a long run with multiple workers, this helps to shutdown idling workers. We recommend
             a timeout that is roughly half the time it would take for the second largest budget to finish.
             The default (None) means that the worker will wait indefinitely and never shutdown on its own.
+        n_prefetch: int
+            number of jobs the worker accepts at a time, the jobs it can not run yet wait in a local queue.
+            With more than one, the next job is already there when a job finishes, so the worker does not
+            idle while the master refits its model and samples a new configuration.
         """
         self.debug = debug
         self.run_id = run_id
@@ -68,6 +76,9 @@ class Worker(object):
         self.timer = None
         self.eval_func = None
         self.support_budget = False
+        self.support_state = False
+        self.support_report = False
+        self.pruner = None
         worker_id = str(worker_id)
         if not worker_id is None:
             self.worker_id += f".{worker_id}"
@@ -77,12 +88,18 @@ class Worker(object):
 
         self.logger = get_logger(f"Worker[{self.manifest_id}]")  # 分布式环境下的命名问题
 
+        self.n_prefetch = n_prefetch
         self.busy = False
+        self.waiting_jobs = deque()
+        self.shutdown_all_threads = False
         self.thread_cond = threading.Condition(threading.Lock())
 
-    def initialize(self, eval_func):
+    def initialize(self, eval_func, pruner=None):
         self.eval_func = eval_func
+        self.pruner = pruner
         self.support_budget = "budget" in inspect.signature(eval_func).parameters.keys()
+        self.support_state = "state" in inspect.signature(eval_func).parameters.keys()
+        self.support_report = "report" in inspect.signature(eval_func).parameters.keys()
 
     def load_nameserver_credentials(self, working_directory, num_tries=60, interval=1):
         """
@@ -183,12 +200,20 @@ class Worker(object):
             uri = self.pyro_daemon.register(self, self.worker_id)
             ns.register(self.worker_id, uri)
 
+        compute_thread = threading.Thread(target=self.process_jobs, name='worker %s jobs' % self.worker_id)
+        compute_thread.daemon = True
+        compute_thread.start()
+
         self.pyro_daemon.requestLoop()
 
+        with self.thread_cond:
+            self.shutdown_all_threads = True
+            self.thread_cond.notify_all()
+
         with Pyro4.locateNS(self.nameserver, port=self.nameserver_port) as ns:
             ns.remove(self.worker_id)
 
-    def compute(self, config_id, config, config_info, budget, working_directory):
+    def compute(self, config_id, config, config_info, budget, working_directory, step2losses=None):
         """ The function you have to overload implementing your computation.
 
         Parameters
@@ -205,6 +230,8 @@ class Worker(object):
             the budget for the evaluate
         working_directory: str
             a name of a directory that is unique to this configuration. Use this to store intermediate results on lower budgets that can be reused later for a larger budget (for iterative algorithms, for example).
+        step2losses: list
+            the intermediate losses the finished trials of the same budget reported at each step, for the pruner
         Returns
         -------
         dict:
@@ -215,54 +242,84 @@ class Worker(object):
         if self.eval_func is None:
             raise NotImplementedError(
                 "Subclass ultraopt.distributed.worker and overwrite the compute method in your worker script")
+        kwargs = {}
         if self.support_budget:
-            loss = self.eval_func(config, budget=budget)
-        else:
-            loss = self.eval_func(config)
-        return {
-            "loss": loss
-        }
+            kwargs["budget"] = budget
+        if self.support_state:
+            kwargs["state"] = TrialState(working_directory)
+        if self.support_report:
+            kwargs["report"] = Reporter(self.pruner, step2losses)
+        # a pruned trial is recorded with its last reported loss
+        return run_eval_func(self.eval_func, config, **kwargs)
 
     @Pyro4.expose
     @Pyro4.oneway
     def start_computation(self, callback, config_id, *args, **kwargs):
-
+        # queue the job, it is run by the ``process_jobs`` thread
         with self.thread_cond:
-            while self.busy:
-                self.thread_cond.wait()
-            self.busy = True
+            self.waiting_jobs.append((callback, config_id, args, kwargs))
+            self.thread_cond.notify()
         if not self.timeout is None and not self.timer is None:
             self.timer.cancel()
+
+    def process_jobs(self):
+        while True:
+            with self.thread_cond:
+                while not self.waiting_jobs:
+                    if self.shutdown_all_threads:
+                        return
+                    self.thread_cond.wait()
+                callback, config_id, args, kwargs = self.waiting_jobs.popleft()
+                self.busy = True
+            self.process_job(callback, config_id, *args, **kwargs)
+
+    def process_job(self, callback, config_id, *args, **kwargs):
         self.logger.debug('WORKER: start processing job %s' % str(config_id))
         self.logger.debug('WORKER: args: %s' % (str(args)))
         self.logger.debug('WORKER: kwargs: %s' % (str(kwargs)))
+        timestamps = {'started': time.time()}
         try:
             result = {'result': self.compute(*args, config_id=config_id, **kwargs),
                       'exception': None}
         except Exception as e:
             self.logger.error(str(e))
             self.logger.error(kwargs)
-            if self.debug:
-                self.logger.error("re-raise exception")
-                raise sys.exc_debug()[1]
             result = {'result': None,
                       'exception': str(e)}
-        finally:
-            self.logger.debug('WORKER: done with job %s, trying to register it.' % str(config_id))
-            with self.thread_cond:
-                self.busy = False
-                callback.register_result(config_id, result)
-                self.thread_cond.notify()
-        self.logger.debug('WORKER: registered result for job %s with dispatcher' % str(config_id))
-        if not self.timeout is None:
+            if self.debug:
+                # the exception kills the ``process_jobs`` thread: the failed job is registered and the worker
+                # shuts down (its queued jobs are registered as crashed by the dispatcher), so the master
+                # does not wait forever
+                self.register_result(callback, config_id, result, timestamps)
+                self.logger.error("re-raise exception")
+                self.shutdown()
+                raise
+        self.register_result(callback, config_id, result, timestamps)
+        if not self.timeout is None and not self.waiting_jobs:
             self.timer = threading.Timer(self.timeout, self.shutdown)
             self.timer.daemon = True
             self.timer.start()
         return (result)
 
+    def register_result(self, callback, config_id, result, timestamps):
+        self.logger.debug('WORKER: done with job %s, trying to register it.' % str(config_id))
+        timestamps['finished'] = time.time()
+        with self.thread_cond:
+            self.busy = False
+        # the worker side timestamps, the idle time of the worker is measured from them
+        result['timestamps'] = timestamps
+        callback.register_result(config_id, result)
+        self.logger.debug('WORKER: registered result for job %s with dispatcher' % str(config_id))
+
     @Pyro4.expose
     def is_busy(self):
-        return (self.busy)
+        # no free slot for another job
+        with self.thread_cond:
+            return (len(self.waiting_jobs) + int(self.busy) >= self.n_prefetch)
+
+    @Pyro4.expose
+    def get_n_prefetch(self):
+        return (self.n_prefetch)
 
     @Pyro4.expose
     @Pyro4.oneway
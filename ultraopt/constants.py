@@ -4,7 +4,7 @@
 # @Date    : 2020-12-20
 # @Contact    : qichun.tang@bupt.edu.cn
 valid_optimizers = ["ETPE", "Forest", "GBRT", "Random"]
-valid_parallel_strategies = ["Serial", "MapReduce", "AsyncComm"]
+valid_parallel_strategies = ["Serial", "MapReduce", "AsyncComm", "ProcessPool", "Asyncio"]
 valid_warm_start_strategies = ["continue", "resume"]
 
 
@@ -3,25 +3,30 @@
 # @Author  : qichun tang
 # @Date    : 2020-12-17
 # @Contact    : qichun.tang@bupt.edu.cn
-import importlib
+import asyncio
 import inspect
 import logging
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from typing import Callable, Union, Optional, List, Type
 from uuid import uuid4
 
 from ConfigSpace import ConfigurationSpace, Configuration
 from joblib import Parallel, delayed
 
+from ultraopt.async_comm.connection import ConnectionWorker
 from ultraopt.async_comm.master import Master
 from ultraopt.async_comm.nameserver import NameServer
 from ultraopt.async_comm.worker import Worker
+from ultraopt.facade.fmin_async import run_asyncio
 from ultraopt.facade.result import FMinResult
-from ultraopt.facade.utils import warm_start_optimizer, get_wanted
-from ultraopt.hdl import hdl2cs
-from ultraopt.multi_fidelity import BaseIterGenerator, CustomIterGenerator
+from ultraopt.facade.utils import warm_start_optimizer, get_wanted, get_config_space, get_optimizer, \
+    get_result_logger
+from ultraopt.multi_fidelity import BaseIterGenerator, CustomIterGenerator, IterationScheduler, TrialStateStore, \
+    get_eval_kwargs
 from ultraopt.optimizer.base_opt import BaseOptimizer
+from ultraopt.pruning import PercentilePruner, run_eval_func
 from ultraopt.utils import progress
-from ultraopt.utils.misc import dump_checkpoint
+from ultraopt.utils.checkpoint import Checkpointer
 
 
 def fmin(
@@ -43,7 +48,14 @@ def fmin(
         verbose=0,
         run_id=None,
         ns_host="127.0.0.1",
-        ns_port=0
+        ns_port=0,
+        worker_initializer: Optional[Callable] = None,
+        worker_initargs=(),
+        state_store: Optional[TrialStateStore] = None,
+        pruner: Optional[PercentilePruner] = None,
+        transport="Pyro4",
+        n_prefetch=1,
+        result_logger=None
 ):
     # fixme: 这合理吗
     if verbose <= 0:
@@ -54,114 +66,242 @@ def fmin(
         logging.basicConfig(level=logging.DEBUG)
     # 设计目标：单机并行、多保真优化
     # ------------   config_space   ---------------#
-    if isinstance(config_space, dict):
-        cs_ = hdl2cs(config_space)
-    elif isinstance(config_space, ConfigurationSpace):
-        cs_ = config_space
-    else:
-        raise NotImplementedError
+    cs_ = get_config_space(config_space)
     # ------------      budgets     ---------------#
     if multi_fidelity_iter_generator is None:
         budgets_ = [1]
     else:
         budgets_ = multi_fidelity_iter_generator.get_budgets()
     # ------------ optimizer ---------------#
-    if inspect.isclass(optimizer):
-        if not issubclass(optimizer, BaseOptimizer):
-            raise ValueError(f"optimizer {optimizer} is not subclass of BaseOptimizer")
-        opt_ = optimizer()
-    elif isinstance(optimizer, BaseOptimizer):
-        opt_ = optimizer
-    elif isinstance(optimizer, str):
-        try:
-            opt_ = getattr(importlib.import_module("ultraopt.optimizer"),
-                           f"{optimizer}Optimizer")()
-        except Exception:
-            raise ValueError(f"Invalid optimizer string-indicator: {optimizer}")
-    else:
-        raise NotImplementedError
+    opt_ = get_optimizer(optimizer)
     if show_progressbar:
         progress_callback = progress.default_callback
     else:
         progress_callback = progress.no_progress_callback
-    # 3种运行模式：
-    # 1. 串行，方便调试，不支持multi-fidelity
-    # 2. AsyncComm，RPC，支持multi-fidelity
-    # 3. MapReduce，不支持multi-fidelity
+    # 运行模式：
+    # 1. 串行，方便调试
+    # 2. AsyncComm，RPC
+    # 3. MapReduce
+    # 4. ProcessPool，常驻进程池异步提交
+    # 5. Asyncio，事件循环中运行协程（async def eval_func）
+    # 都支持multi-fidelity，除AsyncComm外由进程内的IterationScheduler调度
+    if asyncio.iscoroutinefunction(eval_func):
+        # only the event loop can run a coroutine function
+        parallel_strategy = "Asyncio"
     # non-parallelism debug mode
-    if auto_identify_serial_strategy and n_jobs == 1 and multi_fidelity_iter_generator is None:
+    elif auto_identify_serial_strategy and n_jobs == 1:
         parallel_strategy = "Serial"
-    if parallel_strategy in ["Serial", "MapReduce"]:
-        budgets_ = [1]
     # initialize optimizer
     opt_.initialize(cs_, budgets_, random_state, initial_points)
     opt_ = warm_start_optimizer(opt_, previous_result, warm_start_strategy)
-    if parallel_strategy == "Serial":
-        with progress_callback(
-                initial=0, total=n_iterations
-        ) as progress_ctx:
-            for counts in range(n_iterations):
-                config, _ = opt_.ask()
-                loss = eval_func(config)
-                opt_.tell(config, loss)
-                _, best_loss, _ = get_wanted(opt_)
-                progress_ctx.postfix = f"best loss: {best_loss:.3f}"
-                progress_ctx.update(1)
-                if checkpoint_file is not None:
-                    if (counts % checkpoint_freq == 0 and counts != 0) \
-                            or (counts == n_iterations - 1):
-                        dump_checkpoint(opt_, checkpoint_file)
-    elif parallel_strategy == "AsyncComm":
-        # start name-server
-        if run_id is None:
-            run_id = uuid4().hex
-        if multi_fidelity_iter_generator is None:
-            # todo: warning
-            multi_fidelity_iter_generator = CustomIterGenerator([1], [1])
-        NS = NameServer(run_id=run_id, host=ns_host, port=ns_port)  # get_a_free_port(ns_port, ns_host)
-        _, ns_port = NS.start()
-        # start n workers
-        workers = [Worker(run_id=run_id, nameserver=ns_host, nameserver_port=ns_port,
-                          host=ns_host, worker_id=i)
-                   for i in range(n_jobs)]
-        for worker in workers:
-            worker.initialize(eval_func)
-            worker.run(True, "thread")
-        # start master
-        master = Master(
-            run_id, opt_, multi_fidelity_iter_generator, progress_callback=progress_callback,
-            checkpoint_file=checkpoint_file, checkpoint_freq=checkpoint_freq,
-            nameserver=ns_host, nameserver_port=ns_port, host=ns_host)
-        result = master.run(n_iterations)
-        master.shutdown(True)
-        NS.shutdown()
-        # todo: 将result添加到返回结果中
-    elif parallel_strategy == "MapReduce":
-        # todo: 支持multi-fidelity
-        counts = 0
-        with progress_callback(
-                initial=0, total=n_iterations
-        ) as progress_ctx:
-            while counts < n_iterations:
-                n_parallels = min(n_jobs, n_iterations - counts)
-                config_info_pairs = opt_.ask(n_points=n_parallels)
-                losses = Parallel(n_jobs=n_parallels)(
-                    delayed(eval_func)(config)
-                    for config, _ in config_info_pairs
-                )
-                for j, (loss, (config, _)) in enumerate(zip(losses, config_info_pairs)):
-                    opt_.tell(config, loss, update_model=(j == n_parallels - 1))
-                counts += n_parallels
-                _, best_loss, _ = get_wanted(opt_)
-                progress_ctx.postfix = f"best loss: {best_loss:.3f}"
-                progress_ctx.update(n_parallels)
-                iteration = counts // n_jobs
-                if checkpoint_file is not None:
-                    if ((iteration - 1) % checkpoint_freq == 0) \
-                            or (counts == n_iterations):
-                        dump_checkpoint(opt_, checkpoint_file)
-    else:
-        raise NotImplementedError
+    # per-config states, for evaluation functions that resume from the checkpoint of the previous budget
+    is_temporary_state_store = state_store is None and "state" in inspect.signature(eval_func).parameters.keys()
+    if is_temporary_state_store:
+        state_store = TrialStateStore()
+    # a live result logger, or the directory of a JsonResultLogger
+    result_logger_, is_own_result_logger = get_result_logger(result_logger)
+    # the runs of multi-fidelity iterations, of trials that can be pruned and of logged runs are scheduled in process
+    use_scheduler = multi_fidelity_iter_generator is not None or pruner is not None or result_logger_ is not None
+    scheduler = None
+    if use_scheduler and parallel_strategy in ["Serial", "MapReduce", "ProcessPool"]:
+        scheduler = IterationScheduler(opt_, multi_fidelity_iter_generator, n_iterations,
+                                       checkpoint_file, checkpoint_freq, state_store, pruner, result_logger_)
+    # the results are logged by a background thread, the optimizer is only dumped every checkpoint_freq results
+    checkpointer = None
+    if checkpoint_file is not None and not use_scheduler and parallel_strategy in ["Serial", "MapReduce", "ProcessPool"]:
+        checkpointer = Checkpointer(opt_, checkpoint_file)
+    try:
+        if parallel_strategy == "Serial" and use_scheduler:
+            with progress_callback(
+                    initial=0, total=scheduler.all_n_runs
+            ) as progress_ctx:
+                while True:
+                    job = scheduler.get_next_run()
+                    if job is None:
+                        break
+                    job.result = run_eval_func(eval_func, job.kwargs["config"], **get_eval_kwargs(eval_func, job))
+                    scheduler.register_result(job)
+                    max_budget, best_loss, _ = get_wanted(opt_)
+                    progress_ctx.postfix = f"max budget: {max_budget}, best loss: {best_loss:.3f}"
+                    progress_ctx.update(1)
+        elif parallel_strategy == "Serial":
+            with progress_callback(
+                    initial=0, total=n_iterations
+            ) as progress_ctx:
+                for counts in range(n_iterations):
+                    config, _ = opt_.ask()
+                    loss = eval_func(config)
+                    opt_.tell(config, loss)
+                    _, best_loss, _ = get_wanted(opt_)
+                    progress_ctx.postfix = f"best loss: {best_loss:.3f}"
+                    progress_ctx.update(1)
+                    if checkpointer is not None:
+                        checkpointer.log_result(config, 1, {"loss": loss})
+                        if (counts + 1) % checkpoint_freq == 0:
+                            checkpointer.snapshot()
+        elif parallel_strategy == "AsyncComm":
+            if run_id is None:
+                run_id = uuid4().hex
+            if multi_fidelity_iter_generator is None:
+                # todo: warning
+                multi_fidelity_iter_generator = CustomIterGenerator([1], [1])
+            if transport == "Connection":
+                # no nameserver, the workers connect to the listener of the master, prefetch n_prefetch jobs
+                # and send their results back in batches
+                master = Master(
+                    run_id, opt_, multi_fidelity_iter_generator, progress_callback=progress_callback,
+                    checkpoint_file=checkpoint_file, checkpoint_freq=checkpoint_freq,
+                    host=ns_host, state_store=state_store, pruner=pruner, transport=transport,
+                    result_logger=result_logger_)
+                workers = [ConnectionWorker(master.dispatcher.address, run_id, worker_id=i, n_prefetch=n_prefetch)
+                           for i in range(n_jobs)]
+                for worker in workers:
+                    worker.initialize(eval_func, pruner)
+                    worker.run(True, "thread")
+                result = master.run(n_iterations)
+                master.shutdown(True)
+            else:
+                # start name-server
+                NS = NameServer(run_id=run_id, host=ns_host, port=ns_port)  # get_a_free_port(ns_port, ns_host)
+                _, ns_port = NS.start()
+                # start n workers
+                workers = [Worker(run_id=run_id, nameserver=ns_host, nameserver_port=ns_port,
+                                  host=ns_host, worker_id=i, n_prefetch=n_prefetch)
+                           for i in range(n_jobs)]
+                for worker in workers:
+                    worker.initialize(eval_func, pruner)
+                    worker.run(True, "thread")
+                # start master
+                master = Master(
+                    run_id, opt_, multi_fidelity_iter_generator, progress_callback=progress_callback,
+                    checkpoint_file=checkpoint_file, checkpoint_freq=checkpoint_freq,
+                    nameserver=ns_host, nameserver_port=ns_port, host=ns_host, state_store=state_store, pruner=pruner,
+                    result_logger=result_logger_)
+                result = master.run(n_iterations)
+                master.shutdown(True)
+                NS.shutdown()
+            # todo: 将result添加到返回结果中
+        elif parallel_strategy == "MapReduce" and use_scheduler:
+            # a batch holds at most n_jobs runs, less when the current stages wait for their last runs
+            with progress_callback(
+                    initial=0, total=scheduler.all_n_runs
+            ) as progress_ctx:
+                while True:
+                    jobs = []
+                    while len(jobs) < n_jobs:
+                        job = scheduler.get_next_run()
+                        if job is None:
+                            break
+                        jobs.append(job)
+                    if not jobs:
+                        break
+                    # a constant n_jobs lets joblib reuse its workers between batches of different sizes
+                    results = Parallel(n_jobs=n_jobs)(
+                        delayed(run_eval_func)(eval_func, job.kwargs["config"], **get_eval_kwargs(eval_func, job))
+                        for job in jobs
+                    )
+                    # refit the model of each budget once per batch
+                    budget2last = {job.kwargs["budget"]: j for j, job in enumerate(jobs)}
+                    for j, (result, job) in enumerate(zip(results, jobs)):
+                        job.result = result
+                        scheduler.register_result(job, update_model=(budget2last[job.kwargs["budget"]] == j))
+                    max_budget, best_loss, _ = get_wanted(opt_)
+                    progress_ctx.postfix = f"max budget: {max_budget}, best loss: {best_loss:.3f}"
+                    progress_ctx.update(len(jobs))
+        elif parallel_strategy == "MapReduce":
+            counts = 0
+            with progress_callback(
+                    initial=0, total=n_iterations
+            ) as progress_ctx:
+                while counts < n_iterations:
+                    n_parallels = min(n_jobs, n_iterations - counts)
+                    config_info_pairs = opt_.ask(n_points=n_parallels)
+                    losses = Parallel(n_jobs=n_parallels)(
+                        delayed(eval_func)(config)
+                        for config, _ in config_info_pairs
+                    )
+                    for j, (loss, (config, _)) in enumerate(zip(losses, config_info_pairs)):
+                        opt_.tell(config, loss, update_model=(j == n_parallels - 1))
+                        if checkpointer is not None:
+                            checkpointer.log_result(config, 1, {"loss": loss})
+                    _, best_loss, _ = get_wanted(opt_)
+                    progress_ctx.postfix = f"best loss: {best_loss:.3f}"
+                    progress_ctx.update(n_parallels)
+                    if checkpointer is not None:
+                        if counts // checkpoint_freq != (counts + n_parallels) // checkpoint_freq:
+                            checkpointer.snapshot()
+                    counts += n_parallels
+        elif parallel_strategy == "ProcessPool" and use_scheduler:
+            future2job = {}
+            with progress_callback(
+                    initial=0, total=scheduler.all_n_runs
+            ) as progress_ctx, ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=worker_initializer, initargs=worker_initargs
+            ) as executor:
+                while True:
+                    while len(future2job) < n_jobs:
+                        job = scheduler.get_next_run()
+                        if job is None:
+                            break
+                        eval_kwargs = get_eval_kwargs(eval_func, job)
+                        future2job[executor.submit(run_eval_func, eval_func, job.kwargs["config"], **eval_kwargs)] = job
+                    if not future2job:
+                        break
+                    done, _ = wait(future2job, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = future2job.pop(future)
+                        job.result = future.result()
+                        scheduler.register_result(job)
+                        max_budget, best_loss, _ = get_wanted(opt_)
+                        progress_ctx.postfix = f"max budget: {max_budget}, best loss: {best_loss:.3f}"
+                        progress_ctx.update(1)
+        elif parallel_strategy == "ProcessPool":
+            # the workers live for the whole run, ``worker_initializer(*worker_initargs)`` runs once per worker
+            # (e.g. to load the data), a new config is asked as soon as any evaluation finishes
+            counts = 0
+            n_submitted = 0
+            future2config = {}
+            with progress_callback(
+                    initial=0, total=n_iterations
+            ) as progress_ctx, ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=worker_initializer, initargs=worker_initargs
+            ) as executor:
+                while counts < n_iterations:
+                    while n_submitted < n_iterations and len(future2config) < n_jobs:
+                        config, _ = opt_.ask()
+                        future2config[executor.submit(eval_func, config)] = config
+                        n_submitted += 1
+                    done, _ = wait(future2config, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        config = future2config.pop(future)
+                        loss = future.result()
+                        opt_.tell(config, loss)
+                        counts += 1
+                        _, best_loss, _ = get_wanted(opt_)
+                        progress_ctx.postfix = f"best loss: {best_loss:.3f}"
+                        progress_ctx.update(1)
+                        if checkpointer is not None:
+                            checkpointer.log_result(config, 1, {"loss": loss})
+                            if counts % checkpoint_freq == 0:
+                                checkpointer.snapshot()
+        elif parallel_strategy == "Asyncio":
+            asyncio.run(run_asyncio(
+                eval_func, opt_, multi_fidelity_iter_generator, n_iterations, n_jobs,
+                progress_callback=progress_callback, checkpoint_file=checkpoint_file, checkpoint_freq=checkpoint_freq,
+                state_store=state_store, pruner=pruner, result_logger=result_logger_))
+        else:
+            raise NotImplementedError
+    finally:
+        # the last results are snapshotted even if the run stops early (e.g. an exception of the evaluation)
+        if scheduler is not None:
+            scheduler.close()
+        if checkpointer is not None:
+            checkpointer.snapshot()
+            checkpointer.close()
+    if is_own_result_logger:
+        result_logger_.close()
+    if is_temporary_state_store:
+        state_store.clear()
 
     # max_budget, best_loss, best_config = get_wanted(opt_)
     return FMinResult(opt_)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Union, Optional, List, Type
+
+from ConfigSpace import ConfigurationSpace, Configuration
+
+from ultraopt.facade.result import FMinResult
+from ultraopt.facade.utils import warm_start_optimizer, get_wanted, get_config_space, get_optimizer, get_result_logger
+from ultraopt.multi_fidelity import BaseIterGenerator, IterationScheduler, TrialStateStore, get_eval_kwargs
+from ultraopt.optimizer.base_opt import BaseOptimizer
+from ultraopt.pruning import PercentilePruner, TrialPruned, run_eval_func
+from ultraopt.structure import Job
+from ultraopt.utils import progress
+from ultraopt.utils.logging_ import get_logger
+
+logger = get_logger(__name__)
+
+
+async def run_asyncio(
+        eval_func: Callable,
+        optimizer: BaseOptimizer,
+        iter_generator: Optional[BaseIterGenerator] = None,
+        n_iterations=100,
+        n_jobs=1,
+        progress_callback=progress.no_progress_callback,
+        checkpoint_file=None,
+        checkpoint_freq=10,
+        state_store: Optional[TrialStateStore] = None,
+        pruner: Optional[PercentilePruner] = None,
+        result_logger=None
+):
+    '''
+    Event loop version of ``Master.run``: keeps up to ``n_jobs`` evaluations in flight, the runs of the
+    multi-fidelity iterations are scheduled by an ``IterationScheduler``.
+
+    ``eval_func`` can be an ``async def`` function (awaited in the loop) or a plain function (run in the
+    default executor). Sampling and model refits of the optimizer run in a single worker thread,
+    so the event loop is never blocked and the optimizer is never used by two threads at once.
+    '''
+    loop = asyncio.get_event_loop()
+    is_coroutine = asyncio.iscoroutinefunction(eval_func)
+    scheduler = IterationScheduler(optimizer, iter_generator, n_iterations, checkpoint_file, checkpoint_freq,
+                                   state_store, pruner, result_logger)
+
+    async def evaluate(job: Job):
+        config = job.kwargs["config"]
+        kwargs = get_eval_kwargs(eval_func, job)
+        job.time_it("started")
+        try:
+            if is_coroutine:
+                report = job.kwargs["report"]
+                try:
+                    job.result = report.get_result(await eval_func(config, **kwargs))
+                except TrialPruned:
+                    job.result = report.get_result(pruned=True)
+            else:
+                job.result = await loop.run_in_executor(None, partial(run_eval_func, eval_func, config, **kwargs))
+        except Exception as e:
+            logger.error(str(e))
+            logger.error(job.kwargs)
+            job.exception = str(e)
+        job.time_it("finished")
+        return job
+
+    def register_result(job: Job):
+        scheduler.register_result(job)
+        max_budget, best_loss, _ = get_wanted(optimizer)
+        return f"max budget: {max_budget}, best loss: {best_loss:.3f}"
+
+    tasks = set()
+    try:
+        with progress_callback(
+                initial=0, total=scheduler.all_n_runs
+        ) as progress_ctx, ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                while len(tasks) < n_jobs:
+                    job = await loop.run_in_executor(executor, scheduler.get_next_run)
+                    if job is None:
+                        break
+                    tasks.add(loop.create_task(evaluate(job)))
+                if not tasks:
+                    break
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    progress_ctx.postfix = await loop.run_in_executor(executor, register_result, task.result())
+                    progress_ctx.update(1)
+    finally:
+        scheduler.close()
+    return scheduler.iterations
+
+
+async def fmin_async(
+        eval_func: Callable,
+        config_space: Union[ConfigurationSpace, dict],
+        optimizer: Union[BaseOptimizer, str, Type] = "ETPE",
+        initial_points: Union[None, List[Configuration], List[dict]] = None,
+        random_state=42,
+        n_iterations=100,
+        n_jobs=1,
+        multi_fidelity_iter_generator: Optional[BaseIterGenerator] = None,
+        previous_result: Union[FMinResult, BaseOptimizer, str, None] = None,
+        warm_start_strategy="continue",
+        show_progressbar=True,
+        checkpoint_file=None,
+        checkpoint_freq=10,
+        state_store: Optional[TrialStateStore] = None,
+        pruner: Optional[PercentilePruner] = None,
+        result_logger=None
+):
+    '''
+    Awaitable ``fmin`` for ``async def`` objective functions, e.g. inside a running event loop
+    (``fmin(..., parallel_strategy="Asyncio")`` starts its own loop).
+    '''
+    cs_ = get_config_space(config_space)
+    if multi_fidelity_iter_generator is None:
+        budgets_ = [1]
+    else:
+        budgets_ = multi_fidelity_iter_generator.get_budgets()
+    opt_ = get_optimizer(optimizer)
+    if show_progressbar:
+        progress_callback = progress.default_callback
+    else:
+        progress_callback = progress.no_progress_callback
+    opt_.initialize(cs_, budgets_, random_state, initial_points)
+    opt_ = warm_start_optimizer(opt_, previous_result, warm_start_strategy)
+    is_temporary_state_store = state_store is None and "state" in inspect.signature(eval_func).parameters.keys()
+    if is_temporary_state_store:
+        state_store = TrialStateStore()
+    result_logger_, is_own_result_logger = get_result_logger(result_logger)
+    await run_asyncio(
+        eval_func, opt_, multi_fidelity_iter_generator, n_iterations, n_jobs,
+        progress_callback=progress_callback, checkpoint_file=checkpoint_file, checkpoint_freq=checkpoint_freq,
+        state_store=state_store, pruner=pruner, result_logger=result_logger_)
+    if is_own_result_logger:
+        result_logger_.close()
+    if is_temporary_state_store:
+        state_store.clear()
+    return FMinResult(opt_)
@@ -3,6 +3,7 @@
 # @Author  : qichun tang
 # @Date    : 2020-12-19
 # @Contact    : qichun.tang@bupt.edu.cn
+import importlib
 import itertools
 from collections import defaultdict
 from copy import deepcopy
@@ -15,13 +16,14 @@ from terminaltables import AsciiTable
 
 from ultraopt.facade.utils import get_wanted
 from ultraopt.optimizer.base_opt import BaseOptimizer
+from ultraopt.utils.columnar import save_columnar, load_columnar, get_budget2obvs, get_runId2info
 from ultraopt.utils.misc import pbudget, get_import_error
 from ultraopt.viz import plot_convergence
 
 
 class FMinResult():
-    def __init__(self, optimizer: BaseOptimizer):
-        self.optimizer = deepcopy(optimizer)
+    def __init__(self, optimizer: BaseOptimizer, copy_optimizer=True):
+        self.optimizer = deepcopy(optimizer) if copy_optimizer else optimizer
         self.configs_table = []
         self.hyperparameters = [hp.name for hp in optimizer.config_space.get_hyperparameters()]
         self.is_multi_fidelity = len(optimizer.budgets) > 1
@@ -105,6 +107,24 @@ class FMinResult():
     def __getitem__(self, item):
         return self.__getattribute__(item)
 
+    def save(self, directory):
+        '''
+        Saves the observations in ``directory`` in a columnar format (a ``.npy`` file per column, see
+        ``ultraopt.utils.columnar.save_columnar``), ``FMinResult.load`` and ``fmin(previous_result=directory)``
+        memory-map them instead of unpickling an optimizer. The fitted models are not saved.
+        '''
+        save_columnar(directory, self.optimizer)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r") -> "FMinResult":
+        data = load_columnar(directory, mmap_mode)
+        optimizer_cls = getattr(importlib.import_module("ultraopt.optimizer"), data["optimizer"])
+        optimizer = optimizer_cls()
+        optimizer.initialize(data["config_space"], data["budgets"], budget2obvs=get_budget2obvs(data))
+        optimizer.runId2info.update(get_runId2info(data))
+        # copying would read the memory-mapped columns
+        return cls(optimizer, copy_optimizer=False)
+
     def plot_hi(self, budget=None, target_name="loss", loss2target_func=None, return_data_only=False):
         if budget is None:
             budget = self.max_budget
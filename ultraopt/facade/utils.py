@@ -3,41 +3,114 @@
 # @Author  : qichun tang
 # @Date    : 2020-12-18
 # @Contact    : qichun.tang@bupt.edu.cn
-
-from typing import Union
+import importlib
+import inspect
+from typing import Union, Type
 
 import numpy as np
-from joblib import load
+from ConfigSpace import ConfigurationSpace
 
+from ultraopt.hdl import hdl2cs
 from ultraopt.optimizer.base_opt import BaseOptimizer
+from ultraopt.result import JsonResultLogger
+from ultraopt.utils.checkpoint import load_checkpoint
+from ultraopt.utils.columnar import is_columnar_result, load_columnar, get_budget2obvs, get_runId2info
 from ultraopt.utils.config_space import get_dict_from_config
+from ultraopt.utils.hash import get_hash_of_config_space
+
+
+def get_config_space(config_space: Union[ConfigurationSpace, dict]) -> ConfigurationSpace:
+    if isinstance(config_space, dict):
+        return hdl2cs(config_space)
+    elif isinstance(config_space, ConfigurationSpace):
+        return config_space
+    else:
+        raise NotImplementedError
+
+
+def get_optimizer(optimizer: Union[BaseOptimizer, str, Type]) -> BaseOptimizer:
+    if inspect.isclass(optimizer):
+        if not issubclass(optimizer, BaseOptimizer):
+            raise ValueError(f"optimizer {optimizer} is not subclass of BaseOptimizer")
+        return optimizer()
+    elif isinstance(optimizer, BaseOptimizer):
+        return optimizer
+    elif isinstance(optimizer, str):
+        try:
+            return getattr(importlib.import_module("ultraopt.optimizer"),
+                           f"{optimizer}Optimizer")()
+        except Exception:
+            raise ValueError(f"Invalid optimizer string-indicator: {optimizer}")
+    else:
+        raise NotImplementedError
 
 
 def warm_start_optimizer(optimizer: BaseOptimizer, previous_result,
                          warm_start_strategy="resume"):
+    '''
+    The budgets of ``previous_result`` that are not budgets of ``optimizer`` (e.g. a multi-fidelity run
+    warm starting a run without multi-fidelity) are added to the optimizer, with their observations.
+    '''
     from ultraopt.facade.result import FMinResult
     if previous_result is None:
         return optimizer
-    if isinstance(previous_result, str):
-        previous_result = load(previous_result)  # type: Union[FMinResult, BaseOptimizer]
+    if warm_start_strategy not in ("resume", "continue"):
+        raise ValueError(f"Invalid warm_start_strategy {warm_start_strategy} not in ['resume', 'continue']")
+    if is_columnar_result(previous_result):
+        if warm_start_strategy == "resume":
+            # saved by FMinResult.save, the observations are memory-mapped and the models fitted once per budget
+            return warm_start_from_columnar(optimizer, previous_result)
+        directory = previous_result
+        previous_result = FMinResult.load(directory)
+        check_config_space(previous_result.optimizer.config_space, optimizer, directory)
+    elif isinstance(previous_result, str):
+        # the last snapshot of a checkpoint, with the results logged after it
+        previous_result = load_checkpoint(previous_result)  # type: Union[FMinResult, BaseOptimizer]
     if warm_start_strategy == "resume":
         for budget, obvs in previous_result.budget2obvs.items():
-            L = len(obvs["losses"])
-            for i in range(L):
-                optimizer.tell(
-                    get_dict_from_config(obvs["configs"][i]),
-                    obvs["losses"][i],
-                    budget,
-                    update_model=(i == L - 1))
-    elif warm_start_strategy == "continue":
-        if isinstance(previous_result, FMinResult):
-            prev_opt = previous_result.optimizer
-        else:
-            prev_opt = previous_result
-        prev_opt.resume_time()
-        return prev_opt
+            optimizer.add_budget(budget)
+            optimizer.tell_many(obvs["configs"], obvs["losses"], budget)
+        return optimizer
+    if isinstance(previous_result, FMinResult):
+        prev_opt = previous_result.optimizer
     else:
-        raise ValueError(f"Invalid warm_start_strategy {warm_start_strategy} not in ['resume', 'continue']")
+        prev_opt = previous_result
+    for budget in optimizer.budgets:
+        prev_opt.add_budget(budget)
+    prev_opt.resume_time()
+    return prev_opt
+
+
+def get_result_logger(result_logger):
+    '''Returns the result logger and whether it was created here (from a directory) and has to be closed.'''
+    if isinstance(result_logger, str):
+        return JsonResultLogger(result_logger), True
+    return result_logger, False
+
+
+def check_config_space(config_space: ConfigurationSpace, optimizer: BaseOptimizer, directory):
+    # the vectors are only meaningful in the same config space (bounds, choices, conditions and forbidden clauses)
+    if get_hash_of_config_space(config_space) != get_hash_of_config_space(optimizer.config_space):
+        raise ValueError(f"The config space of the result in {directory} differs from the config space of the optimizer")
+
+
+def warm_start_from_columnar(optimizer: BaseOptimizer, directory):
+    data = load_columnar(directory)
+    check_config_space(data["config_space"], optimizer, directory)
+    for budget, obvs in get_budget2obvs(data, optimizer.config_space).items():
+        if len(obvs) == 0:
+            continue
+        optimizer.add_budget(budget)
+        if len(optimizer.budget2obvs[budget]) == 0:
+            optimizer.budget2obvs[budget] = obvs
+        else:
+            optimizer.budget2obvs[budget].extend(list(obvs["configs"]), obvs["vectors"], obvs["losses"])
+        merged_obvs = optimizer.budget2obvs[budget]
+        optimizer._new_result(budget, merged_obvs["vectors"], merged_obvs["losses"])
+    for runId, info in get_runId2info(data).items():
+        optimizer.runId2info[runId] = info
+    # the saved times are relative to the start of the previous run
+    optimizer.resume_time()
     return optimizer
 
 
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import numpy as np
+from scipy.special import logsumexp
+from sklearn.utils import check_random_state
+
+
+class GaussianKDE():
+    '''
+    Gaussian Parzen-window estimator implemented with NumPy.
+
+    It is a drop-in replacement of ``sklearn.neighbors.KernelDensity(kernel="gaussian")`` for the
+    small-n, moderate-d densities fitted by TPE: no tree is built, ``score_samples`` evaluates the
+    (n_candidates × n_obs) kernel matrix in chunks and reduces it with a log-sum-exp.
+    ``bandwidth`` can be a scalar or one value per dimension.
+    '''
+
+    def __init__(self, bandwidth=1.0, chunk_size=4096):
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+
+    def fit(self, X, sample_weight=None):
+        X = np.asarray(X, dtype="float64")
+        self.data = X
+        N, M = X.shape
+        if sample_weight is None:
+            self.sample_weight = None
+            self.log_weight = np.full([N], -np.log(N))
+        else:
+            sample_weight = np.asarray(sample_weight, dtype="float64")
+            self.sample_weight = sample_weight
+            self.log_weight = np.log(sample_weight) - np.log(sample_weight.sum())
+        return self
+
+    def get_bandwidth(self, bandwidth_factor=1.0):
+        return np.broadcast_to(np.asarray(self.bandwidth, dtype="float64") * bandwidth_factor,
+                               (self.data.shape[1],))
+
+    def score_samples(self, X, bandwidth_factor=1.0):
+        X = np.asarray(X, dtype="float64")
+        bandwidth = self.get_bandwidth(bandwidth_factor)
+        M = self.data.shape[1]
+        data = self.data / bandwidth
+        data_sq = np.sum(data ** 2, axis=1)
+        log_norm = -np.sum(np.log(bandwidth)) - 0.5 * M * np.log(2 * np.pi)
+        log_pdf = np.zeros([X.shape[0]], dtype="float64")
+        for start in range(0, X.shape[0], self.chunk_size):
+            Z = X[start:start + self.chunk_size] / bandwidth
+            sq_dist = np.sum(Z ** 2, axis=1)[:, None] + data_sq[None, :] - 2 * Z @ data.T
+            np.maximum(sq_dist, 0, out=sq_dist)
+            log_pdf[start:start + self.chunk_size] = logsumexp(-0.5 * sq_dist + self.log_weight, axis=1)
+        return log_pdf + log_norm
+
+    def sample(self, n_samples=1, random_state=None, bandwidth_factor=1.0):
+        # draw in the same order as sklearn's KernelDensity.sample
+        rng = check_random_state(random_state)
+        u = rng.uniform(0, 1, size=n_samples)
+        if self.sample_weight is None:
+            idx = (u * self.data.shape[0]).astype(np.int64)
+        else:
+            cumsum_weight = np.cumsum(self.sample_weight)
+            idx = np.searchsorted(cumsum_weight, u * cumsum_weight[-1])
+        return np.atleast_2d(rng.normal(self.data[idx], self.get_bandwidth(bandwidth_factor)))
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 # @Author  : qichun tang
 # @Contact    : qichun.tang@bupt.edu.cn
+from bisect import bisect_right
 from copy import deepcopy
 from typing import List, Optional
 
@@ -15,10 +16,12 @@ from sklearn.model_selection import KFold
 from sklearn.neighbors import KernelDensity
 from sklearn.utils import check_random_state
 
-from ultraopt.utils.config_space import add_configs_origin, sample_configurations
+from ultraopt.learning.kde import GaussianKDE
+from ultraopt.utils.config_space import sample_configurations, get_array_from_configs
 from ultraopt.utils.config_transformer import ConfigTransformer
 from ultraopt.utils.hash import get_hash_of_array
 from ultraopt.utils.logging_ import get_logger
+from ultraopt.utils.obvs_store import reserve_rows
 
 
 def estimate_bw(data, bw_method="scott", cv_times=100):
@@ -46,11 +49,101 @@ def estimate_bw(data, bw_method="scott", cv_times=100):
     return bandwidth
 
 
+class KDEBuffer():
+    '''
+    Rows of the good (or bad) KDE of one group. A row is removed by moving the last row
+    into its slot, and running sums keep the std needed by scott/silverman up to date.
+    '''
+
+    def __init__(self, n_dims):
+        self.data = np.zeros([8, n_dims], dtype="float64")
+        self.y = np.zeros([8], dtype="float64")
+        self.ids = []
+        self.id2pos = {}
+        self.sum = 0.0
+        self.sq_sum = 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        return id_ in self.id2pos
+
+    @property
+    def X(self):
+        return self.data[:len(self.ids)]
+
+    @property
+    def Y(self):
+        return self.y[:len(self.ids)]
+
+    def add(self, id_, x, y):
+        n = len(self.ids)
+        self.data = reserve_rows(self.data, n + 1)
+        self.y = reserve_rows(self.y, n + 1)
+        self.data[n] = x
+        self.y[n] = y
+        self.ids.append(id_)
+        self.id2pos[id_] = n
+        self.sum += x.sum()
+        self.sq_sum += (x ** 2).sum()
+
+    def extend(self, ids, X, y):
+        n = len(self.ids)
+        n_new = len(ids)
+        self.data = reserve_rows(self.data, n + n_new)
+        self.y = reserve_rows(self.y, n + n_new)
+        self.data[n:n + n_new] = X
+        self.y[n:n + n_new] = y
+        for i, id_ in enumerate(ids):
+            self.ids.append(id_)
+            self.id2pos[id_] = n + i
+        self.sum += X.sum()
+        self.sq_sum += (X ** 2).sum()
+
+    def remove(self, id_):
+        pos = self.id2pos.pop(id_)
+        last = len(self.ids) - 1
+        x = self.data[pos].copy()
+        y = self.y[pos]
+        if pos != last:
+            self.data[pos] = self.data[last]
+            self.y[pos] = self.y[last]
+            self.ids[pos] = self.ids[last]
+            self.id2pos[self.ids[pos]] = pos
+        self.ids.pop()
+        self.sum -= x.sum()
+        self.sq_sum -= (x ** 2).sum()
+        return x, y
+
+    def std(self):
+        # equals to np.std(self.X, ddof=1)
+        count = len(self.ids) * self.data.shape[1]
+        if count <= 1:
+            return np.nan
+        var = (self.sq_sum - self.sum ** 2 / count) / (count - 1)
+        return np.sqrt(max(var, 0))
+
+
+class TPEGroup():
+    '''Active observations of one group, sorted by loss and split into good and bad KDE buffers.'''
+
+    def __init__(self, n_dims):
+        self.sorted_y = []
+        self.sorted_ids = []
+        self.good = KDEBuffer(n_dims)
+        self.bad = KDEBuffer(n_dims)
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+
 class TreeParzenEstimator(BaseEstimator):
     def __init__(
             self,
             top_n_percent=15, min_points_in_kde=2,
             bw_method="scott", cv_times=100, kde_sample_weight_scaler=None,
+            kde_backend="numpy",
             # fill_deactivated_value=False
     ):
         self.min_points_in_kde = min_points_in_kde
@@ -63,10 +156,19 @@ class TreeParzenEstimator(BaseEstimator):
         self.kde_sample_weight_scaler = kde_sample_weight_scaler
         self.cv_times = cv_times
         self.bw_method = bw_method
+        self.kde_backend = kde_backend
         # self.fill_deactivated_value = fill_deactivated_value
         self.good_kdes = None
         self.bad_kdes = None
 
+    def build_kde(self, bandwidth):
+        if self.kde_backend == "numpy":
+            return GaussianKDE(bandwidth=bandwidth)
+        elif self.kde_backend == "sklearn":
+            return KernelDensity(bandwidth=bandwidth)
+        else:
+            raise ValueError(f"Invalid kde_backend '{self.kde_backend}', should be 'numpy' or 'sklearn'")
+
     def set_config_transformer(self, config_transformer):
         self.config_transformer = config_transformer
 
@@ -87,52 +189,148 @@ class TreeParzenEstimator(BaseEstimator):
                 n_groups += 1
         return np.array(groups), n_groups
 
+    def get_n_good(self, N):
+        # Each KDE contains at least 2 samples
+        return max(2, (self.top_n_percent * N) // 100)
+
+    def estimate_buffer_bw(self, buffer: KDEBuffer):
+        N = len(buffer)
+        if self.bw_method == "scott":
+            return np.clip(N ** (-1 / 5) * buffer.std(), 0.01, None)
+        elif self.bw_method == "silverman":
+            return np.clip((N * 3 / 4) ** (-1 / 5) * buffer.std(), 0.01, None)
+        return estimate_bw(buffer.X, self.bw_method, self.cv_times)
+
     def fit(self, X: np.ndarray, y: np.ndarray):
+        X = np.asarray(X, dtype="float64")
+        y = np.asarray(y, dtype="float64")
+        self._X_buffer = X.copy()
+        self._y_buffer = y.copy()
+        self.n_samples_ = X.shape[0]
         groups, n_groups = self.calc_groups(X)
         self.groups = groups
         self.n_groups = n_groups
-        good_kdes = np.zeros([n_groups], dtype=object)
-        bad_kdes = deepcopy(good_kdes)
-        for group in range(n_groups):
-            group_mask = groups == group
+        self.group_masks = [groups == group for group in range(n_groups)]
+        self.group_states: List[TPEGroup] = []
+        self.good_kdes = np.zeros([n_groups], dtype=object)
+        self.bad_kdes = deepcopy(self.good_kdes)
+        for group, group_mask in enumerate(self.group_masks):
             grouped_X = X[:, group_mask]
             inactive_mask = np.isnan(grouped_X[:, 0])
+            active_ids = np.arange(X.shape[0])[~inactive_mask]
             active_X = grouped_X[~inactive_mask, :]
             active_y = y[~inactive_mask]
-            if active_X.shape[0] < 4:  # at least have 4 samples
-                continue
-            N, M = active_X.shape
-            # Each KDE contains at least 2 samples
-            n_good = max(2, (self.top_n_percent * N) // 100)
-            if n_good < self.min_points_in_kde or \
-                    N - n_good < self.min_points_in_kde:
-                # Too few observation samples
-                continue
             idx = np.argsort(active_y)
-            X_good = active_X[idx[:n_good]]
-            X_bad = active_X[idx[n_good:]]
-            y_good = -active_y[idx[:n_good]]
-            sample_weight = None
-            if self.kde_sample_weight_scaler is not None and y_good.std() != 0:
-                if self.kde_sample_weight_scaler == "normalize":
-                    scaled_y = (y_good - y_good.mean()) / y_good.std()
-                    scaled_y -= np.min(scaled_y)
-                    scaled_y /= np.max(scaled_y)
-                    scaled_y += 0.5
-                    sample_weight = scaled_y
-                elif self.kde_sample_weight_scaler == "std-exp":
-                    scaled_y = (y_good - y_good.mean()) / y_good.std()
-                    sample_weight = np.exp(scaled_y)
-                else:
-                    raise ValueError(f"Invalid kde_sample_weight_scaler '{self.kde_sample_weight_scaler}'")
-            bw_good = estimate_bw(X_good, self.bw_method, self.cv_times)
-            bw_bad = estimate_bw(X_bad, self.bw_method, self.cv_times)
-            good_kdes[group] = KernelDensity(bandwidth=bw_good).fit(X_good, sample_weight=sample_weight)
-            bad_kdes[group] = KernelDensity(bandwidth=bw_bad).fit(X_bad)
-        self.good_kdes = good_kdes
-        self.bad_kdes = bad_kdes
+            n_good = self.get_n_good(len(idx))
+            state = TPEGroup(group_mask.sum())
+            state.sorted_y = active_y[idx].tolist()
+            state.sorted_ids = active_ids[idx].tolist()
+            good_idx, bad_idx = idx[:n_good], idx[n_good:]
+            state.good.extend(active_ids[good_idx].tolist(), active_X[good_idx], active_y[good_idx])
+            state.bad.extend(active_ids[bad_idx].tolist(), active_X[bad_idx], active_y[bad_idx])
+            self.group_states.append(state)
+            self.update_kdes(group)
+        return self
+
+    @property
+    def X_(self):
+        return self._X_buffer[:self.n_samples_]
+
+    @property
+    def y_(self):
+        return self._y_buffer[:self.n_samples_]
+
+    def update_kdes(self, group):
+        state = self.group_states[group]
+        N = len(state)
+        n_good = self.get_n_good(N)
+        if N < 4 or n_good < self.min_points_in_kde or N - n_good < self.min_points_in_kde:
+            # at least have 4 samples, too few observation samples
+            self.good_kdes[group] = 0
+            self.bad_kdes[group] = 0
+            return
+        y_good = -state.good.Y
+        sample_weight = None
+        if self.kde_sample_weight_scaler is not None and y_good.std() != 0:
+            if self.kde_sample_weight_scaler == "normalize":
+                scaled_y = (y_good - y_good.mean()) / y_good.std()
+                scaled_y -= np.min(scaled_y)
+                scaled_y /= np.max(scaled_y)
+                scaled_y += 0.5
+                sample_weight = scaled_y
+            elif self.kde_sample_weight_scaler == "std-exp":
+                scaled_y = (y_good - y_good.mean()) / y_good.std()
+                sample_weight = np.exp(scaled_y)
+            else:
+                raise ValueError(f"Invalid kde_sample_weight_scaler '{self.kde_sample_weight_scaler}'")
+        bw_good = self.estimate_buffer_bw(state.good)
+        bw_bad = self.estimate_buffer_bw(state.bad)
+        # GaussianKDE keeps a view of the buffer, it is rebuilt whenever the buffer changes
+        X_good, X_bad = state.good.X, state.bad.X
+        if self.kde_backend != "numpy":
+            X_good, X_bad = X_good.copy(), X_bad.copy()
+        self.good_kdes[group] = self.build_kde(bw_good).fit(X_good, sample_weight=sample_weight)
+        self.bad_kdes[group] = self.build_kde(bw_bad).fit(X_bad)
+
+    def partial_fit(self, X: np.ndarray, y: np.ndarray):
+        '''
+        Add new observations to a fitted estimator. Only the groups the new rows are active in
+        are touched: each row is inserted into the sorted losses of the group and at most two rows
+        cross the good/bad boundary. Fall back to a full ``fit`` if a new row splits a group
+        (i.e. it is active on only part of the columns of the group), or if the kde backend is not numpy.
+        '''
+        X = np.atleast_2d(np.asarray(X, dtype="float64"))
+        y = np.atleast_1d(np.asarray(y, dtype="float64"))
+        if self.good_kdes is None:
+            return self.fit(X, y)
+        if self.kde_backend != "numpy":
+            return self.fit(np.vstack([self.X_, X]), np.hstack([self.y_, y]))
+        groups_active = []
+        for x in X:
+            active = ~np.isnan(x)
+            group_active = []
+            for group_mask in self.group_masks:
+                n_active = active[group_mask].sum()
+                if 0 < n_active < group_mask.sum():
+                    return self.fit(np.vstack([self.X_, X]), np.hstack([self.y_, y]))
+                group_active.append(n_active > 0)
+            groups_active.append(group_active)
+        touched = set()
+        for x, y_, group_active in zip(X, y, groups_active):
+            id_ = self.n_samples_
+            self._X_buffer = reserve_rows(self._X_buffer, id_ + 1)
+            self._y_buffer = reserve_rows(self._y_buffer, id_ + 1)
+            self._X_buffer[id_] = x
+            self._y_buffer[id_] = y_
+            self.n_samples_ += 1
+            for group, is_active in enumerate(group_active):
+                if is_active:
+                    self.insert(group, id_, x[self.group_masks[group]], y_)
+                    touched.add(group)
+        for group in touched:
+            self.update_kdes(group)
         return self
 
+    def insert(self, group, id_, x, y):
+        state = self.group_states[group]
+        pos = bisect_right(state.sorted_y, y)
+        state.sorted_y.insert(pos, y)
+        state.sorted_ids.insert(pos, id_)
+        n_good = self.get_n_good(len(state))
+        if pos < n_good:
+            state.good.add(id_, x, y)
+        else:
+            state.bad.add(id_, x, y)
+        # the good KDE contains the first n_good rows, only the rows besides the boundary can cross it
+        for rank in (n_good - 1, n_good):
+            if not (0 <= rank < len(state)) or state.sorted_ids[rank] == id_:
+                continue
+            rank_id = state.sorted_ids[rank]
+            if rank < n_good and rank_id not in state.good:
+                state.good.add(rank_id, *state.bad.remove(rank_id))
+            elif rank >= n_good and rank_id in state.good:
+                state.bad.add(rank_id, *state.good.remove(rank_id))
+
     def predict(self, X: np.ndarray):
         n_groups = self.n_groups
         good_log_pdf = np.zeros([X.shape[0], n_groups], dtype="float64")
@@ -167,42 +365,59 @@ class TreeParzenEstimator(BaseEstimator):
         return result
 
     def sample(self, n_candidates=20, sort_by_EI=False, random_state=None, bandwidth_factor=3) -> List[Configuration]:
+        vectors, is_random = self._sample_vectors(n_candidates, sort_by_EI, random_state, bandwidth_factor)
+        candidates = self.config_transformer.compiled_space.materialize_all(vectors)
+        for candidate, random in zip(candidates, is_random):
+            candidate.origin = "Random Search" if random else "ETPE sampling"
+        return candidates
+
+    def sample_vectors(self, n_candidates=20, sort_by_EI=False, random_state=None, bandwidth_factor=3) -> np.ndarray:
+        '''
+        Same as ``sample``, but returns the config vectors of the candidates without building
+        ``Configuration`` objects. Materialize the picked ones with ``config_transformer.compiled_space``.
+        '''
+        vectors, _ = self._sample_vectors(n_candidates, sort_by_EI, random_state, bandwidth_factor)
+        return vectors
+
+    def _sample_vectors(self, n_candidates, sort_by_EI, random_state, bandwidth_factor):
         # https://scikit-learn.org/stable/modules/generated/sklearn.neighbors.KernelDensity.html#sklearn.neighbors.KernelDensity
-        groups = np.array(self.groups)
         rng = check_random_state(random_state)
+        config_space = self.config_transformer.config_space
         if self.good_kdes is None:
             self.logger.warning("good_kdes is None, random sampling.")
-            return sample_configurations(self.config_transformer.config_space, n_candidates)
+            vectors = get_array_from_configs(sample_configurations(config_space, n_candidates))
+            return vectors, np.ones([n_candidates], dtype="bool")
+        groups = np.array(self.groups)
         sampled_matrix = np.zeros([n_candidates, len(self.groups)])
         for group, good_kde in enumerate(self.good_kdes):
             group_mask = groups == group
-            if good_kde:
-                # KDE采样
-                bw = good_kde.bandwidth
-                prev_bw = bw
-                bw *= bandwidth_factor
-                good_kde.set_params(bandwidth=bw)
-                result = good_kde.sample(n_candidates, random_state=random_state)
-                good_kde.set_params(bandwidth=prev_bw)
+            if isinstance(good_kde, GaussianKDE):
+                result = good_kde.sample(n_candidates, random_state=random_state, bandwidth_factor=bandwidth_factor)
+            elif good_kde:
+                # KDE采样. A fitted KernelDensity samples with its fitted ``bandwidth_`` (sklearn >= 1.x),
+                # so the scaled bandwidth is applied to the data of its tree instead of ``set_params``
+                tree = good_kde.tree_
+                result = GaussianKDE(bandwidth=getattr(good_kde, "bandwidth_", good_kde.bandwidth)) \
+                    .fit(np.asarray(tree.data), tree.sample_weight) \
+                    .sample(n_candidates, random_state=random_state, bandwidth_factor=bandwidth_factor)
             else:
                 # 随机采样(0-1)
                 result = rng.rand(n_candidates, group_mask.sum())
             sampled_matrix[:, group_mask] = result
-        candidates = self.config_transformer.inverse_transform(sampled_matrix)
-        n_fails = n_candidates - len(candidates)
-        add_configs_origin(candidates, "ETPE sampling")
+        vectors, _ = self.config_transformer.inverse_transform_vectors(sampled_matrix)
+        n_fails = n_candidates - vectors.shape[0]
+        is_random = np.zeros([n_candidates], dtype="bool")
         if n_fails:
-            random_candidates = sample_configurations(self.config_transformer.config_space, n_fails)
-            add_configs_origin(random_candidates, "Random Search")
-            candidates.extend(random_candidates)
+            random_vectors = get_array_from_configs(sample_configurations(config_space, n_fails))
+            vectors = np.vstack([vectors, random_vectors])
+            is_random[-n_fails:] = True
         if sort_by_EI:
             try:
-                X = [candidate.get_array() for candidate in candidates]
-                X_trans = self.config_transformer.transform(X)
-
+                X_trans = self.config_transformer.transform(vectors)
                 EI = self.predict(X_trans)
                 indexes = np.argsort(-EI)
-                candidates = [candidates[ix] for ix in indexes]
+                vectors = vectors[indexes]
+                is_random = is_random[indexes]
             except Exception as e:
                 self.logger.error(f"sort_by_EI failed: {e}")
-        return candidates
+        return vectors, is_random
@@ -5,4 +5,7 @@
 # @Contact    : qichun.tang@bupt.edu.cn
 from .iter_gen.base_gen import BaseIterGenerator
 from .iter_gen.custom_gen import CustomIterGenerator
-from .iter_gen.hyperband_gen import HyperBandIterGenerator, SuccessiveHalvingIterGenerator
+from .iter_gen.hyperband_gen import HyperBandIterGenerator, SuccessiveHalvingIterGenerator, \
+    AsyncSuccessiveHalvingIterGenerator
+from .scheduler import IterationScheduler, get_eval_kwargs
+from .state_store import TrialStateStore, TrialState
@@ -5,4 +5,5 @@
 # @Contact    : qichun.tang@bupt.edu.cn
 from .base_iter import BaseIteration
 from .rank_iter import RankReductionIteration
-from .ws_iter import WarmStartIteration
\ No newline at end of file
+from .ws_iter import WarmStartIteration
+from .async_iter import AsyncPromotionIteration
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import numpy as np
+
+from ultraopt.multi_fidelity.iter.base_iter import BaseIteration
+
+
+class AsyncPromotionIteration(BaseIteration):
+    '''
+    Asynchronous successive halving (ASHA): there is no barrier between the stages (rungs).
+    Whenever a run is requested, a configuration that ranks in the top ``num_configs[k + 1] / num_configs[k]``
+    (i.e. 1/eta) of the results completed so far at rung ``k`` is promoted to rung ``k + 1``, the deepest
+    rungs first. Otherwise a new configuration is sampled at the lowest budget, until ``num_configs[0]``
+    configurations have been sampled. Each rung still runs at most ``num_configs[k]`` configurations,
+    so the iteration has the same size as its synchronous counterpart.
+    '''
+
+    def get_next_run(self):
+        if self.is_finished:
+            return (None)
+
+        for stage in reversed(range(len(self.budgets) - 1)):
+            config_id = self._get_promotable(stage)
+            if config_id is not None:
+                d = self.data[config_id]
+                self.logger.debug(
+                    'ITERATION: Promoting config %s to budget %f' % (config_id, self.budgets[stage + 1]))
+                d.budget = self.budgets[stage + 1]
+                self.actual_num_configs[stage + 1] += 1
+                return self._start_run(config_id)
+
+        if self.actual_num_configs[0] < self.num_configs[0]:
+            return self._start_run(self.add_configuration())
+
+        if self.num_running == 0:
+            self.finish_up()
+        return (None)
+
+    def _start_run(self, config_id):
+        d = self.data[config_id]
+        d.status = 'RUNNING'
+        self.num_running += 1
+        self.optimizer.register_config(d.config, d.budget)
+        return (config_id, d.config, d.config_info, d.budget)
+
+    def _get_promotable(self, stage):
+        if self.actual_num_configs[stage + 1] >= self.num_configs[stage + 1]:
+            return None
+        budget = self.budgets[stage]
+        config_ids = [config_id for config_id, d in self.data.items() if budget in d.results]
+        if not config_ids:
+            return None
+        # crashed runs count as completed, but are never promoted
+        losses = np.array([self.get_loss(config_id, budget) for config_id in config_ids])
+        n_promotable = len(config_ids) * self.num_configs[stage + 1] // self.num_configs[stage]
+        for idx in np.argsort(losses, kind="stable")[:n_promotable]:
+            config_id = config_ids[idx]
+            d = self.data[config_id]
+            if d.budget == budget and d.status == 'REVIEW':
+                return config_id
+        return None
+
+    def get_loss(self, config_id, budget):
+        result = self.data[config_id].results.get(budget)
+        if result is None or not np.isfinite(result['loss']):
+            return np.inf
+        return result['loss']
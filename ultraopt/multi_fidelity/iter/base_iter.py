@@ -13,7 +13,7 @@ class BaseIteration(object):
     implementations) determine the further development.
     """
 
-    def __init__(self, HPB_iter, num_configs, budgets, optimizer, logger=None, result_logger=None):
+    def __init__(self, HPB_iter, num_configs, budgets, optimizer, logger=None, result_logger=None, state_store=None):
         """
         Parameters
         ----------
@@ -33,6 +33,8 @@ class BaseIteration(object):
         logger: a logger
         result_logger:
             a result logger that writes live results to disk
+        state_store: ultraopt.multi_fidelity.state_store.TrialStateStore
+            the per-config states of the run, the state of a config is removed when it is terminated
         """
 
         self.data = {}  # this holds all the configs and results of this iteration
@@ -46,6 +48,7 @@ class BaseIteration(object):
         self.num_running = 0
         self.logger = logger if not logger is None else logging.getLogger('ultraopt.iter')
         self.result_logger = result_logger
+        self.state_store = state_store
 
     def __str__(self):
         return f"{self.__class__.__name__}:\n" + \
@@ -117,9 +120,12 @@ class BaseIteration(object):
         d.results[budget] = result
 
         if (not job.result is None) and np.isfinite(result['loss']):
-            d.status = 'REVIEW'
+            # a pruned trial is a partial observation, it is never advanced
+            d.status = 'PRUNED' if result.get('pruned') else 'REVIEW'
         else:
             d.status = 'CRASHED'
+        if d.status == 'PRUNED' and self.state_store is not None:
+            self.state_store.remove(config_id)
 
         d.exceptions[budget] = exception
         self.num_running -= 1
@@ -228,10 +234,14 @@ class BaseIteration(object):
                 self.actual_num_configs[self.stage] += 1
             else:
                 self.data[cid].status = 'TERMINATED'
+                if self.state_store is not None:
+                    self.state_store.remove(cid)
 
     def finish_up(self):
         self.is_finished = True
 
         for k, v in self.data.items():
-            assert v.status in ['TERMINATED', 'REVIEW', 'CRASHED'], 'Configuration has not finshed yet!'
+            assert v.status in ['TERMINATED', 'REVIEW', 'CRASHED', 'PRUNED'], 'Configuration has not finshed yet!'
             v.status = 'COMPLETED'
+            if self.state_store is not None:
+                self.state_store.remove(k)
@@ -22,7 +22,8 @@ class WarmStartIteration(BaseIteration):
 
         super().__init__(-1, [len(id2conf)], [None], None)
 
-        for i, id in enumerate(id2conf):
+        configs, losses, budgets = [], [], []
+        for id in id2conf:
             new_id = self.add_configuration(config=id2conf[id]['config'], config_info=id2conf[id]['config_info'])
 
             for r in result.get_runs_by_id(id):
@@ -36,9 +37,11 @@ class WarmStartIteration(BaseIteration):
                     j.timestamps[k] = v + delta_t
 
                 self.register_result(j, skip_sanity_checks=True)
-                should_update = (i == len(id2conf) - 1)
-                optimizer.new_result(j, update_model=should_update, should_update_weight=-1)
-        optimizer.update_weight(should_update=1)
+                configs.append(j.kwargs['config'])
+                losses.append(r.loss)
+                budgets.append(r.budget)
+        # crashed runs (no loss) count as bad configurations, the models are fitted once
+        optimizer.tell_many(configs, losses, budgets)
 
         # mark as finished, as no more runs should be executed from these runs
         self.is_finished = True
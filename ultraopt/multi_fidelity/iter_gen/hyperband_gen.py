@@ -6,6 +6,7 @@
 import numpy as np
 
 from ultraopt.utils.misc import get_max_SH_iter
+from ultraopt.multi_fidelity.iter import AsyncPromotionIteration
 from .base_gen import BaseIterGenerator
 
 
@@ -56,3 +57,16 @@ class SuccessiveHalvingIterGenerator(HyperBandIterGenerator):
             iter_klass=None
     ):
         super(SuccessiveHalvingIterGenerator, self).__init__(min_budget, max_budget, eta, True, iter_klass)
+
+
+class AsyncSuccessiveHalvingIterGenerator(SuccessiveHalvingIterGenerator):
+    def __init__(
+            self,
+            min_budget,
+            max_budget,
+            eta,
+            iter_klass=None
+    ):
+        if iter_klass is None:
+            iter_klass = AsyncPromotionIteration
+        super(AsyncSuccessiveHalvingIterGenerator, self).__init__(min_budget, max_budget, eta, iter_klass)
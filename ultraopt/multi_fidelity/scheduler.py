@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import inspect
+import threading
+from typing import Optional, Callable
+
+from ultraopt.multi_fidelity.iter_gen.base_gen import BaseIterGenerator
+from ultraopt.multi_fidelity.iter_gen.custom_gen import CustomIterGenerator
+from ultraopt.multi_fidelity.state_store import TrialStateStore
+from ultraopt.optimizer.base_opt import BaseOptimizer
+from ultraopt.pruning import PercentilePruner, Reporter
+from ultraopt.structure import Job
+from ultraopt.utils.checkpoint import Checkpointer
+
+
+def get_eval_kwargs(eval_func: Callable, job: Job) -> dict:
+    # like ``Worker.compute``, the budget, the state and the report callback are only passed to evaluation functions that accept them
+    parameters = inspect.signature(eval_func).parameters.keys()
+    return {key: job.kwargs[key] for key in ["budget", "state", "report"] if key in parameters and key in job.kwargs}
+
+
+class IterationScheduler():
+    '''
+    In-process counterpart of ``ultraopt.async_comm.master.Master``: starts the iterations of
+    ``iter_generator`` and asks them for the next run (``BaseIteration.get_next_run``) and registers
+    the results (``BaseIteration.register_result``) directly, without nameserver, dispatcher or RPC.
+
+    ``get_next_run`` returns None when every iteration is waiting for running jobs (or all the runs
+    are done), the caller decides how many jobs are in flight.
+
+    With a ``state_store``, the jobs carry the ``TrialState`` of their config in ``job.kwargs["state"]``.
+    Every job carries a ``Reporter`` in ``job.kwargs["report"]``, it prunes the trial if a ``pruner`` is given.
+    A ``result_logger`` (e.g. ``ultraopt.result.JsonResultLogger``) gets the new configs and the finished jobs,
+    like the one of the ``Master``.
+
+    ``close`` writes the last snapshot of the checkpoint, it has to be called when the run stops
+    (the runs that are not promoted or the errors make the number of runs unknown).
+    The optimizer is only used while holding ``lock``, the checkpointer serializes it in its own thread.
+    '''
+
+    def __init__(
+            self,
+            optimizer: BaseOptimizer,
+            iter_generator: Optional[BaseIterGenerator] = None,
+            n_iterations=1,
+            checkpoint_file=None,
+            checkpoint_freq=10,
+            state_store: Optional[TrialStateStore] = None,
+            pruner: Optional[PercentilePruner] = None,
+            result_logger=None
+    ):
+        if iter_generator is None:
+            iter_generator = CustomIterGenerator([1], [1])
+        iter_generator.initialize(optimizer)
+        self.optimizer = optimizer
+        self.iter_generator = iter_generator
+        self.n_iterations = n_iterations
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_freq = checkpoint_freq
+        self.lock = threading.Lock()
+        self.checkpointer = Checkpointer(optimizer, checkpoint_file, lock=self.lock) \
+            if checkpoint_file is not None else None
+        self.state_store = state_store
+        self.pruner = pruner
+        self.result_logger = result_logger
+        self.all_n_runs = iter_generator.num_all_configs(n_iterations)
+        self.iterations = []
+        self.running_config_ids = set()
+        self.n_done = 0
+
+    def get_next_run(self) -> Optional[Job]:
+        with self.lock:
+            return self._get_next_run()
+
+    def _get_next_run(self) -> Optional[Job]:
+        while True:
+            for iteration in self.iterations:
+                if iteration.is_finished:
+                    continue
+                next_run = iteration.get_next_run()
+                if next_run is not None:
+                    config_id, config, config_info, budget = next_run
+                    job = Job(config_id, config=config, config_info=config_info, budget=budget)
+                    if self.state_store is not None:
+                        job.kwargs["state"] = self.state_store.get(config_id)
+                    step2losses = self.optimizer.get_step2losses(budget) if self.pruner is not None else None
+                    job.kwargs["report"] = Reporter(self.pruner, step2losses)
+                    job.time_it("submitted")
+                    self.running_config_ids.add(config_id)
+                    return job
+            # every active iteration is waiting for running jobs, start the next one
+            if len(self.iterations) >= self.n_iterations:
+                return None
+            self.iterations.append(self.iter_generator.get_next_iteration(
+                len(self.iterations), state_store=self.state_store, result_logger=self.result_logger))
+
+    def register_result(self, job: Job, update_model=True):
+        with self.lock:
+            self._register_result(job, update_model)
+
+    def _register_result(self, job: Job, update_model=True):
+        if "finished" not in job.timestamps:
+            job.time_it("finished")
+        job.timestamps.setdefault("started", job.timestamps["submitted"])
+        if self.result_logger is not None:
+            self.result_logger(job)
+        self.iterations[job.id[0]].register_result(job)
+        self.optimizer.new_result(job, update_model=update_model)
+        self.running_config_ids.discard(job.id)
+        self.n_done += 1
+        if self.state_store is not None:
+            self.state_store.update_size(job.id)
+            self.state_store.evict(self.running_config_ids)
+        if self.checkpointer is not None:
+            self.checkpointer.log_result(job.kwargs["config"], job.kwargs["budget"], job.result)
+            if self.n_done % self.checkpoint_freq == 0:
+                self.checkpointer.snapshot()
+
+    def close(self):
+        if self.checkpointer is not None:
+            self.checkpointer.snapshot()
+            self.checkpointer.close()
+            self.checkpointer = None
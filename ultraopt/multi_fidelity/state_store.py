@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from typing import Tuple, Any, Optional
+
+from joblib import dump, load
+
+from ultraopt.utils.logging_ import get_logger
+
+logger = get_logger(__name__)
+
+
+class TrialState():
+    '''
+    Handle on the state directory of one configuration, given to the evaluation function as ``state``.
+    ``save`` checkpoints e.g. a partially trained model at the current budget, when the configuration is
+    promoted to a larger budget ``load`` returns it so training can be resumed instead of restarted.
+    The handle only holds a path, it can be pickled to worker processes.
+    '''
+
+    checkpoint_name = "checkpoint.pkl"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def checkpoint_file(self):
+        return os.path.join(self.directory, self.checkpoint_name)
+
+    def save(self, state: Any, budget: float):
+        os.makedirs(self.directory, exist_ok=True)
+        # write then rename, a reader never sees a half-written checkpoint
+        tmp_file = self.checkpoint_file + ".tmp"
+        dump({"budget": budget, "state": state}, tmp_file)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def load(self) -> Tuple[Optional[float], Any]:
+        '''Returns the budget and the state of the last checkpoint, ``(None, None)`` if there is none.'''
+        if not os.path.exists(self.checkpoint_file):
+            return None, None
+        checkpoint = load(self.checkpoint_file)
+        return checkpoint["budget"], checkpoint["state"]
+
+    def __repr__(self):
+        return f"TrialState({self.directory!r})"
+
+
+class TrialStateStore():
+    '''
+    Local filesystem store of the per-config ``TrialState`` s of a multi-fidelity run, one directory
+    per config id. The iterations remove the state of a config when they terminate it, and when
+    the store is larger than ``max_size`` bytes the least recently used states are evicted
+    (an evicted config just restarts from scratch if it is promoted later).
+
+    The states are saved by the evaluation functions, possibly in other processes, so the size of a
+    state is recorded by ``update_size`` when its job is finished and the store keeps the total size.
+    '''
+
+    def __init__(self, directory=None, max_size=None):
+        self.is_temporary = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="ultraopt_state_")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.config_ids = OrderedDict()  # config id -> size of its state, least recently used first
+        self.total_size = 0
+
+    def get_directory(self, config_id) -> str:
+        return os.path.join(self.directory, "_".join(map(str, config_id)))
+
+    def get(self, config_id) -> TrialState:
+        self.config_ids.setdefault(config_id, 0)
+        self.config_ids.move_to_end(config_id)
+        return TrialState(self.get_directory(config_id))
+
+    def remove(self, config_id):
+        self.total_size -= self.config_ids.pop(config_id, 0)
+        shutil.rmtree(self.get_directory(config_id), ignore_errors=True)
+
+    def get_size(self, config_id) -> int:
+        # a ``TrialState`` only writes its checkpoint
+        try:
+            return os.path.getsize(TrialState(self.get_directory(config_id)).checkpoint_file)
+        except OSError:
+            return 0
+
+    def update_size(self, config_id):
+        '''Records the size of the state of ``config_id``, once its job (which may have saved it) is finished.'''
+        if self.max_size is None or config_id not in self.config_ids:
+            return
+        size = self.get_size(config_id)
+        self.total_size += size - self.config_ids[config_id]
+        self.config_ids[config_id] = size
+
+    def evict(self, excluded=()):
+        '''Removes the least recently used states (except the ``excluded`` config ids) until the store fits ``max_size``.'''
+        if self.max_size is None or self.total_size <= self.max_size:
+            return
+        for config_id, size in list(self.config_ids.items()):
+            if self.total_size <= self.max_size:
+                break
+            if config_id in excluded:
+                continue
+            logger.debug(f"evict the state of config {config_id} ({size} bytes)")
+            self.remove(config_id)
+
+    def clear(self):
+        for config_id in list(self.config_ids):
+            self.remove(config_id)
+        if self.is_temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
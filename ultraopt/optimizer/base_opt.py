@@ -13,9 +13,11 @@ from ConfigSpace import Configuration
 from sklearn.utils.validation import check_random_state
 
 from ultraopt.structure import Job
+from ultraopt.utils.compiled_space import CompiledConfigSpace
 from ultraopt.utils.config_space import add_configs_origin, get_dict_from_config
-from ultraopt.utils.hash import get_hash_of_config
+from ultraopt.utils.hash import get_hash_of_config, get_hashes_of_vectors, get_keys_of_vectors, get_key_of_vector
 from ultraopt.utils.logging_ import get_logger
+from ultraopt.utils.obvs_store import ObservationStore
 
 
 def runId_info():
@@ -28,6 +30,8 @@ class BaseOptimizer():
         self.is_init = False
         self.configId2config: Dict[str, dict] = {}
         self.runId2info: Dict[Tuple[str, float], dict] = defaultdict(runId_info)
+        # intermediate losses reported at each step, for the pruners
+        self.budget2curves: Dict[float, Dict[int, List[float]]] = {}
 
     def initialize(self, config_space, budgets=(1,), random_state=42, initial_points=None, budget2obvs=None):
         if self.is_init:
@@ -40,18 +44,25 @@ class BaseOptimizer():
         self.budgets = budgets
         if budget2obvs is None:
             budget2obvs = self.get_initial_budget2obvs(self.budgets)
-        self.budget2obvs = budget2obvs
+        self.budget2obvs = {
+            budget: obvs if isinstance(obvs, ObservationStore) else ObservationStore.from_dict(obvs)
+            for budget, obvs in budget2obvs.items()
+        }
         # other variable
         self.rng = check_random_state(self.random_state)
         self.initial_points_index = 0
 
     @classmethod
     def get_initial_budget2obvs(cls, budgets):
-        return {budget: {"losses": [], "configs": [], "vectors": [], "locks": []} for budget in budgets}
+        return {budget: ObservationStore() for budget in budgets}
+
+    def add_budget(self, budget):
+        '''Adds a budget that is not a budget of ``initialize``, e.g. a budget of a warm started result.'''
+        self.budget2obvs.setdefault(budget, ObservationStore())
 
     def tell(self, config: Union[dict, Configuration], loss: float, budget: float = 1, update_model=True):
         config = get_dict_from_config(config)
-        job = Job(get_hash_of_config(config))
+        job = Job(get_hash_of_config(config, self.config_space))
         job.kwargs = {
             "budget": budget,
             "config": config,
@@ -62,6 +73,50 @@ class BaseOptimizer():
         }
         self.new_result(job, update_model=update_model)
 
+    def tell_many(self, configs: List[Union[dict, Configuration]], losses, budgets=1, update_model=True):
+        '''
+        Bulk version of ``tell``, e.g. to warm start from a previous run: all the configs are validated
+        and vectorized in one pass (see ``CompiledConfigSpace.vectorize``), appended to the observations
+        of their budget at once and the model of each budget is fitted once.
+        ``budgets`` is a budget for all the configs or the budget of each config.
+        '''
+        n_configs = len(configs)
+        losses = np.array(losses, dtype="float64").reshape(-1)
+        # like ``new_result``, non numeric losses count as bad
+        losses[~np.isfinite(losses)] = np.inf
+        if np.ndim(budgets) == 0:
+            budgets = [budgets] * n_configs
+        if not (len(losses) == len(budgets) == n_configs):
+            raise ValueError(f"Got {n_configs} configs, {len(losses)} losses and {len(budgets)} budgets.")
+        if n_configs == 0:
+            return
+        config_dicts = [get_dict_from_config(config) for config in configs]
+        vectors, legal = CompiledConfigSpace(self.config_space).vectorize(config_dicts)
+        if not np.all(legal):
+            illegal_ids = np.flatnonzero(~legal)
+            raise ValueError(f"{len(illegal_ids)} configs are not legal in the config space, "
+                             f"e.g. {config_dicts[illegal_ids[0]]}")
+        now = time()
+        budget2ids = defaultdict(list)
+        configIds = get_hashes_of_vectors(vectors, self.config_space)
+        for i, (configId, config_dict, budget) in enumerate(zip(configIds, config_dicts, budgets)):
+            budget2ids[budget].append(i)
+            self.configId2config.setdefault(configId, config_dict)
+            self.runId2info[(configId, budget)] = {"start_time": now, "end_time": now, "loss": losses[i]}
+        for budget, ids in budget2ids.items():
+            configs_of_budget = []
+            for i in ids:
+                config = configs[i]
+                if not (isinstance(config, Configuration) and config.configuration_space is self.config_space):
+                    origin = getattr(config, "origin", None)
+                    config = Configuration(self.config_space, vector=vectors[i])
+                    config.origin = origin
+                configs_of_budget.append(config)
+            obvs = self.budget2obvs[budget]
+            obvs.extend(configs_of_budget, vectors[ids], losses[ids])
+            if update_model:
+                self._new_result(budget, obvs["vectors"], obvs["losses"])
+
     def new_result(self, job: Job, update_model=True):
 
         ##############################
@@ -77,22 +132,30 @@ class BaseOptimizer():
             loss = job.result["loss"] if np.isfinite(job.result["loss"]) else np.inf
         budget = job.kwargs["budget"]
         config_dict = job.kwargs["config"]
-        configId = get_hash_of_config(config_dict)
+        # config_info = job.kwargs["config_info"]
+        config = Configuration(self.config_space, config_dict)
+        configId = get_hash_of_config(config)
         runId = (configId, budget)
         if runId in self.runId2info:
             self.runId2info[runId]["end_time"] = time()
             self.runId2info[runId]["loss"] = loss
+            if job.result is not None and job.result.get("pruned"):
+                # a partial observation, the loss is the last reported one
+                self.runId2info[runId]["pruned"] = True
         else:
             self.logger.error(f"runId {runId} not in runId2info, it's impossible!!!")
-        # config_info = job.kwargs["config_info"]
-        config = Configuration(self.config_space, config_dict)
+        if job.result is not None and job.result.get("curve"):
+            step2losses = self.budget2curves.setdefault(budget, {})
+            for step, step_loss in job.result["curve"]:
+                step2losses.setdefault(step, []).append(step_loss)
+        vector = config.get_array()
+        obvs = self.budget2obvs[budget]
         # add lock (It may be added twice, but it does not affect)
-        self.budget2obvs[budget]["locks"].append(config.get_array().copy())
-        self.budget2obvs[budget]["configs"].append(deepcopy(config))
-        self.budget2obvs[budget]["vectors"].append(config.get_array())
-        self.budget2obvs[budget]["losses"].append(loss)
-        losses = np.array(self.budget2obvs[budget]["losses"])
-        vectors = np.array(self.budget2obvs[budget]["vectors"])
+        obvs.add_lock(vector)
+        obvs.append(config, vector, loss)
+        # read-only views of the observation buffers, no copy
+        losses = obvs["losses"]
+        vectors = obvs["vectors"]
         ###################################################################
         ### 2. Judge whether the EPM training conditions are satisfied  ###
         ###################################################################
@@ -103,6 +166,9 @@ class BaseOptimizer():
     def _new_result(self, budget, vectors: np.ndarray, losses: np.ndarray):
         raise NotImplementedError
 
+    def get_step2losses(self, budget) -> Dict[int, List[float]]:
+        return {step: list(losses) for step, losses in self.budget2curves.get(budget, {}).items()}
+
     def ask(self, budget=1, n_points=None, strategy="cl_min") -> Union[List[Tuple[dict, dict]], Tuple[dict, dict]]:
         if n_points is None:
             return self.get_config(budget)
@@ -119,25 +185,54 @@ class BaseOptimizer():
                 str(supported_strategies) + ", " + "got %s" % strategy
             )
 
-        opt = deepcopy(self)
+        # the lies are appended to the observations of ``budget`` and removed at the end,
+        # the optimizer is not copied
+        obvs = self.budget2obvs[budget]
+        n_obvs = len(obvs)
         config_info_pairs = []
-        for i in range(n_points):
-            start_time = time()
-            config, config_info = opt.get_config(budget=budget)
-            config_info_pairs.append((config, config_info))
-            losses = opt.budget2obvs[budget]["losses"]
-            if strategy == "cl_min":
-                y_lie = np.min(losses) if losses else 0.0  # CL-min lie
-            elif strategy == "cl_mean":
-                y_lie = np.mean(losses) if losses else 0.0  # CL-mean lie
-            elif strategy == "cl_max":
-                y_lie = np.max(losses) if losses else 0.0  # CL-max lie
-            else:
-                raise NotImplementedError
-            opt.tell(config, y_lie)
-            self.register_config(config, budget, start_time=start_time)
+        try:
+            for i in range(n_points):
+                config, config_info = self.get_config(budget=budget)
+                config_info_pairs.append((config, config_info))
+                if i == n_points - 1:
+                    break
+                losses = obvs["losses"]
+                if strategy == "cl_min":
+                    y_lie = np.min(losses) if len(losses) else 0.0  # CL-min lie
+                elif strategy == "cl_mean":
+                    y_lie = np.mean(losses) if len(losses) else 0.0  # CL-mean lie
+                elif strategy == "cl_max":
+                    y_lie = np.max(losses) if len(losses) else 0.0  # CL-max lie
+                else:
+                    raise NotImplementedError
+                self.fantasize(config, y_lie, budget)
+        finally:
+            if len(obvs) > n_obvs:
+                obvs.truncate(n_obvs)
+                self._discard_fantasies(budget, obvs["vectors"], obvs["losses"])
         return config_info_pairs
 
+    def fantasize(self, config: Union[dict, Configuration], loss: float, budget: float = 1):
+        '''
+        Add a lie (a pending config with a fake loss) to the observations of ``budget`` and
+        update the model with it. The config is already locked by ``get_config``.
+        '''
+        config = Configuration(self.config_space, get_dict_from_config(config))
+        obvs = self.budget2obvs[budget]
+        obvs.append(config, config.get_array(), loss)
+        self._fantasize(budget, obvs["vectors"], obvs["losses"])
+
+    def _fantasize(self, budget, vectors: np.ndarray, losses: np.ndarray):
+        '''
+        Update the model of ``budget`` with a lie, the last row of ``vectors`` and ``losses``.
+        By default the model is refitted like for a real observation.
+        '''
+        self._new_result(budget, vectors, losses)
+
+    def _discard_fantasies(self, budget, vectors: np.ndarray, losses: np.ndarray):
+        '''The lies were removed from the observations of ``budget``, restore its model.'''
+        self._new_result(budget, vectors, losses)
+
     def get_config(self, budget) -> Tuple[dict, dict]:
         # get max_budget
         # calc by budget2epm
@@ -160,7 +255,7 @@ class BaseOptimizer():
         return config, config_info
 
     def register_config(self, config, budget, start_time=None):
-        configId = get_hash_of_config(config)
+        configId = get_hash_of_config(config, self.config_space)
         runId = (configId, budget)
         if runId in self.runId2info:  # don't set second time
             return
@@ -172,30 +267,33 @@ class BaseOptimizer():
     def _get_config(self, budget, max_budget):
         raise NotImplementedError
 
+    def get_lock_keys(self, budget):
+        return [obvs.lock_keys for budget_, obvs in self.budget2obvs.items() if budget_ >= budget]
+
     def is_config_exist(self, budget, config: Configuration):
-        vectors_list = []
-        budgets = [budget_ for budget_ in list(self.budget2obvs.keys()) if budget_ >= budget]
-        for budget_ in budgets:
-            vectors = np.array(self.budget2obvs[budget_]["locks"])
-            if vectors.size:
-                vectors_list.append(vectors)
-        if len(vectors_list) == 0:
-            return False
-        vectors = np.vstack(vectors_list)
-        if np.any(np.array(vectors.shape) == 0):
-            return False
-        vectors[np.isnan(vectors)] = -1
-        vector = config.get_array().copy()
-        vector[np.isnan(vector)] = -1
-        if np.any(np.all(vector == vectors, axis=1)):
-            return True
-        return False
+        key = get_key_of_vector(config.get_array())
+        return any(key in lock_keys for lock_keys in self.get_lock_keys(budget))
+
+    def filter_existing(self, budget, candidates: Union[List[Configuration], np.ndarray]) -> np.ndarray:
+        '''
+        Returns a boolean mask, True for the candidates (configs or vectors) that are not
+        locked on any budget >= ``budget``.
+        '''
+        if len(candidates) == 0:
+            return np.zeros([0], dtype="bool")
+        if not isinstance(candidates, np.ndarray):
+            candidates = np.array([config.get_array() for config in candidates])
+        lock_keys_list = self.get_lock_keys(budget)
+        return np.array([
+            not any(key in lock_keys for lock_keys in lock_keys_list)
+            for key in get_keys_of_vectors(candidates)
+        ], dtype="bool")
 
     def get_available_max_budget(self):
         raise NotImplementedError
 
     def process_config_info_pair(self, config: Configuration, info_dict: dict, budget):
-        self.budget2obvs[budget]["locks"].append(config.get_array().copy())
+        self.budget2obvs[budget].add_lock(config.get_array())
         info_dict = deepcopy(info_dict)
         if config.origin is None:
             config.origin = "unknown"
@@ -58,10 +58,172 @@ class EI():
         return values
 
 
+def snap_weights(weights, tol=1e-3):
+    weights[weights - tol <= 0] = 0
+    weights[weights + tol >= 1] = 1
+    return weights
+
+
+def count_tied_pairs(X_sorted):
+    '''Number of pairs of equal values in each row of a row-wise sorted matrix.'''
+    n = X_sorted.shape[1]
+    idx = np.arange(n)
+    new_run = np.ones(X_sorted.shape, dtype="bool")
+    new_run[:, 1:] = X_sorted[:, 1:] != X_sorted[:, :-1]
+    run_start = np.maximum.accumulate(np.where(new_run, idx, 0), axis=1)
+    return (idx - run_start).sum(axis=1)
+
+
+def count_inversions(X, block_size=32):
+    '''
+    Number of pairs i < j with X[:, i] > X[:, j] in each row of a non-negative integer matrix.
+
+    Vectorized over the rows: the inversions inside blocks of ``block_size`` columns are counted by
+    comparison, then the sorted blocks are merged bottom-up, one ``np.sort`` per level. The inversions
+    between two merged halves are read from the positions of the right half elements in the merged block.
+    '''
+    n_rows, n = X.shape
+    n_pad = 1
+    while n_pad < n:
+        n_pad *= 2
+    width = min(block_size, n_pad)
+    # padded values are larger than all the others and placed at the end, so they add no inversion
+    max_value = int(X.max(initial=0)) + 1
+    dtype = "int16" if 2 * max_value + 1 <= np.iinfo("int16").max else "int64"
+    X = np.hstack([X, np.full([n_rows, n_pad - n], max_value)]).astype(dtype)
+    blocks = X.reshape(n_rows, -1, width)
+    upper = np.triu(np.ones([width, width], dtype="bool"), k=1)
+    inversions = np.count_nonzero((blocks[:, :, :, None] > blocks[:, :, None, :]) & upper, axis=(1, 2, 3))
+    X = np.sort(blocks, axis=2).reshape(n_rows, n_pad)
+    while width < n_pad:
+        # tag the right halves with the lowest bit, a value of the left half is sorted before an equal one of the right
+        keys = X.reshape(n_rows, -1, 2 * width) * 2
+        keys[:, :, width:] += 1
+        keys.sort(axis=2, kind="stable")
+        # sum of positions of the right half elements in the merged blocks
+        pos_sum = (keys & 1).reshape(n_rows, -1, 2 * width) @ np.arange(2 * width)
+        n_blocks = keys.shape[1]
+        inversions += n_blocks * (width * width + width * (width - 1) // 2) - pos_sum.sum(axis=1, dtype="int64")
+        X = (keys >> 1).reshape(n_rows, n_pad)
+        width *= 2
+    return inversions
+
+
+def rank_losses(outputs, label, weights, chunk_size=2048):
+    '''
+    Ranking loss of the linear ensembles ``weights @ outputs`` w.r.t. ``label``, for all the weights at once.
+
+    The loss of an ensemble ``o`` is the number of ordered pairs (i, j) with
+    ``(o[i] < o[j]) xor (label[i] < label[j])``: 2 for every discordant pair and 1 for every pair
+    that is tied in exactly one of ``o`` and ``label``. The ties are counted on sorted rows and the
+    discordant pairs with a Kendall-tau style counting kernel, so no (n × n) matrix is built.
+
+    Parameters
+    ----------
+    outputs: (L, n) predictions of L models
+    label: (n, ) true losses
+    weights: (N, L) candidate weights
+
+    Returns
+    -------
+    losses: (N, ) int64
+    '''
+    outputs = np.asarray(outputs, dtype="float64")
+    label = np.asarray(label, dtype="float64").ravel()
+    weights = np.atleast_2d(weights)
+    n = label.shape[0]
+    label_rank = np.unique(label, return_inverse=True)[1]
+    label_order = np.argsort(label_rank, kind="stable")
+    n_label_ties = count_tied_pairs(label_rank[label_order][None, :])[0]
+    losses = np.zeros([weights.shape[0]], dtype="int64")
+    for start in range(0, weights.shape[0], chunk_size):
+        W = weights[start:start + chunk_size]
+        # same summation order as ``(outputs * w[:, None]).sum(axis=0)``, to keep the ties of the outputs
+        O = (outputs[None, :, :] * W[:, :, None]).sum(axis=1)
+        order = np.argsort(O, axis=1, kind="stable")
+        O_sorted = np.take_along_axis(O, order, axis=1)
+        n_output_ties = count_tied_pairs(O_sorted)
+        new_value = np.ones(O.shape, dtype="int64")
+        new_value[:, 1:] = O_sorted[:, 1:] != O_sorted[:, :-1]
+        R = np.empty_like(new_value)
+        np.put_along_axis(R, order, np.cumsum(new_value, axis=1), axis=1)
+        # sort by (label, output), then every strict inversion of the output ranks is a discordant pair
+        if n_label_ties == 0:
+            n_both_ties = 0
+            discordant = count_inversions(R[:, label_order])
+        else:
+            keys = label_rank[None, :] * (n + 1) + R
+            order = np.argsort(keys, axis=1)
+            n_both_ties = count_tied_pairs(np.take_along_axis(keys, order, axis=1))
+            discordant = count_inversions(np.take_along_axis(R, order, axis=1))
+        losses[start:start + chunk_size] = n_label_ties + n_output_ties - 2 * n_both_ties + 2 * discordant
+    return losses
+
+
+class PredictionCache():
+    '''
+    Cache of ``epm.predict(X, return_std=True)`` for the EPM of every budget, shared by the
+    ConfigEvaluators of all budgets. Entries are keyed by the bytes of the transformed candidate and
+    belong to one fit version of the budget's EPM: ``invalidate(budget)`` must be called after a refit.
+    Repeated neighbors, incumbents and start points of the local search are predicted only once.
+    '''
+
+    def __init__(self, budget2epm, max_size=100000):
+        self.budget2epm = budget2epm
+        self.max_size = max_size
+        self.budget2version = {}
+        self.budget2cache = {}
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __getstate__(self):
+        # the cached predictions are not pickled
+        state = self.__dict__.copy()
+        state["budget2cache"] = {}
+        return state
+
+    def cache_info(self):
+        return {
+            "hits": self.n_hits,
+            "misses": self.n_misses,
+            "size": sum(len(cache) for cache in self.budget2cache.values()),
+            "versions": dict(self.budget2version),
+        }
+
+    def invalidate(self, budget):
+        self.budget2version[budget] = self.budget2version.get(budget, 0) + 1
+        self.budget2cache.pop(budget, None)
+
+    def predict(self, budget, X):
+        X = np.ascontiguousarray(X)
+        N = X.shape[0]
+        keys = X.view(np.dtype((np.void, X.itemsize * X.shape[1]))).ravel().tolist()
+        cache = self.budget2cache.setdefault(budget, {})
+        mean = np.zeros([N], dtype="float64")
+        std = np.zeros([N], dtype="float64")
+        miss = []
+        for i, key in enumerate(keys):
+            value = cache.get(key)
+            if value is None:
+                miss.append(i)
+            else:
+                mean[i], std[i] = value
+        self.n_hits += N - len(miss)
+        self.n_misses += len(miss)
+        if miss:
+            mean[miss], std[miss] = self.budget2epm[budget].predict(X[miss], return_std=True)
+            if len(cache) + len(miss) > self.max_size:
+                cache.clear()
+            for i in miss:
+                cache[keys[i]] = (mean[i], std[i])
+        return mean, std
+
+
 class ConfigEvaluator:
     def __init__(
             self, budget2epm, budget,
-            acq_func="EI", acq_func_params=frozendict(), random_state=0
+            acq_func="EI", acq_func_params=frozendict(), random_state=0,
+            weight_search="random", prediction_cache=None
     ):
         self.acq_func_params = dict(acq_func_params)
         # todo: 引入包的形式
@@ -77,6 +239,8 @@ class ConfigEvaluator:
         self.budget2epm = budget2epm
         self.logger = get_logger(self)
         self.rng = check_random_state(random_state)
+        self.weight_search = weight_search
+        self.prediction_cache = prediction_cache if prediction_cache is not None else PredictionCache(budget2epm)
 
     def calc_weight(self, X_test, y_test):
         # 计算outputs
@@ -95,33 +259,16 @@ class ConfigEvaluator:
             self.logger.warning(f"In here max_budget = {budgets[max_budget_idx]}, != {self.budget}, it's invalid ! ")
             self.budget2weight = None
             return
-
-        def linear_regression(w):
-            w = np.array(w)[:, None]
-            output = outputs * w
-            sum = output.sum(axis=0)
-            return sum
-
-        def rank_loss(output, label):
-            return np.count_nonzero(np.logical_xor((output < output.T), (label < label.T)))
-
-        def objective(w):
-            output = linear_regression(w)[None, :]
-            return rank_loss(output, y_test[None, :])
-
-        # todo: 向量化上述操作
         L = len(budgets)
-        # lb = [0] * L
-        # ub = [1] * L
-        # rranges=[slice(0,1,20) for i in range(L)]
-        N = 10000  # 1w 样本随机搜索
-        weights = self.rng.rand(N, L)
-        weights[weights - (1e-3) <= 0] = 0
-        weights[weights + (1e-3) >= 1] = 1
-        losses = [objective(weights[i, :]) for i in range(N)]
-        result = weights[np.argmin(losses), :]
-        # result = differential_evolution(objective, bounds=Bounds(lb, ub), maxiter=1000)
-        # result = brute(objective, rranges)
+        if self.weight_search == "random":
+            N = 10000  # 1w 样本随机搜索
+            weights = self.sample_weights(N, L)
+            losses = rank_losses(outputs, y_test, weights)
+            result = weights[np.argmin(losses), :]
+        elif self.weight_search == "coarse_to_fine":
+            result = self.coarse_to_fine_search(outputs, y_test)
+        else:
+            raise NotImplementedError
         self.logger.debug(str(result))
         w = result
         if np.sum(w) == 0:
@@ -131,6 +278,26 @@ class ConfigEvaluator:
         weight = w.tolist()
         return dict(zip(budgets, weight))
 
+    def sample_weights(self, N, L):
+        weights = self.rng.rand(N, L)
+        return snap_weights(weights)
+
+    def coarse_to_fine_search(self, outputs, y_test, n_coarse=1000, n_top=8, n_per_top=32, scales=(0.1, 0.03, 0.01)):
+        '''
+        Random search over ``n_coarse`` weights, then ``len(scales)`` rounds of Gaussian perturbations
+        around the ``n_top`` best weights found so far, with a shrinking scale.
+        '''
+        L = outputs.shape[0]
+        weights = self.sample_weights(n_coarse, L)
+        losses = rank_losses(outputs, y_test, weights)
+        for scale in scales:
+            top = np.argsort(losses, kind="stable")[:n_top]
+            candidates = np.repeat(weights[top], n_per_top, axis=0)
+            candidates = snap_weights(np.clip(candidates + self.rng.normal(0, scale, candidates.shape), 0, 1))
+            weights = np.vstack([weights[top], candidates])
+            losses = np.hstack([losses[top], rank_losses(outputs, y_test, candidates)])
+        return weights[np.argmin(losses), :]
+
     def update_weight(self, budget2weight):
         # self.budget2weight = dict(zip(budgets, weight))
         self.budget2weight = budget2weight
@@ -141,18 +308,22 @@ class ConfigEvaluator:
         self.logger.debug(msg)
         # 不做集成学习的形式
 
-    def __call__(self, X, y_opt):
+    def predict(self, budget, X, use_cache=True):
+        if use_cache:
+            return self.prediction_cache.predict(budget, X)
+        return self.budget2epm[budget].predict(X, return_std=True)
+
+    def __call__(self, X, y_opt, use_cache=True):
         start_time = time()
         if self.budget2weight is None:
-            epm = self.budget2epm[self.budget]
-            mean, std = epm.predict(X, return_std=True)
+            mean, std = self.predict(self.budget, X, use_cache)
         else:
             # 集成学习
             # todo: 如果太慢，可以考虑先用1个筛100个点出来，然后再细筛
             mean = np.zeros([X.shape[0]], dtype="float64")
             var = deepcopy(mean)
             for budget, weight in self.budget2weight.items():
-                mean_, std_ = self.budget2epm[budget].predict(X, return_std=True)
+                mean_, std_ = self.predict(budget, X, use_cache)
                 var_ = np.square(std_)
                 mean += mean_ * weight
                 var += var_ * (weight ** 2)
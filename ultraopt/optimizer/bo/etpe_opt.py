@@ -4,6 +4,7 @@
 # @Date    : 2020-12-15
 # @Contact    : qichun.tang@bupt.edu.cn
 from copy import deepcopy
+from time import time
 
 import numpy as np
 from tabular_nn import EmbeddingEncoder
@@ -13,6 +14,7 @@ from ultraopt.learning.tpe import TreeParzenEstimator
 from ultraopt.optimizer.base_opt import BaseOptimizer
 from ultraopt.utils.config_space import add_configs_origin, initial_design_2, sample_configurations
 from ultraopt.utils.config_transformer import ConfigTransformer
+from ultraopt.utils.hash import get_keys_of_vectors
 
 
 class ETPEOptimizer(BaseOptimizer):
@@ -20,15 +22,19 @@ class ETPEOptimizer(BaseOptimizer):
             self,
             # model related
             top_n_percent=15, min_points_in_kde=2,
-            bw_method="scott", cv_times=100, kde_sample_weight_scaler=None,
+            bw_method="scott", cv_times=100, kde_sample_weight_scaler=None, kde_backend="numpy",
             # several hyper-parameters
             gamma1=0.96, gamma2=3, max_bw_factor=4, min_bw_factor=1, max_try=3,
             min_points_in_model=20, min_n_candidates=8,
             n_candidates=None, n_candidates_factor=4, sort_by_EI=True,
+            # batch ask
+            batch_strategy="cl_min", batch_diversity=0.5,
             # Embedding Encoder
             embedding_encoder="default"
     ):
         super(ETPEOptimizer, self).__init__()
+        self.batch_strategy = batch_strategy
+        self.batch_diversity = batch_diversity
         self.min_bw_factor = min_bw_factor
         self.max_bw_factor = max_bw_factor
         self.embedding_encoder = embedding_encoder
@@ -46,7 +52,8 @@ class ETPEOptimizer(BaseOptimizer):
             min_points_in_kde=min_points_in_kde,
             bw_method=bw_method,
             cv_times=cv_times,
-            kde_sample_weight_scaler=kde_sample_weight_scaler
+            kde_sample_weight_scaler=kde_sample_weight_scaler,
+            kde_backend=kde_backend
         )
 
     def initialize(self, config_space, budgets=(1,), random_state=42, initial_points=None, budget2obvs=None):
@@ -72,6 +79,8 @@ class ETPEOptimizer(BaseOptimizer):
             vectors = np.array([config.get_array() for config in sample_configurations(self.config_space, 5000)])
             self.config_transformer.fit_encoder(vectors)
         self.budget2epm = {budget: None for budget in budgets}
+        # encoder version that the epm of each budget was fitted with
+        self.budget2encoder_version = {budget: None for budget in budgets}
         if self.n_candidates is None:
             self.n_candidates = max(
                 self.config_transformer.n_variables_embedded * self.n_candidates_factor,
@@ -87,22 +96,30 @@ class ETPEOptimizer(BaseOptimizer):
                               f"to {updated_min_points_in_model}")
             self.min_points_in_model = updated_min_points_in_model
 
+    def add_budget(self, budget):
+        super(ETPEOptimizer, self).add_budget(budget)
+        self.budget2epm.setdefault(budget, None)
+        self.budget2encoder_version.setdefault(budget, None)
+
     def tpe_sampling(self, epm, budget):
         info_dict = {"model_based_pick": True}
         for try_id in range(self.max_try):
-            samples = epm.sample(
+            samples = epm.sample_vectors(
                 n_candidates=self.n_candidates,
                 sort_by_EI=self.sort_by_EI,
                 random_state=self.rng,
                 bandwidth_factor=self._bw_factor + self.min_bw_factor
             )
-            for i, sample in enumerate(samples):
-                if self.is_config_exist(budget, sample):
-                    self.logger.debug(f"The sample already exists and needs to be resampled. "
-                                      f"It's the {i}-th time sampling in thompson sampling. ")
-                else:
-                    add_configs_origin(sample, "ETPE sampling")
-                    return sample, info_dict
+            is_new = self.filter_existing(budget, samples)
+            if np.any(is_new):
+                i = int(np.argmax(is_new))
+                if i > 0:
+                    self.logger.debug(f"The first {i} samples already exist in observations, "
+                                      f"pick the {i}-th sample in thompson sampling. ")
+                # only the picked candidate is materialized
+                sample = self.config_transformer.compiled_space.materialize(samples[i])
+                add_configs_origin(sample, "ETPE sampling")
+                return sample, info_dict
             old_db = self._bw_factor
             self._bw_factor = (self._bw_factor + self.min_bw_factor) * self.gamma2 - self.min_bw_factor
             self.logger.warning(f"After {try_id + 1} times sampling, all samples exist in observations. "
@@ -113,6 +130,80 @@ class ETPEOptimizer(BaseOptimizer):
         info_dict = {"model_based_pick": False}
         return sample, info_dict
 
+    def ask(self, budget=1, n_points=None, strategy=None):
+        '''
+        ``strategy`` defaults to ``batch_strategy``, a constant liar strategy ("cl_min", "cl_mean", "cl_max")
+        of ``BaseOptimizer.ask`` or ``"diversified"``, which proposes a batch of ``n_points`` configs
+        from one candidate pool of the good KDEs, without refitting between the points.
+        '''
+        if strategy is None:
+            strategy = self.batch_strategy
+        if n_points is None or strategy != "diversified":
+            return super(ETPEOptimizer, self).ask(budget, n_points, strategy)
+        if not (isinstance(n_points, int) and n_points > 0):
+            raise ValueError(
+                "n_points should be int > 0, got " + str(n_points)
+            )
+        max_budget = self.get_available_max_budget()
+        epm = self.budget2epm[max_budget]
+        if epm is None or (self.initial_points is not None and self.initial_points_index < len(self.initial_points)):
+            # initial design, there is no model to refit between the points
+            return super(ETPEOptimizer, self).ask(budget, n_points, "cl_min")
+        start_time = time()
+        config_info_pairs = []
+        for vector in self.diversified_sampling(epm, budget, n_points):
+            config = self.config_transformer.compiled_space.materialize(vector)
+            add_configs_origin(config, "ETPE sampling")
+            config, config_info = self.process_config_info_pair(config, {"model_based_pick": True}, budget)
+            self.register_config(config, budget, start_time)
+            config_info_pairs.append((config, config_info))
+        self._bw_factor *= self.gamma1 ** len(config_info_pairs)
+        # all the candidates already exist, sample the rest one by one
+        while len(config_info_pairs) < n_points:
+            config_info_pairs.append(self.get_config(budget))
+        return config_info_pairs
+
+    def diversified_sampling(self, epm, budget, n_points) -> np.ndarray:
+        '''
+        Draw ``n_points * n_candidates`` candidates from the good KDEs, score them once with the EI of ``epm``
+        and greedily pick up to ``n_points`` new, distinct vectors. Each pick maximizes the normalized EI times
+        ``1 - exp(-(d / r) ** 2)``, where ``d`` is the distance to the nearest picked candidate and ``r`` is
+        ``batch_diversity`` times the median distance of the candidates to the first pick.
+        '''
+        vectors = epm.sample_vectors(
+            n_candidates=n_points * self.n_candidates,
+            sort_by_EI=False,
+            random_state=self.rng,
+            bandwidth_factor=self._bw_factor + self.min_bw_factor
+        )
+        # new and distinct candidates
+        keys = get_keys_of_vectors(vectors)
+        is_new = self.filter_existing(budget, vectors)
+        index = sorted({key: i for i, key in reversed(list(enumerate(keys)))}.values())
+        index = [i for i in index if is_new[i]]
+        vectors = vectors[index]
+        if vectors.shape[0] == 0:
+            return vectors
+        X_trans = self.config_transformer.transform(vectors)
+        EI = epm.predict(X_trans)
+        # inactive hyperparameters are compared as 0
+        X_trans = np.nan_to_num(X_trans)
+        EI_range = EI.max() - EI.min()
+        score = (EI - EI.min()) / EI_range if EI_range > 0 else np.ones_like(EI)
+        picked = [int(np.argmax(score))]
+        min_dist = np.linalg.norm(X_trans - X_trans[picked[0]], axis=1)
+        r = self.batch_diversity * np.median(min_dist)
+        for _ in range(min(n_points, vectors.shape[0]) - 1):
+            penalty = 1 - np.exp(-(min_dist / r) ** 2) if r > 0 else (min_dist > 0).astype("float64")
+            # picked candidates have a distance of 0
+            penalized_score = (score + 1e-12) * penalty
+            i = int(np.argmax(penalized_score))
+            if penalized_score[i] <= 0:
+                break
+            picked.append(i)
+            min_dist = np.minimum(min_dist, np.linalg.norm(X_trans - X_trans[i], axis=1))
+        return vectors[picked]
+
     def _get_config(self, budget, max_budget):
         # choose model from max-budget
         epm = self.budget2epm[max_budget]
@@ -151,30 +242,59 @@ class ETPEOptimizer(BaseOptimizer):
     def _new_result(self, budget, vectors: np.ndarray, losses: np.ndarray):
         if len(losses) < self.min_points_in_model:
             return
-        vectors = self.budget2obvs[budget]["vectors"]
-        losses = np.array(self.budget2obvs[budget]["losses"])
         # fit embedding encoder
         if self.has_embedding_encoder:
             if self.config_transformer.encoder.fitted:
-                X = np.array([vectors[-1]])
-                y = np.array([losses[-1]])
+                X = vectors[-1:]
+                y = losses[-1:]
                 self.config_transformer.fit_encoder(X, y)
             else:
-                X = np.array(vectors)
-                y = np.array(losses)
-                self.config_transformer.fit_encoder(X, y)
+                self.config_transformer.fit_encoder(vectors, losses)
             # todo: plot
-        # fit epm
+        self.fit_epm(budget, vectors, losses)
+
+    def _fantasize(self, budget, vectors: np.ndarray, losses: np.ndarray):
+        # the embedding encoder is not fitted with lies, the epm adds the lie incrementally.
+        # Before the encoder is fitted on real observations, the lies can not be encoded
+        if len(losses) < self.min_points_in_model or not self.is_encoder_fitted:
+            return
+        self.fit_epm(budget, vectors, losses)
+
+    def _discard_fantasies(self, budget, vectors: np.ndarray, losses: np.ndarray):
+        if len(losses) < self.min_points_in_model or not self.is_encoder_fitted:
+            # the epm was built from lies
+            self.budget2epm[budget] = None
+            return
         if self.budget2epm[budget] is None:
+            self.fit_epm(budget, vectors, losses)
+            return
+        # one refit on the real observations, their encoding is cached
+        self.budget2epm[budget] = self.budget2epm[budget].fit(
+            self.config_transformer.transform(vectors, cache_key=budget), losses)
+        self.budget2encoder_version[budget] = self.config_transformer.encoder_version
+
+    def fit_epm(self, budget, vectors: np.ndarray, losses: np.ndarray):
+        epm = self.budget2epm[budget]
+        encoder_version = self.config_transformer.encoder_version
+        if epm is not None and epm.n_samples_ == len(losses) - 1 and \
+                self.budget2encoder_version[budget] == encoder_version:
+            # the encoding of previous observations is unchanged, only add the new observation
+            X_new = self.config_transformer.transform(vectors, cache_key=budget)[-1:]
+            self.budget2epm[budget] = epm.partial_fit(X_new, losses[-1:])
+            return
+        if epm is None:
             # new epm
             epm = deepcopy(self.tpe)
             epm.set_config_transformer(self.config_transformer)
-        else:
-            epm = self.budget2epm[budget]
-        X_obvs = self.config_transformer.transform(vectors)
+        X_obvs = self.config_transformer.transform(vectors, cache_key=budget)
         self.budget2epm[budget] = epm.fit(X_obvs, losses)
+        self.budget2encoder_version[budget] = encoder_version
 
     @property
     def has_embedding_encoder(self):
         return isinstance(self.config_transformer.encoder, EmbeddingEncoder) and \
                len(self.config_transformer.high_r_cols) > 0
+
+    @property
+    def is_encoder_fitted(self):
+        return not self.has_embedding_encoder or self.config_transformer.encoder.fitted
@@ -18,6 +18,6 @@ class RandomOptimizer(BaseOptimizer):
 
     def get_available_max_budget(self):
         for budget in reversed(sorted(self.budgets)):
-            if self.budget2obvs[budget]["losses"]:
+            if len(self.budget2obvs[budget]["losses"]):
                 return budget
         return self.budgets[0]
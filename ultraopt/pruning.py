@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+from typing import Callable, Optional
+
+import numpy as np
+
+
+class TrialPruned(Exception):
+    '''Raised inside an evaluation (by ``report`` or by the evaluation function itself) to stop a bad trial.'''
+
+
+class PercentilePruner():
+    '''
+    Prunes a trial whose loss at a step is worse than the ``percentile`` of the losses the other trials
+    of the same budget reported at that step. Nothing is pruned before ``n_warmup_steps``
+    or while less than ``n_startup_trials`` trials reported at the step.
+    '''
+
+    def __init__(self, percentile=50.0, n_startup_trials=5, n_warmup_steps=0):
+        self.percentile = percentile
+        self.n_startup_trials = n_startup_trials
+        self.n_warmup_steps = n_warmup_steps
+
+    def should_prune(self, step, loss, losses) -> bool:
+        if step < self.n_warmup_steps or len(losses) < self.n_startup_trials:
+            return False
+        return not loss <= np.percentile(losses, self.percentile)
+
+
+class MedianPruner(PercentilePruner):
+    def __init__(self, n_startup_trials=5, n_warmup_steps=0):
+        super(MedianPruner, self).__init__(50.0, n_startup_trials, n_warmup_steps)
+
+
+class Reporter():
+    '''
+    The ``report(step, loss)`` callback given to the evaluation functions that accept a ``report`` argument.
+    It records the learning curve of the trial and raises ``TrialPruned`` when the ``pruner`` says so,
+    ``step2losses`` are the losses the finished trials of the same budget reported at each step.
+    '''
+
+    def __init__(self, pruner: Optional[PercentilePruner] = None, step2losses=None):
+        self.pruner = pruner
+        # a dict, or a list of (step, losses) pairs when it comes through RPC
+        self.step2losses = dict(step2losses) if step2losses is not None else {}
+        self.curve = []
+
+    def __call__(self, step, loss):
+        self.curve.append([step, float(loss)])
+        if self.pruner is not None and self.pruner.should_prune(step, loss, self.step2losses.get(step, [])):
+            raise TrialPruned(f"trial pruned at step {step} with loss {loss}")
+
+    def get_result(self, loss=None, pruned=False) -> dict:
+        if pruned:
+            # a partial observation: the last reported loss
+            loss = self.curve[-1][1] if self.curve else np.inf
+        result = {"loss": loss}
+        if self.curve:
+            result["curve"] = self.curve
+        if pruned:
+            result["pruned"] = True
+        return result
+
+
+def run_eval_func(eval_func: Callable, config: dict, **kwargs) -> dict:
+    '''
+    Calls ``eval_func(config, **kwargs)`` and returns the result of the job, if the trial is pruned
+    the result holds its last reported loss and ``"pruned": True``.
+    '''
+    report = kwargs.get("report")
+    if report is None:
+        report = Reporter()
+    try:
+        loss = eval_func(config, **kwargs)
+    except TrialPruned:
+        return report.get_result(pruned=True)
+    return report.get_result(loss)
@@ -1,8 +1,13 @@
 import copy
 import json
 import os
+import threading
+
+import numpy as np
 
 from ultraopt.structure import Datum
+from ultraopt.utils.checkpoint import to_json
+from ultraopt.utils.columnar import load_columnar, get_budget2obvs
 
 
 class Run(object):
@@ -65,13 +70,153 @@ def extract_HBS_learning_curves(runs):
     return ([lc, ])
 
 
+class JsonResultLogger(object):
+    """
+    Live result logger of the ``Master`` (and of the in-process strategies of ``fmin``), in the
+    'configs.json' / 'results.json' JSON-lines format read by ``logged_results_to_HBS_result``.
+
+    ``new_config`` and ``__call__`` only append a line to a buffer, a background thread appends the
+    buffers to the files every ``flush_interval`` seconds, so the master never waits for the disk and a
+    dashboard can follow the files of a running optimization (see ``LoggedResultsReader``).
+    """
+
+    def __init__(self, directory, overwrite=False, flush_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.config_fn = os.path.join(directory, 'configs.json')
+        self.results_fn = os.path.join(directory, 'results.json')
+        for fn in [self.config_fn, self.results_fn]:
+            if os.path.exists(fn):
+                if not overwrite:
+                    raise FileExistsError('The file %s already exists.' % fn)
+                os.remove(fn)
+        self.flush_interval = flush_interval
+        self.config_ids = set()
+        self.config_lines = []
+        self.result_lines = []
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.flush_periodically, name='result_logger')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def new_config(self, config_id, config, config_info):
+        with self.lock:
+            if not config_id in self.config_ids:
+                self.config_ids.add(config_id)
+                self.config_lines.append(json.dumps([config_id, config, config_info], default=to_json))
+
+    def __call__(self, job):
+        with self.lock:
+            if not job.id in self.config_ids:
+                # e.g. the runs of a warm start
+                self.config_ids.add(job.id)
+                self.config_lines.append(json.dumps([job.id, job.kwargs['config'], {}], default=to_json))
+            self.result_lines.append(json.dumps(
+                [job.id, job.kwargs['budget'], job.timestamps, job.result, job.exception], default=to_json))
+
+    def flush(self):
+        with self.lock:
+            config_lines, self.config_lines = self.config_lines, []
+            result_lines, self.result_lines = self.result_lines, []
+        # the configs first, a reader always knows the config of a result
+        for fn, lines in [(self.config_fn, config_lines), (self.results_fn, result_lines)]:
+            if lines:
+                with open(fn, 'a') as fh:
+                    fh.write('\n'.join(lines) + '\n')
+
+    def flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+
+
+class LoggedResultsReader(object):
+    """
+    Incremental reader of the logs of a ``JsonResultLogger``: each ``read`` only parses the lines
+    appended since the previous one (an incomplete last line is left for the next ``read``)
+    and returns the ``Result`` of all the runs logged so far.
+    """
+
+    def __init__(self, directory):
+        self.config_fn = os.path.join(directory, 'configs.json')
+        self.results_fn = os.path.join(directory, 'results.json')
+        self.fn2offset = {self.config_fn: 0, self.results_fn: 0}
+        self.data = {}
+        self.pending_results = []
+        self.time_ref = float('inf')
+        self.budget_set = set()
+
+    def read_new_lines(self, fn):
+        if not os.path.exists(fn):
+            return []
+        with open(fn, 'rb') as fh:
+            fh.seek(self.fn2offset[fn])
+            content = fh.read()
+        end = content.rfind(b'\n') + 1
+        self.fn2offset[fn] += end
+        return [json.loads(line) for line in content[:end].decode().splitlines() if line]
+
+    def read(self):
+        for line in self.read_new_lines(self.config_fn):
+            if len(line) == 3:
+                config_id, config, config_info = line
+            if len(line) == 2:
+                config_id, config, = line
+                config_info = 'N/A'
+
+            self.data[tuple(config_id)] = Datum(config=config, config_info=config_info)
+
+        results = self.pending_results + self.read_new_lines(self.results_fn)
+        self.pending_results = []
+        for line in results:
+            config_id, budget, timestamps, result, exception = line
+
+            id = tuple(config_id)
+            if id not in self.data:
+                # the config is logged by another flush
+                self.pending_results.append(line)
+                continue
+
+            self.data[id].timestamps[budget] = timestamps
+            self.data[id].results[budget] = result
+            self.data[id].exceptions[budget] = exception
+
+            self.budget_set.add(budget)
+            self.time_ref = min(self.time_ref, timestamps['submitted'])
+
+        # infer the hyperband configuration from the data
+        budget_list = sorted(list(self.budget_set))
+
+        HB_config = {
+            'eta': None if len(budget_list) < 2 else budget_list[1] / budget_list[0],
+            'min_budget': min(budget_list) if budget_list else None,
+            'max_budget': max(budget_list) if budget_list else None,
+            'budgets': budget_list,
+            'max_SH_iter': len(budget_list),
+            'time_ref': self.time_ref
+        }
+        # the Result normalizes the timestamps in place, only they are copied
+        data = {
+            id: Datum(config=datum.config, config_info=datum.config_info, results=dict(datum.results),
+                      timestamps={budget: dict(timestamps) for budget, timestamps in datum.timestamps.items()},
+                      exceptions=dict(datum.exceptions), status=datum.status, budget=datum.budget)
+            for id, datum in self.data.items()
+        }
+        return (Result([data], HB_config))
+
+
 def logged_results_to_HBS_result(directory):
     """
     function to import logged 'live-results' and return a HB_result object
 
     You can load live run results with this function and the returned
     HB_result object gives you access to the results the same way
-    a finished run would.
+    a finished run would. To follow a running optimization, keep a
+    ``LoggedResultsReader`` and call its ``read`` method, it only parses the new lines.
     
     Parameters
     ----------
@@ -84,46 +229,50 @@ def logged_results_to_HBS_result(directory):
         TODO
     
     """
-    data = {}
-    time_ref = float('inf')
-    budget_set = set()
+    return LoggedResultsReader(directory).read()
 
-    with open(os.path.join(directory, 'configs.json')) as fh:
-        for line in fh:
 
-            line = json.loads(line)
-
-            if len(line) == 3:
-                config_id, config, config_info = line
-            if len(line) == 2:
-                config_id, config, = line
-                config_info = 'N/A'
-
-            data[tuple(config_id)] = Datum(config=config, config_info=config_info)
-
-    with open(os.path.join(directory, 'results.json')) as fh:
-        for line in fh:
-            config_id, budget, timestamps, result, exception = json.loads(line)
-
-            id = tuple(config_id)
-
-            data[id].timestamps[budget] = timestamps
-            data[id].results[budget] = result
-            data[id].exceptions[budget] = exception
+def columnar_results_to_HBS_result(directory):
+    """
+    function to import a result saved in the columnar format (see ``FMinResult.save``)
+    and return a HB_result object, like ``logged_results_to_HBS_result``
 
-            budget_set.add(budget)
-            time_ref = min(time_ref, timestamps['submitted'])
+    Each configuration gets the id (0, 0, i), there is no iteration structure in the columnar format.
 
-    # infer the hyperband configuration from the data
-    budget_list = sorted(list(budget_set))
+    Parameters
+    ----------
+    directory: str
+        the directory containing the .npy columns and meta.json
 
+    Returns
+    -------
+    ultraopt.result.Result
+    """
+    data = {}
+    columns = load_columnar(directory)
+    budget2obvs = get_budget2obvs(columns)
+    configId2id = {}
+    for budget, start, end in columns["budget_slices"]:
+        configs = budget2obvs[budget]["configs"]
+        for i, config_id in enumerate(columns["config_ids"][start:end].tolist()):
+            row = start + i
+            if config_id not in configId2id:
+                configId2id[config_id] = (0, 0, len(configId2id))
+                data[configId2id[config_id]] = Datum(config=configs[i].get_dictionary(),
+                                                     config_info={"origin": configs[i].origin})
+            datum = data[configId2id[config_id]]
+            start_time, end_time = float(columns["start_times"][row]), float(columns["end_times"][row])
+            datum.timestamps[budget] = {"submitted": start_time, "started": start_time, "finished": end_time}
+            datum.results[budget] = {"loss": float(columns["losses"][row])}
+            datum.exceptions[budget] = None
+    budget_list = sorted(budget for budget, start, end in columns["budget_slices"] if end > start)
     HB_config = {
         'eta': None if len(budget_list) < 2 else budget_list[1] / budget_list[0],
-        'min_budget': min(budget_set),
-        'max_budget': max(budget_set),
+        'min_budget': min(budget_list) if budget_list else None,
+        'max_budget': max(budget_list) if budget_list else None,
         'budgets': budget_list,
-        'max_SH_iter': len(budget_set),
-        'time_ref': time_ref
+        'max_SH_iter': len(budget_list),
+        'time_ref': float(np.nanmin(columns["start_times"])) if budget_list else float('inf')
     }
     return (Result([data], HB_config))
 
@@ -256,7 +405,8 @@ class Result(object):
                 if d.results[b] is None:
                     r = Run(config_id, b, None, None, d.timestamps[b], err_logs)
                 else:
-                    r = Run(config_id, b, d.results[b]['loss'], d.results[b]['info'],
+                    # the results of ultraopt's evaluation functions have no 'info'
+                    r = Run(config_id, b, d.results[b]['loss'], d.results[b].get('info'),
                             d.timestamps[b], err_logs)
                 runs.append(r)
             except:
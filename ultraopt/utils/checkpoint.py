@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import json
+import os
+import queue
+import threading
+from io import BytesIO
+
+import numpy as np
+from joblib import dump, load
+
+from ultraopt.structure import Job
+from ultraopt.utils.hash import get_hash_of_config
+from ultraopt.utils.logging_ import get_logger
+
+logger = get_logger(__name__)
+
+
+def get_log_file(checkpoint_file):
+    return checkpoint_file + ".log"
+
+
+def to_json(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+class Checkpointer():
+    '''
+    Checkpoints a run without blocking the caller on disk.
+
+    Every result is appended to the log ``checkpoint_file + ".log"`` (one JSON line with the config,
+    the budget, the result and the start/end time of the run), a background thread writes the lines
+    and fsyncs once per batch of the lines that are waiting. So the cost of checkpointing a result does
+    not depend on the size of the history.
+
+    ``snapshot`` dumps the whole optimizer (with its models) to ``checkpoint_file``, as ``dump_checkpoint``
+    did. Without ``lock``, the optimizer is serialized in memory by the caller, so that the snapshot is
+    consistent, and written by the background thread. With ``lock`` (the lock other threads hold while
+    they change the optimizer, e.g. the condition of the ``Master``), ``snapshot`` only queues the request
+    and the background thread serializes the optimizer while holding ``lock``. Snapshots are only needed
+    rarely: ``load_checkpoint`` loads the last snapshot and replays the results of the log that are not in it.
+
+    The first snapshot is queued like the others. The log is only truncated once it is written, so a run
+    resumed from ``checkpoint_file`` that checkpoints to the same file keeps the previous log until then.
+    '''
+
+    def __init__(self, optimizer, checkpoint_file, lock=None):
+        self.optimizer = optimizer
+        self.lock = lock
+        self.checkpoint_file = checkpoint_file
+        self.log_file = get_log_file(checkpoint_file)
+        self.queue = queue.Queue()
+        # the number of observations of each budget when the log starts, e.g. after a warm start
+        header = {"budget2n_obvs": [[budget, len(obvs)] for budget, obvs in optimizer.budget2obvs.items()]}
+        self.snapshot()
+        self.queue.put(("line", json.dumps(header)))
+        self.thread = threading.Thread(target=self.write, name="checkpointer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def log_result(self, config: dict, budget: float, result):
+        info = self.optimizer.runId2info.get((get_hash_of_config(config, self.optimizer.config_space), budget), {})
+        record = {"config": config, "budget": budget, "result": result,
+                  "start_time": info.get("start_time"), "end_time": info.get("end_time")}
+        self.queue.put(("line", json.dumps(record, default=to_json)))
+
+    def snapshot(self):
+        # without a lock, the optimizer may change as soon as this returns
+        self.queue.put(("snapshot", self.dump() if self.lock is None else None))
+
+    def dump(self) -> bytes:
+        buffer = BytesIO()
+        dump(self.optimizer, buffer)
+        return buffer.getvalue()
+
+    def flush(self):
+        '''Blocks until everything logged so far is on disk.'''
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(("close", None))
+        self.thread.join()
+
+    def write(self):
+        log_fh = None
+        closed = False
+        while not closed:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                lines = []
+                for kind, item in items:
+                    if kind == "line":
+                        lines.append(item)
+                        continue
+                    if kind == "close":
+                        closed = True
+                        continue
+                    # the lines logged before the snapshot are synced first
+                    self.write_lines(log_fh, lines)
+                    lines = []
+                    try:
+                        if item is None:
+                            with self.lock:
+                                item = self.dump()
+                        self.write_snapshot(item)
+                    finally:
+                        if log_fh is None:
+                            # the previous log is only needed until the first snapshot is written
+                            log_fh = open(self.log_file, "w")
+                self.write_lines(log_fh, lines)
+            except Exception as e:
+                logger.error(f"failed to write the checkpoint {self.checkpoint_file}: {e}")
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+        if log_fh is not None:
+            log_fh.close()
+
+    def write_lines(self, log_fh, lines):
+        if not lines:
+            return
+        log_fh.write("\n".join(lines) + "\n")
+        log_fh.flush()
+        os.fsync(log_fh.fileno())
+
+    def write_snapshot(self, data):
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if os.path.exists(self.checkpoint_file):
+            os.replace(self.checkpoint_file, self.checkpoint_file + ".bak")
+        os.replace(tmp_file, self.checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file):
+    '''
+    Loads the optimizer of the last snapshot of ``checkpoint_file`` and replays the results of
+    the checkpoint log that were logged after the snapshot.
+    '''
+    if not os.path.exists(checkpoint_file) and os.path.exists(checkpoint_file + ".bak"):
+        # the run stopped while a new snapshot replaced the previous one
+        checkpoint_file = checkpoint_file + ".bak"
+    optimizer = load(checkpoint_file)
+    log_file = get_log_file(checkpoint_file[:-len(".bak")] if checkpoint_file.endswith(".bak") else checkpoint_file)
+    if not os.path.exists(log_file):
+        return optimizer
+    with open(log_file) as fh:
+        lines = fh.read().splitlines()
+    if not lines:
+        return optimizer
+    header = json.loads(lines[0])
+    # the results of each budget are logged in the order of the observations,
+    # the ones the snapshot holds are skipped
+    budget2n_skip = {
+        budget: len(optimizer.budget2obvs[budget]) - n_obvs
+        for budget, n_obvs in header["budget2n_obvs"]
+    }
+    replayed_budgets = set()
+    n_replayed = 0
+    for line in lines[1:]:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # the last line was only partially written
+            break
+        budget = record["budget"]
+        if budget2n_skip.get(budget, 0) > 0:
+            budget2n_skip[budget] -= 1
+            continue
+        config = record["config"]
+        optimizer.register_config(config, budget, record["start_time"])
+        job = Job(get_hash_of_config(config, optimizer.config_space))
+        job.kwargs = {"budget": budget, "config": config, "config_info": {}}
+        job.result = record["result"]
+        optimizer.new_result(job, update_model=False)
+        if record["end_time"] is not None:
+            optimizer.runId2info[(job.id, budget)]["end_time"] = record["end_time"]
+        replayed_budgets.add(budget)
+        n_replayed += 1
+    for budget in replayed_budgets:
+        obvs = optimizer.budget2obvs[budget]
+        optimizer._new_result(budget, obvs["vectors"], obvs["losses"])
+    logger.info(f"replayed {n_replayed} results logged after the snapshot {checkpoint_file}")
+    return optimizer
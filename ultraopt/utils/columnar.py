@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import json
+import os
+from typing import Dict
+
+import numpy as np
+from ConfigSpace.read_and_write import json as cs_json
+
+from ultraopt.utils.hash import get_hashes_of_vectors
+from ultraopt.utils.obvs_store import ObservationStore
+
+columns = ("vectors", "losses", "budgets", "start_times", "end_times", "origin_codes", "config_ids")
+meta_file = "meta.json"
+
+
+def is_columnar_result(path) -> bool:
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, meta_file))
+
+
+def save_columnar(directory, optimizer):
+    '''
+    Saves the observations of ``optimizer`` in ``directory`` as one ``.npy`` file per column
+    (``vectors``, ``losses``, ``budgets``, ``start_times``, ``end_times``, ``origin_codes`` and ``config_ids``),
+    the rows are sorted by budget so the rows of a budget are a slice of each column. ``meta.json`` holds
+    the config space, the origins and the slice of each budget.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    budgets = sorted(optimizer.budget2obvs.keys())
+    n_dims = len(optimizer.config_space.get_hyperparameters())
+    column2parts = {column: [] for column in columns}
+    origins = []
+    budget_slices = []
+    start = 0
+    for budget in budgets:
+        obvs = optimizer.budget2obvs[budget]
+        n_obvs = len(obvs)
+        budget_slices.append([budget, start, start + n_obvs])
+        start += n_obvs
+        if n_obvs == 0:
+            continue
+        config_ids = get_hashes_of_vectors(obvs["vectors"], optimizer.config_space)
+        infos = [optimizer.runId2info.get((config_id, budget), {}) for config_id in config_ids]
+        origin_codes = []
+        for config in obvs["configs"]:
+            origin = str(config.origin)
+            if origin not in origins:
+                origins.append(origin)
+            origin_codes.append(origins.index(origin))
+        column2parts["vectors"].append(obvs["vectors"])
+        column2parts["losses"].append(obvs["losses"])
+        column2parts["budgets"].append(np.full([n_obvs], budget, dtype="float64"))
+        column2parts["start_times"].append(np.array([info.get("start_time", np.nan) for info in infos], dtype="float64"))
+        column2parts["end_times"].append(np.array([info.get("end_time", np.nan) for info in infos], dtype="float64"))
+        column2parts["origin_codes"].append(np.array(origin_codes, dtype="int32"))
+        column2parts["config_ids"].append(np.array(config_ids, dtype="U32"))
+    empty_columns = {
+        "vectors": np.zeros([0, n_dims], dtype="float64"), "origin_codes": np.zeros([0], dtype="int32"),
+        "config_ids": np.zeros([0], dtype="U32")
+    }
+    for column, parts in column2parts.items():
+        array = np.concatenate(parts) if parts else empty_columns.get(column, np.zeros([0], dtype="float64"))
+        np.save(os.path.join(directory, f"{column}.npy"), array)
+    meta = {
+        "optimizer": optimizer.__class__.__name__,
+        "config_space": cs_json.write(optimizer.config_space),
+        "budgets": budgets,
+        "budget_slices": budget_slices,
+        "origins": origins
+    }
+    with open(os.path.join(directory, meta_file), "w") as fh:
+        json.dump(meta, fh)
+
+
+def load_columnar(directory, mmap_mode="r") -> dict:
+    '''
+    Loads the columns saved by ``save_columnar``, memory-mapped by default (``mmap_mode=None`` reads them),
+    with the config space and the other entries of ``meta.json``.
+    '''
+    with open(os.path.join(directory, meta_file)) as fh:
+        data = json.load(fh)
+    data["config_space"] = cs_json.read(data["config_space"])
+    for column in columns:
+        data[column] = np.load(os.path.join(directory, f"{column}.npy"), mmap_mode=mmap_mode)
+    return data
+
+
+def get_budget2obvs(data: dict, config_space=None) -> Dict[float, ObservationStore]:
+    '''
+    The observations of each budget of the loaded ``data``, wrapping slices of the columns
+    (nothing is copied, the configs are built when they are accessed).
+    '''
+    if config_space is None:
+        config_space = data["config_space"]
+    budget2obvs = {}
+    for budget, start, end in data["budget_slices"]:
+        origins = [data["origins"][code] for code in data["origin_codes"][start:end]]
+        budget2obvs[budget] = ObservationStore.from_arrays(
+            config_space, data["vectors"][start:end], data["losses"][start:end], origins)
+    return budget2obvs
+
+
+def get_runId2info(data: dict) -> Dict[tuple, dict]:
+    return {
+        (config_id, budget): {"start_time": start_time, "end_time": end_time, "loss": loss}
+        for config_id, budget, start_time, end_time, loss in zip(
+            data["config_ids"].tolist(), data["budgets"].tolist(), data["start_times"].tolist(),
+            data["end_times"].tolist(), data["losses"].tolist())
+    }
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+import numbers
+from typing import List
+
+import numpy as np
+from ConfigSpace import ConfigurationSpace, Configuration, CategoricalHyperparameter, OrdinalHyperparameter, \
+    Constant
+from ConfigSpace.conditions import EqualsCondition, NotEqualsCondition, InCondition, GreaterThanCondition, \
+    LessThanCondition, AndConjunction, OrConjunction
+from ConfigSpace.hyperparameters import IntegerHyperparameter
+from ConfigSpace.forbidden import ForbiddenEqualsClause, ForbiddenInClause, ForbiddenAndConjunction
+from sklearn.utils import check_random_state
+
+
+class CompiledConfigSpace():
+    '''
+    Conditions and forbidden clauses of a ConfigurationSpace compiled once into NumPy operations,
+    so a whole (N × d) matrix of config vectors can be deactivated, validated and canonicalized
+    without building a ``Configuration`` per row.
+
+    ``process(X)`` gives the same vectors (and rejects the same rows) as calling
+    ``ultraopt.utils.config_space.deactivate`` and then ``deactivate_inactive_hyperparameters`` on
+    every row; ``materialize`` builds a ``Configuration`` only for the rows that are actually used.
+    '''
+
+    def __init__(self, config_space: ConfigurationSpace):
+        self.config_space = config_space
+        self.hyperparameters = config_space.get_hyperparameters()
+        self.n_dims = len(self.hyperparameters)
+        self.name2idx = {hp.name: i for i, hp in enumerate(self.hyperparameters)}
+        # number of choices of categorical / ordinal hyperparameters, 0 for numerical ones
+        self.n_choices = np.zeros([self.n_dims], dtype="int64")
+        self.is_constant = np.zeros([self.n_dims], dtype="bool")
+        for i, hp in enumerate(self.hyperparameters):
+            if isinstance(hp, CategoricalHyperparameter):
+                self.n_choices[i] = len(hp.choices)
+            elif isinstance(hp, OrdinalHyperparameter):
+                self.n_choices[i] = len(hp.sequence)
+            elif isinstance(hp, Constant):
+                self.is_constant[i] = True
+        self.is_ordinal = np.array([isinstance(hp, OrdinalHyperparameter) for hp in self.hyperparameters], dtype="bool")
+        self.numerical_ids = [i for i in range(self.n_dims)
+                              if self.n_choices[i] == 0 and not self.is_constant[i]]
+        # vector of the default values, newly activated hyperparameters of a neighbor take these values
+        self.default_vector = np.array([hp._inverse_transform(hp.default_value) for hp in self.hyperparameters],
+                                       dtype="float64")
+        # activation plan: (child_id, conditions) in topological order
+        self.activation_plan = []
+        for i, hp in enumerate(self.hyperparameters):
+            conditions = config_space.get_parent_conditions_of(hp.name)
+            if conditions:
+                self.activation_plan.append((i, conditions))
+        self.forbidden_clauses = config_space.get_forbiddens()
+
+    def evaluate_condition(self, condition, X: np.ndarray) -> np.ndarray:
+        if isinstance(condition, AndConjunction):
+            return np.all([self.evaluate_condition(component, X) for component in condition.components], axis=0)
+        elif isinstance(condition, OrConjunction):
+            return np.any([self.evaluate_condition(component, X) for component in condition.components], axis=0)
+        elif isinstance(condition, (EqualsCondition, NotEqualsCondition, InCondition,
+                                    GreaterThanCondition, LessThanCondition)):
+            parent = X[:, self.name2idx[condition.parent.name]]
+            # comparisons with NaN (inactive parent) are False
+            with np.errstate(invalid="ignore"):
+                if isinstance(condition, EqualsCondition):
+                    return parent == condition.vector_value
+                elif isinstance(condition, NotEqualsCondition):
+                    return ~np.isnan(parent) & (parent != condition.vector_value)
+                elif isinstance(condition, InCondition):
+                    return np.isin(parent, condition.vector_values)
+                elif isinstance(condition, GreaterThanCondition):
+                    return parent > condition.vector_value
+                else:
+                    return parent < condition.vector_value
+        # unknown condition, evaluate row by row
+        return np.array([condition.evaluate_vector(x) for x in X], dtype="bool")
+
+    def evaluate_forbidden(self, clause, X: np.ndarray) -> np.ndarray:
+        if isinstance(clause, ForbiddenAndConjunction):
+            return np.all([self.evaluate_forbidden(component, X) for component in clause.components], axis=0)
+        elif isinstance(clause, ForbiddenEqualsClause):
+            return X[:, self.name2idx[clause.hyperparameter.name]] == clause.vector_value
+        elif isinstance(clause, ForbiddenInClause):
+            return np.isin(X[:, self.name2idx[clause.hyperparameter.name]], list(clause.vector_values))
+        return np.array([clause.is_forbidden_vector(x, strict=False) for x in X], dtype="bool")
+
+    def deactivate(self, X: np.ndarray) -> np.ndarray:
+        '''Returns a copy of ``X`` whose inactive hyperparameters are set to NaN.'''
+        X = np.array(X, dtype="float64", ndmin=2)
+        # parents always come before their children in the activation plan
+        for child_id, conditions in self.activation_plan:
+            active = np.all([self.evaluate_condition(condition, X) for condition in conditions], axis=0)
+            X[~active, child_id] = np.nan
+        return X
+
+    def canonicalize(self, X: np.ndarray) -> np.ndarray:
+        '''
+        Round-trip the numerical columns through their values (in place), e.g. quantized or integer
+        hyperparameters are snapped to the vector of the nearest legal value and out of bound values are clipped.
+        '''
+        for i in self.numerical_ids:
+            col = X[:, i]
+            mask = np.isfinite(col)
+            if not np.any(mask):
+                continue
+            hp = self.hyperparameters[i]
+            try:
+                col[mask] = hp._inverse_transform(hp._transform(col[mask]))
+            except Exception:
+                col[mask] = [hp._inverse_transform(hp._transform(value)) for value in col[mask]]
+        X[:, self.is_constant] = np.where(np.isnan(X[:, self.is_constant]), np.nan, 0)
+        return X
+
+    def is_valid(self, X: np.ndarray) -> np.ndarray:
+        '''
+        Rows of a deactivated matrix that are legal: all active hyperparameters have a value,
+        categorical/ordinal indexes are in range, and no forbidden clause is violated.
+        '''
+        valid = np.ones([X.shape[0]], dtype="bool")
+        active = np.ones_like(X, dtype="bool")
+        for child_id, conditions in self.activation_plan:
+            active[:, child_id] = np.all([self.evaluate_condition(condition, X) for condition in conditions], axis=0)
+        valid &= ~np.any(active & np.isnan(X), axis=1)
+        choice_ids = self.n_choices > 0
+        C = X[:, choice_ids]
+        with np.errstate(invalid="ignore"):
+            legal = np.isnan(C) | ((C == np.round(C)) & (C >= 0) & (C < self.n_choices[choice_ids]))
+        valid &= np.all(legal, axis=1)
+        for clause in self.forbidden_clauses:
+            valid &= ~self.evaluate_forbidden(clause, X)
+        return valid
+
+    def process(self, X: np.ndarray):
+        '''Returns the deactivated, canonical vectors of the valid rows of ``X`` and the mask of valid rows.'''
+        X = self.canonicalize(self.deactivate(X))
+        valid = self.is_valid(X)
+        return X[valid], valid
+
+    def vectorize(self, dicts: List[dict]):
+        '''
+        The vectors of config dicts, built one hyperparameter (column) at a time, and the mask of the
+        dicts that are legal configurations: known hyperparameters with legal values, exactly the active
+        hyperparameters are given and no forbidden clause is violated (what ``Configuration(config_space, values)``
+        checks row by row).
+        '''
+        X = np.full([len(dicts), self.n_dims], np.nan, dtype="float64")
+        legal = np.ones([len(dicts)], dtype="bool")
+        for i, hp in enumerate(self.hyperparameters):
+            values = [dict_.get(hp.name) for dict_ in dicts]
+            rows = np.array([value is not None for value in values], dtype="bool")
+            if not np.any(rows):
+                continue
+            values = [value for value in values if value is not None]
+            if self.n_choices[i] > 0 or self.is_constant[i]:
+                # few distinct values, each one is transformed once
+                value2vector = {}
+                col = np.empty([len(values)], dtype="float64")
+                for j, value in enumerate(values):
+                    key = (type(value), value)
+                    if key not in value2vector:
+                        try:
+                            value2vector[key] = float(hp._inverse_transform(value))
+                        except (ValueError, TypeError):
+                            value2vector[key] = np.nan
+                    col[j] = value2vector[key]
+            else:
+                # like ``Configuration``, strings such as "0.5" (and floats of integer hyperparameters) are illegal
+                number_type = numbers.Integral if isinstance(hp, IntegerHyperparameter) else numbers.Real
+                raw = np.array([value if isinstance(value, number_type) else np.nan for value in values],
+                               dtype="float64")
+                with np.errstate(invalid="ignore"):
+                    in_bound = (raw >= getattr(hp, "lower", -np.inf)) & (raw <= getattr(hp, "upper", np.inf))
+                    if isinstance(hp, IntegerHyperparameter):
+                        in_bound &= raw == np.round(raw)
+                    col = np.full_like(raw, np.nan)
+                    if np.any(in_bound):
+                        col[in_bound] = hp._inverse_transform(raw[in_bound])
+            legal[rows] &= ~np.isnan(col)
+            X[rows, i] = col
+        # unknown hyperparameters
+        legal &= np.array([len(dict_) for dict_ in dicts]) == np.sum(~np.isnan(X), axis=1)
+        # given inactive hyperparameters are NaN after the deactivation
+        legal &= np.all(np.isnan(self.deactivate(X)) == np.isnan(X), axis=1)
+        legal &= self.is_valid(X)
+        return X, legal
+
+    def sample(self, n_samples=1, random_state=None, max_tries=100) -> np.ndarray:
+        '''
+        Draw ``n_samples`` valid config vectors from the prior distributions of the hyperparameters,
+        like ``ConfigurationSpace.sample_configuration`` but without building ``Configuration`` objects.
+        Rows that violate a forbidden clause are resampled.
+        '''
+        rng = check_random_state(random_state)
+        samples = []
+        n_valid = 0
+        for _ in range(max_tries):
+            n = n_samples - n_valid
+            X = np.zeros([n, self.n_dims], dtype="float64")
+            for i, hp in enumerate(self.hyperparameters):
+                X[:, i] = hp._sample(rng, n)
+            vectors, _ = self.process(X)
+            samples.append(vectors)
+            n_valid += vectors.shape[0]
+            if n_valid >= n_samples:
+                break
+        else:
+            raise ValueError(f"Failed to sample {n_samples} valid configurations after {max_tries} tries.")
+        return np.vstack(samples)
+
+    def get_one_exchange_neighbors(self, X: np.ndarray, random_state=None, num_neighbors=8, stdev=0.05):
+        '''
+        One-exchange neighbors of all the (deactivated, valid) rows of ``X`` at once, like
+        ``ConfigSpace.util.get_one_exchange_neighbourhood``: every active hyperparameter is changed alone,
+        categorical ones to each other choice, ordinal ones to the adjacent values and numerical ones
+        to ``num_neighbors`` Gaussian perturbations (``stdev`` in the vector space) truncated to [0, 1].
+        Newly activated hyperparameters take their default value, invalid and unchanged neighbors are dropped.
+
+        Returns the neighbors and, for each neighbor, the index of its row in ``X``.
+        '''
+        rng = check_random_state(random_state)
+        X = np.array(X, dtype="float64", ndmin=2)
+        neighbors = []
+        owners = []
+        for i in range(self.n_dims):
+            if self.is_constant[i]:
+                continue
+            rows = np.flatnonzero(~np.isnan(X[:, i]))
+            if rows.size == 0:
+                continue
+            value = X[rows, i][:, None]
+            if self.is_ordinal[i]:
+                values = value + np.array([-1, 1])
+            elif self.n_choices[i] > 0:
+                values = (value + np.arange(1, self.n_choices[i])) % self.n_choices[i]
+            else:
+                values = rng.normal(value, stdev, [rows.size, num_neighbors])
+                for _ in range(10):
+                    out_of_bound = (values < 0) | (values > 1)
+                    if not np.any(out_of_bound):
+                        break
+                    values[out_of_bound] = rng.normal(np.broadcast_to(value, values.shape)[out_of_bound], stdev)
+                np.clip(values, 0, 1, out=values)
+            neighbors_of_i = np.repeat(X[rows], values.shape[1], axis=0)
+            neighbors_of_i[:, i] = values.ravel()
+            neighbors.append(neighbors_of_i)
+            owners.append(np.repeat(rows, values.shape[1]))
+        if not neighbors:
+            return np.zeros([0, self.n_dims]), np.zeros([0], dtype="int64")
+        neighbors = np.vstack(neighbors)
+        owners = np.hstack(owners)
+        # out of range ordinal values are rejected by ``is_valid``
+        neighbors = np.where(np.isnan(neighbors), self.default_vector, neighbors)
+        neighbors, valid = self.process(neighbors)
+        owners = owners[valid]
+        origin = X[owners]
+        unchanged = np.all((neighbors == origin) | (np.isnan(neighbors) & np.isnan(origin)), axis=1)
+        neighbors, owners = neighbors[~unchanged], owners[~unchanged]
+        # e.g. quantized hyperparameters give the same neighbor several times
+        keys = np.ascontiguousarray(np.column_stack([owners, np.nan_to_num(neighbors, nan=-1)]))
+        keys = keys.view(np.dtype((np.void, keys.itemsize * keys.shape[1]))).ravel().tolist()
+        index = sorted({key: i for i, key in reversed(list(enumerate(keys)))}.values())
+        return neighbors[index], owners[index]
+
+    def materialize(self, vector: np.ndarray) -> Configuration:
+        return Configuration(self.config_space, vector=vector)
+
+    def materialize_all(self, X: np.ndarray) -> List[Configuration]:
+        return [self.materialize(x) for x in X]
@@ -3,23 +3,52 @@
 # @Author  : qichun tang
 # @Date    : 2020-12-14
 # @Contact    : qichun.tang@bupt.edu.cn
+import re
 from copy import copy
-from typing import Optional, Union
+from typing import Optional, Union, List
 
 import numpy as np
 import pandas as pd
 from ConfigSpace import ConfigurationSpace, Constant, CategoricalHyperparameter, Configuration, OrdinalHyperparameter
-from ConfigSpace.util import deactivate_inactive_hyperparameters
 from sklearn.preprocessing import LabelEncoder
 from tabular_nn.base_tnn import get_embed_dims
 
-from ultraopt.utils.config_space import deactivate
+from ultraopt.utils.compiled_space import CompiledConfigSpace
+from ultraopt.utils.obvs_store import reserve_rows, readonly_view
+
+
+def is_same_rows(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    return np.all((A == B) | (np.isnan(A) & np.isnan(B)), axis=1)
 
 
 class ConfigTransformer():
     def __init__(self, impute: Optional[float] = -1, encoder=None):
         self.impute = impute
         self.encoder = encoder
+        # bumped every time the output of the encoder changes
+        self.encoder_version = 0
+        self.init_cache()
+
+    def init_cache(self):
+        # cache_key -> {"encoder_version", "n", "raw", "encoded"}
+        self.caches = {}
+        self.encoder_lookup = None
+        self.encoder_lookup_version = None
+        self.n_encoded_rows = 0
+        self.n_cache_hits = 0
+
+    def cache_info(self):
+        return {
+            "encoded": self.n_encoded_rows,
+            "hits": self.n_cache_hits,
+            "numpy_path": self.encoder is None or self.get_encoder_lookup() is not None,
+        }
+
+    def __getstate__(self):
+        # caches are rebuilt lazily, do not pickle them
+        state = self.__dict__.copy()
+        state.update(caches={}, encoder_lookup=None, encoder_lookup_version=None)
+        return state
 
     def fit(self, config_space: ConfigurationSpace):
         mask = []
@@ -71,6 +100,7 @@ class ConfigTransformer():
         groups_str = [f"{parent}-{parent_value}" for parent, parent_value in zip(parents, parent_values)]
         group_encoder = LabelEncoder()
         groups = group_encoder.fit_transform(groups_str)
+        self.compiled_space = CompiledConfigSpace(config_space)
         self.is_child = is_child
         self.sequence_mapper = sequence_mapper
         self.is_ordinal_list = is_ordinal_list
@@ -105,15 +135,121 @@ class ConfigTransformer():
         df = pd.DataFrame(vectors, columns=self.hp_names)
         if self.encoder is not None:
             self.encoder.fit(df, losses)
+            # EmbeddingEncoder only retrains after enough new observations are accumulated
+            if getattr(self.encoder, "transform_matrix_status", "Updated") == "Updated":
+                self.encoder_version += 1
+
+    def transform(self, vectors: np.ndarray, cache_key=None) -> np.ndarray:
+        '''
+        If ``cache_key`` is given, ``vectors`` is treated as an append-only history (e.g. the observations
+        of a budget): rows that were encoded by a previous call with the same key and the same encoder
+        version are not encoded again, and a read-only array is returned.
+        '''
+        vectors = np.asarray(vectors, dtype="float64")
+        N = vectors.shape[0]
+        if cache_key is None or self.impute == "random_choice":
+            self.n_encoded_rows += N
+            return self._transform(vectors)
+        cache = self.caches.get(cache_key)
+        if cache is None or cache["encoder_version"] != self.encoder_version:
+            cache = {"encoder_version": self.encoder_version, "n": 0,
+                     "raw": np.zeros([0, vectors.shape[1]]), "encoded": None}
+            self.caches[cache_key] = cache
+        # number of leading rows that are the same as the cached ones. The history only grows or loses its
+        # last rows (e.g. the lies of a batch ask), so only the last shared row is compared, in O(d).
+        # If it differs (the lies were replaced by new observations), the unchanged prefix is searched
+        n_valid = min(cache["n"], N)
+        if n_valid > 0 and not is_same_rows(cache["raw"][n_valid - 1:n_valid], vectors[n_valid - 1:n_valid])[0]:
+            is_same = is_same_rows(cache["raw"][:n_valid], vectors[:n_valid])
+            n_valid = int(np.argmin(is_same))
+        if n_valid < N:
+            encoded = self._transform(vectors[n_valid:])
+            if cache["encoded"] is None:
+                cache["encoded"] = np.zeros([0, encoded.shape[1]])
+            cache["raw"] = reserve_rows(cache["raw"], N)
+            cache["encoded"] = reserve_rows(cache["encoded"], N)
+            cache["raw"][n_valid:N] = vectors[n_valid:]
+            cache["encoded"][n_valid:N] = encoded
+        cache["n"] = N
+        self.n_cache_hits += n_valid
+        self.n_encoded_rows += N - n_valid
+        return readonly_view(cache["encoded"][:N])
+
+    def get_encoder_lookup(self):
+        if self.encoder_lookup_version != self.encoder_version:
+            self.encoder_lookup = self.build_encoder_lookup()
+            self.encoder_lookup_version = self.encoder_version
+        return self.encoder_lookup
+
+    def build_encoder_lookup(self):
+        '''
+        Both EmbeddingEncoder and EquidistanceEncoder encode each categorical column independently,
+        so their output can be tabulated by encoding every category (and NaN) once.
+        Returns a list with one table per column (None for pass-through columns),
+        or None if the output layout of the encoder is not understood.
+        '''
+        hp_names = self.hp_names.tolist()
+        encoded_cols = set(self.encoder.cols or [])
+        n_choices_list = list(self.n_choices_list)
+        n_rows = max([n_choices for col, n_choices in zip(hp_names, n_choices_list) if col in encoded_cols],
+                     default=0) + 1
+        probe = np.zeros([n_rows, len(hp_names)])
+        for j, (col, n_choices) in enumerate(zip(hp_names, n_choices_list)):
+            if col in encoded_cols:
+                probe[:n_choices, j] = np.arange(n_choices)
+                probe[n_choices:, j] = np.nan
+        try:
+            output = self.encoder.transform(pd.DataFrame(probe, columns=self.hp_names))
+            output_cols = [str(col) for col in output.columns]
+            output = np.asarray(output, dtype="float64")
+        except Exception:
+            return None
+        lookup = []
+        pos = 0
+        for col, n_choices in zip(hp_names, n_choices_list):
+            if col in encoded_cols:
+                pattern = re.compile(rf"^{re.escape(col)}_\d+_*$")
+                width = 0
+                while pos + width < len(output_cols) and pattern.match(output_cols[pos + width]):
+                    width += 1
+                if width == 0:
+                    return None
+                # the last row is the encoding of NaN
+                lookup.append(output[:n_choices + 1, pos:pos + width])
+                pos += width
+            else:
+                if pos >= len(output_cols) or output_cols[pos] != col:
+                    return None
+                lookup.append(None)
+                pos += 1
+        if pos != len(output_cols) or \
+                not np.allclose(self.lookup_transform(probe, lookup), output, equal_nan=True):
+            return None
+        return lookup
+
+    @staticmethod
+    def lookup_transform(vectors, lookup):
+        blocks = []
+        for j, table in enumerate(lookup):
+            col = vectors[:, j]
+            if table is None:
+                blocks.append(col[:, None])
+            else:
+                idx = np.where(np.isnan(col), table.shape[0] - 1, col).astype("int64")
+                blocks.append(table[idx])
+        return np.hstack(blocks)
 
-    def transform(self, vectors: np.ndarray) -> np.ndarray:
-        vectors = np.array(vectors)
+    def _transform(self, vectors: np.ndarray) -> np.ndarray:
         vectors = vectors[:, self.mask]
         if self.encoder is not None:
-            df = pd.DataFrame(vectors, columns=self.hp_names)
-            vectors = self.encoder.transform(df)
-            if not isinstance(vectors, np.ndarray):
-                vectors = np.array(vectors)
+            lookup = self.get_encoder_lookup()
+            if lookup is not None:
+                vectors = self.lookup_transform(vectors, lookup)
+            else:
+                df = pd.DataFrame(vectors, columns=self.hp_names)
+                vectors = self.encoder.transform(df)
+                if not isinstance(vectors, np.ndarray):
+                    vectors = np.array(vectors)
         if self.impute is not None:
             if self.impute == "random_choice":
                 vectors = self.impute_conditional_data(vectors)
@@ -121,7 +257,20 @@ class ConfigTransformer():
                 vectors[np.isnan(vectors)] = float(self.impute)
         return vectors
 
-    def inverse_transform(self, array: np.ndarray, return_vector=False) -> Union[np.ndarray, None, Configuration]:
+    def inverse_transform(self, array: np.ndarray, return_vector=False) -> Union[np.ndarray, List[Configuration]]:
+        if return_vector:
+            return self.inverse_transform_raw(array)
+        vectors, _ = self.inverse_transform_vectors(array)
+        return self.compiled_space.materialize_all(vectors)
+
+    def inverse_transform_vectors(self, array: np.ndarray):
+        '''
+        Returns the config vectors (deactivated and canonical) of the valid rows, and the mask of valid rows.
+        Use ``compiled_space.materialize`` to get the ``Configuration`` of a vector.
+        '''
+        return self.compiled_space.process(self.inverse_transform_raw(array))
+
+    def inverse_transform_raw(self, array: np.ndarray) -> np.ndarray:
         if self.encoder is not None:
             array = self.encoder.inverse_transform(array)
         array = np.array(array)
@@ -135,20 +284,7 @@ class ConfigTransformer():
         N, M = array.shape
         result = np.zeros([N, len(self.mask)])
         result[:, self.mask] = array
-        if return_vector:
-            return result
-        configs = []
-        for i in range(N):
-            try:
-                config = deactivate(self.config_space, result[i, :])
-                config = deactivate_inactive_hyperparameters(
-                    configuration_space=self.config_space,
-                    configuration=config
-                )
-                configs.append(config)
-            except Exception as e:
-                pass
-        return configs
+        return result
 
     def impute_conditional_data(self, array):
         # copy from HpBandSter
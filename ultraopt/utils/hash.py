@@ -4,11 +4,13 @@
 # @Date    : 2020-12-15
 # @Contact    : qichun.tang@bupt.edu.cn
 import hashlib
+import struct
+import weakref
 from copy import deepcopy
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, List
 
 import numpy as np
-from ConfigSpace import Configuration
+from ConfigSpace import Configuration, ConfigurationSpace
 from scipy.sparse import issparse
 
 
@@ -57,10 +59,93 @@ def get_hash_of_dict(dict_, m=None):
     return m.hexdigest()
 
 
-def get_hash_of_config(config: Union[Configuration, Dict[str, Any]], m=None):
-    if m is None:
-        m = hashlib.md5()
+def get_keys_of_vectors(vectors, decimals=10) -> List[bytes]:
+    '''
+    Canonical byte keys of config vectors, used to detect duplicated configs in O(1).
+    Inactive hyperparameters (NaN) are mapped to -1, values are rounded to ``decimals`` and
+    -0.0 is folded into 0.0, so vectors that only differ by float noise share the same key.
+    '''
+    vectors = np.array(vectors, dtype="float64", ndmin=2)
+    vectors[np.isnan(vectors)] = -1
+    vectors = np.ascontiguousarray(np.round(vectors, decimals) + 0.0)
+    return [row.tobytes() for row in vectors]
+
+
+def get_key_of_vector(vector, decimals=10) -> bytes:
+    '''
+    The key of ``get_keys_of_vectors`` for one vector, computed with Python floats (NumPy's overhead
+    dominates for a single vector): ``round`` rounds half to even like ``np.round``.
+    '''
+    if not isinstance(vector, list):
+        vector = np.asarray(vector, dtype="float64")
+        vector = (vector[0] if vector.ndim > 1 else vector).tolist()
+    scale = 10.0 ** decimals
+    values = [-1.0 if value != value else round(value * scale) / scale for value in vector]
+    return struct.pack(f"{len(values)}d", *values)
+
+
+# id of a config space -> (weak reference to it, its digest, name -> (index, hyperparameter)).
+# Nothing is cached on the config space itself, ``ConfigurationSpace.__eq__`` compares the attributes
+# and ``hash(config_space)`` formats the whole space, so it can not be the key of a ``WeakKeyDictionary``.
+# The entry of a config space is deleted when it is garbage collected.
+config_space_cache = {}
+
+
+def evict_config_space_info(ref, key):
+    info = config_space_cache.get(key)
+    if info is not None and info[0] is ref:
+        del config_space_cache[key]
+
+
+def get_config_space_info(config_space: ConfigurationSpace):
+    key = id(config_space)
+    info = config_space_cache.get(key)
+    if info is None or info[0]() is not config_space:
+        digest = hashlib.blake2b(str(config_space).encode("utf-8"), digest_size=16).digest()
+        name2idx_hp = {hp.name: (idx, hp) for idx, hp in enumerate(config_space.get_hyperparameters())}
+        info = (weakref.ref(config_space, lambda ref: evict_config_space_info(ref, key)), digest, name2idx_hp)
+        config_space_cache[key] = info
+    return info
+
+
+def get_hash_of_config_space(config_space: ConfigurationSpace) -> bytes:
+    '''
+    Digest of the description of ``config_space`` (hyperparameters, conditions and forbidden clauses),
+    stable across processes. Computed once per config space.
+    '''
+    return get_config_space_info(config_space)[1]
+
+
+def get_vector_of_dict(dict_: Dict[str, Any], config_space: ConfigurationSpace) -> List[float]:
+    '''The vector ``Configuration(config_space, values=dict_).get_array()`` would have (as a list), without validation.'''
+    name2idx_hp = get_config_space_info(config_space)[2]
+    vector = [np.nan] * len(name2idx_hp)
+    for name, value in dict_.items():
+        idx, hp = name2idx_hp[name]
+        vector[idx] = float(hp._inverse_transform(value))
+    return vector
+
+
+def get_hashes_of_vectors(vectors, config_space: ConfigurationSpace) -> List[str]:
+    '''
+    IDs of the configs of ``config_space`` given by their vectors: a 128 bits BLAKE2 digest of the
+    digest of the config space and the canonical key of the vector (see ``get_keys_of_vectors``).
+    '''
+    return [get_hash_of_key(key, config_space) for key in get_keys_of_vectors(vectors)]
+
+
+def get_hash_of_key(key: bytes, config_space: ConfigurationSpace) -> str:
+    return hashlib.blake2b(get_hash_of_config_space(config_space) + key, digest_size=16).hexdigest()
+
+
+def get_hash_of_config(config: Union[Configuration, Dict[str, Any]], config_space: ConfigurationSpace = None):
+    '''
+    ID of a config, keyed on its vector and its config space (``config_space`` is needed for a dict),
+    so a config has the same ID as a dict or as a ``Configuration``, in every process.
+    '''
     assert isinstance(config, (dict, Configuration))
     if isinstance(config, Configuration):
-        config = config.get_dictionary()
-    return get_hash_of_dict(config, m)
+        return get_hash_of_key(get_key_of_vector(config.get_array()), config.configuration_space)
+    if config_space is None:
+        raise ValueError("The config space of a config given as a dict is needed to get its ID.")
+    return get_hash_of_key(get_key_of_vector(get_vector_of_dict(config, config_space)), config_space)
@@ -11,7 +11,7 @@ ERR_LOSS = 1 << 31
 
 class LossTransformer():
     def fit_transform(self, y, *args):
-        y: np.ndarray = check_array(y, ensure_2d=False)
+        y: np.ndarray = check_array(y, ensure_2d=False, copy=True)
         # cutoff
         # fixme: all of y < ERR_LOSS
         y[y >= ERR_LOSS] = y[y < ERR_LOSS].max() + 0.1
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author  : qichun tang
+# @Contact    : qichun.tang@bupt.edu.cn
+from typing import List
+
+import numpy as np
+from ConfigSpace import Configuration
+
+from ultraopt.utils.hash import get_key_of_vector, get_keys_of_vectors
+
+
+def readonly_view(array: np.ndarray) -> np.ndarray:
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def reserve_rows(buffer: np.ndarray, n_required) -> np.ndarray:
+    '''Returns ``buffer`` if it can hold ``n_required`` rows, otherwise a copy with doubled capacity.'''
+    capacity = buffer.shape[0]
+    if n_required <= capacity:
+        return buffer
+    while capacity < n_required:
+        capacity = max(capacity * 2, 1)
+    new_buffer = np.zeros((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+    new_buffer[:buffer.shape[0]] = buffer
+    return new_buffer
+
+
+class VectorConfigs():
+    '''
+    The configs of observations loaded as vectors (e.g. memory-mapped from a columnar result),
+    a ``Configuration`` is only built when it is accessed. Configs appended later are kept as they are.
+    '''
+
+    def __init__(self, config_space, vectors: np.ndarray, origins=None):
+        self.config_space = config_space
+        self.vectors = vectors
+        self.origins = origins
+        self.appended: List[Configuration] = []
+
+    def __len__(self):
+        return len(self.vectors) + len(self.appended)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if item >= len(self.vectors):
+            return self.appended[item - len(self.vectors)]
+        config = Configuration(self.config_space, vector=self.vectors[item])
+        if self.origins is not None:
+            config.origin = self.origins[item]
+        return config
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __delitem__(self, item: slice):
+        start = item.indices(len(self))[0]
+        if start >= len(self.vectors):
+            del self.appended[start - len(self.vectors):]
+        else:
+            self.vectors = self.vectors[:start]
+            self.appended = []
+
+    def append(self, config: Configuration):
+        self.appended.append(config)
+
+    def extend(self, configs: List[Configuration]):
+        self.appended.extend(configs)
+
+
+class ObservationStore():
+    '''
+    Observations of one budget, kept in preallocated arrays that grow geometrically.
+
+    ``store["losses"]``, ``store["vectors"]`` and ``store["locks"]`` are read-only views of the
+    filled part of the buffers, so reading the history never copies it. ``store["configs"]``
+    is the list of observed ``Configuration`` objects, indexed like the losses.
+
+    ``lock_keys`` holds the canonical keys (see ``get_keys_of_vectors``) of all locked vectors,
+    so duplicate detection is a set lookup.
+    '''
+    keys_ = ("losses", "configs", "vectors", "locks")
+
+    def __init__(self, initial_capacity=64):
+        self.initial_capacity = initial_capacity
+        self.n_dims = None
+        self.n_obvs = 0
+        self.n_locks = 0
+        self._losses = np.zeros([0], dtype="float64")
+        self._vectors = None
+        self._locks = None
+        self._configs: List[Configuration] = []
+        self.lock_keys = set()
+
+    @classmethod
+    def from_dict(cls, obvs: dict):
+        store = cls()
+        for config, vector, loss in zip(obvs["configs"], obvs["vectors"], obvs["losses"]):
+            store.append(config, vector, loss)
+        for lock in obvs["locks"]:
+            store.add_lock(lock)
+        return store
+
+    @classmethod
+    def from_arrays(cls, config_space, vectors: np.ndarray, losses: np.ndarray, origins=None):
+        '''
+        Wraps existing arrays (which can be memory-mapped), nothing is copied until an observation is
+        appended, and the ``Configuration`` objects are only built when they are accessed.
+        The observed vectors are locked.
+        '''
+        store = cls()
+        if len(losses) == 0:
+            return store
+        store.n_dims = vectors.shape[1]
+        store._vectors = store._locks = vectors
+        store._losses = losses
+        store.n_obvs = store.n_locks = len(losses)
+        store._configs = VectorConfigs(config_space, vectors, origins)
+        store.lock_keys = set(get_keys_of_vectors(vectors))
+        return store
+
+    def _init_buffers(self, n_dims):
+        self.n_dims = n_dims
+        self._vectors = np.zeros([self.initial_capacity, n_dims], dtype="float64")
+        self._locks = np.zeros([self.initial_capacity, n_dims], dtype="float64")
+        self._losses = np.zeros([self.initial_capacity], dtype="float64")
+
+    def _check_vector(self, vector):
+        vector = np.asarray(vector, dtype="float64")
+        if self.n_dims is None:
+            self._init_buffers(vector.shape[-1])
+        return vector
+
+    def append(self, config: Configuration, vector: np.ndarray, loss: float):
+        vector = self._check_vector(vector)
+        n = self.n_obvs
+        self._vectors = reserve_rows(self._vectors, n + 1)
+        self._losses = reserve_rows(self._losses, n + 1)
+        self._vectors[n] = vector
+        self._losses[n] = loss
+        self._configs.append(config)
+        self.n_obvs = n + 1
+
+    def extend(self, configs: List[Configuration], vectors: np.ndarray, losses: np.ndarray, lock=True):
+        '''Appends many observations at once (and locks their vectors), the buffers grow at most once.'''
+        vectors = np.array(vectors, dtype="float64", ndmin=2)
+        if len(configs) == 0:
+            return
+        self._check_vector(vectors[0])
+        n = self.n_obvs
+        self._vectors = reserve_rows(self._vectors, n + len(configs))
+        self._losses = reserve_rows(self._losses, n + len(configs))
+        self._vectors[n:n + len(configs)] = vectors
+        self._losses[n:n + len(configs)] = losses
+        self._configs.extend(configs)
+        self.n_obvs = n + len(configs)
+        if lock:
+            n = self.n_locks
+            self._locks = reserve_rows(self._locks, n + len(configs))
+            self._locks[n:n + len(configs)] = vectors
+            self.n_locks = n + len(configs)
+            self.lock_keys.update(get_keys_of_vectors(vectors))
+
+    def truncate(self, n_obvs):
+        '''Drop the observations after the first ``n_obvs`` ones (e.g. the lies of a batch ask), locks are kept.'''
+        if n_obvs < self.n_obvs:
+            self.n_obvs = n_obvs
+            del self._configs[n_obvs:]
+
+    def add_lock(self, vector: np.ndarray):
+        vector = self._check_vector(vector)
+        n = self.n_locks
+        self._locks = reserve_rows(self._locks, n + 1)
+        self._locks[n] = vector
+        self.n_locks = n + 1
+        self.lock_keys.add(get_key_of_vector(vector))
+
+    @property
+    def losses(self) -> np.ndarray:
+        return readonly_view(self._losses[:self.n_obvs])
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            return np.zeros([0, 0], dtype="float64")
+        return readonly_view(self._vectors[:self.n_obvs])
+
+    @property
+    def locks(self) -> np.ndarray:
+        if self._locks is None:
+            return np.zeros([0, 0], dtype="float64")
+        return readonly_view(self._locks[:self.n_locks])
+
+    @property
+    def configs(self) -> List[Configuration]:
+        return self._configs
+
+    def __getitem__(self, item):
+        if item not in self.keys_:
+            raise KeyError(item)
+        return getattr(self, item)
+
+    def __len__(self):
+        return self.n_obvs
+
+    def keys(self):
+        return list(self.keys_)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys_]
+
+    def __getstate__(self):
+        # do not pickle the unused capacity of the buffers
+        state = self.__dict__.copy()
+        state["_losses"] = self._losses[:self.n_obvs].copy()
+        if self._vectors is not None:
+            state["_vectors"] = self._vectors[:self.n_obvs].copy()
+            state["_locks"] = self._locks[:self.n_locks].copy()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(n_obvs={self.n_obvs}, n_locks={self.n_locks}, n_dims={self.n_dims})"